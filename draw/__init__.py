@@ -1,2 +1,14 @@
+try:
+    import chainer
+except ImportError:
+    # Without Chainer only the PyTorch backend (draw.nn.pytorch), data and
+    # metrics can be used
+    chainer = None
+
+if chainer is not None:
+    from . import backend
 from . import nn
-from . import data
\ No newline at end of file
+from . import data
+if chainer is not None:
+    from . import codec
+from . import metrics
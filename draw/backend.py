@@ -0,0 +1,64 @@
+import numpy as np
+import chainer
+from chainer.backends import cuda
+
+# CuPy is optional. Everything here goes through chainer.backends.cuda, which
+# imports it only if it is installed, so the NumPy path works without CUDA.
+
+
+def gpu_available():
+    return cuda.available
+
+
+def get_cupy():
+    if not cuda.available:
+        raise RuntimeError("CuPy is not available")
+    return cuda.cupy
+
+
+def get_array_module(*args):
+    return chainer.backend.get_array_module(*args)
+
+
+# Returns the array module for the device and makes it current.
+# A negative id selects the CPU.
+def get_xp(gpu_device):
+    if gpu_device < 0:
+        return np
+    cupy = get_cupy()
+    cuda.get_device_from_id(gpu_device).use()
+    return cupy
+
+
+# Random generator of xp seeded with `seed`. Both standard_normal(shape,
+# dtype) of NumPy's Generator and of CuPy's RandomState draw float32 directly.
+def random_generator(xp, seed):
+    if xp is np:
+        return np.random.default_rng(seed)
+    return xp.random.RandomState(seed)
+
+
+def is_gpu_array(array):
+    return cuda.available and isinstance(array, cuda.ndarray)
+
+
+def to_gpu(array, device=None):
+    if is_gpu_array(array) and (device is None
+                                or array.device.id == device):
+        return array
+    return cuda.to_gpu(array, device=device)
+
+
+def to_cpu(array):
+    if isinstance(array, np.ndarray):
+        return array
+    return cuda.to_cpu(array)
+
+
+def as_float32(array):
+    return array.astype(np.float32, copy=False)
+
+
+def synchronize(xp):
+    if xp is not np:
+        cuda.Stream.null.synchronize()
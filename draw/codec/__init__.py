@@ -0,0 +1,3 @@
+from . import rans
+from .bitstream import Bitstream
+from .quantization import LatentQuantizer
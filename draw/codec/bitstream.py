@@ -0,0 +1,64 @@
+import struct
+
+# Layout:
+#   header  magic, number of steps, number of rANS lanes, quantization step
+#           and max index of the LatentQuantizer
+#   chunks  for every generation step, its length (uint32) and the rANS
+#           message of its latents
+# A bitstream truncated after any chunk is a valid bitstream of fewer steps.
+magic = b"DRAW"
+header = struct.Struct("<4sHHfH")
+chunk_header = struct.Struct("<I")
+
+
+class Bitstream():
+    def __init__(self, chunks, num_lanes, step, max_index):
+        self.chunks = list(chunks)
+        self.num_lanes = num_lanes
+        self.step = step
+        self.max_index = max_index
+
+    @property
+    def num_steps(self):
+        return len(self.chunks)
+
+    # Size in bytes of the first `num_steps` steps
+    def size(self, num_steps=None):
+        chunks = self.chunks[:num_steps]
+        return header.size + sum(chunk_header.size + len(chunk)
+                                 for chunk in chunks)
+
+    def truncate(self, num_steps):
+        return Bitstream(self.chunks[:num_steps], self.num_lanes, self.step,
+                         self.max_index)
+
+    def to_bytes(self):
+        data = [
+            header.pack(magic, self.num_steps, self.num_lanes, self.step,
+                        self.max_index)
+        ]
+        for chunk in self.chunks:
+            data.append(chunk_header.pack(len(chunk)))
+            data.append(chunk)
+        return b"".join(data)
+
+    # Chunks cut short at the end of `data` are dropped
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < header.size:
+            raise ValueError("bitstream is too short")
+        tag, num_steps, num_lanes, step, max_index = header.unpack_from(data)
+        if tag != magic:
+            raise ValueError("not a bitstream")
+        offset = header.size
+        chunks = []
+        for _ in range(num_steps):
+            if offset + chunk_header.size > len(data):
+                break
+            length, = chunk_header.unpack_from(data, offset)
+            offset += chunk_header.size
+            if offset + length > len(data):
+                break
+            chunks.append(data[offset:offset + length])
+            offset += length
+        return cls(chunks, num_lanes, step, max_index)
@@ -0,0 +1,45 @@
+import math
+
+import numpy as np
+
+from .. import backend
+from . import rans
+
+
+def standard_normal_cdf(x):
+    return 0.5 * (1 + math.erf(x / math.sqrt(2)))
+
+
+# A posterior mean is coded as the index of the nearest point of a grid with
+# a spacing of `step` prior standard deviations around the prior mean. Under
+# the prior the offset then has the same distribution for every latent, a
+# discretized standard normal, so all latents share one static table and the
+# decoder never needs the prior to decode the indices. Offsets beyond
+# `max_deviation` standard deviations are clipped.
+# The step is rounded to float32, which is how it is stored in a bitstream.
+class LatentQuantizer():
+    def __init__(self,
+                 step=1.0,
+                 max_deviation=8.0,
+                 max_index=None,
+                 precision=16):
+        self.step = float(np.float32(step))
+        if max_index is None:
+            max_index = int(math.ceil(max_deviation / self.step))
+        self.max_index = max_index
+        edges = [(k + 0.5) * self.step
+                 for k in range(-self.max_index, self.max_index)]
+        cdf = [0.0] + [standard_normal_cdf(edge) for edge in edges] + [1.0]
+        self.table = rans.FrequencyTable(np.diff(cdf), precision=precision)
+
+    # Returns the symbols (indices into self.table) of mean_z_q
+    def quantize(self, mean_z_q, mean_z_p, ln_var_z_p):
+        xp = backend.get_array_module(mean_z_q)
+        offset = (mean_z_q - mean_z_p) / (self.step * xp.exp(0.5 * ln_var_z_p))
+        offset = xp.clip(xp.rint(offset), -self.max_index, self.max_index)
+        return offset.astype(np.int64) + self.max_index
+
+    def dequantize(self, symbols, mean_z_p, ln_var_z_p):
+        xp = backend.get_array_module(mean_z_p)
+        offset = (symbols - self.max_index).astype(mean_z_p.dtype)
+        return mean_z_p + offset * self.step * xp.exp(0.5 * ln_var_z_p)
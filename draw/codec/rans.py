@@ -0,0 +1,134 @@
+import math
+
+import numpy as np
+
+# Interleaved rANS (https://arxiv.org/abs/1311.2540) over a batch of
+# independent messages, one per image. Every message has `num_lanes` coder
+# states that are updated together, so one NumPy operation codes
+# batch_size * num_lanes symbols. States are 32-bit and are renormalized by
+# 16-bit words. A message is the final states (uint32) followed by the words
+# (uint16).
+state_lower_bound = 1 << 16
+word_bits = 16
+word_mask = (1 << word_bits) - 1
+
+
+class FrequencyTable():
+    # Quantizes `probabilities` to integer frequencies that sum to
+    # 2**precision. Every symbol keeps a frequency of at least 1.
+    def __init__(self, probabilities, precision=16):
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+        probabilities = probabilities / probabilities.sum()
+        if precision > word_bits:
+            raise ValueError("precision must be at most {}, got {}".format(
+                word_bits, precision))
+        total = 1 << precision
+        if probabilities.size > total:
+            raise ValueError(
+                "{} symbols do not fit in a table of precision {}".format(
+                    probabilities.size, precision))
+        freqs = np.maximum(
+            np.floor(probabilities * total).astype(np.int64), 1)
+        freqs[np.argmax(freqs)] += total - freqs.sum()
+        self.precision = precision
+        self.freqs = freqs.astype(np.uint64)
+        self.starts = np.concatenate(([0], np.cumsum(freqs)[:-1])).astype(
+            np.uint64)
+        self.symbols = np.repeat(
+            np.arange(freqs.size, dtype=np.int64), freqs)
+
+    def __len__(self):
+        return self.freqs.size
+
+    # Ideal code length of every symbol in bits
+    def code_lengths(self):
+        return self.precision - np.log2(self.freqs.astype(np.float64))
+
+
+def lane_shape(num_symbols, num_lanes):
+    return (math.ceil(num_symbols / num_lanes), num_lanes)
+
+
+# symbols: (batch_size, num_symbols) indices into `table`
+# Returns one message (bytes) per row
+def encode(symbols, table, num_lanes):
+    batch_size, num_symbols = symbols.shape
+    num_rows, _ = lane_shape(num_symbols, num_lanes)
+    padded = np.zeros((batch_size, num_rows * num_lanes), dtype=np.int64)
+    padded[:, :num_symbols] = symbols
+    padded = padded.reshape(batch_size, num_rows, num_lanes)
+
+    precision = np.uint64(table.precision)
+    x_max_factor = np.uint64(
+        (state_lower_bound >> table.precision) << word_bits)
+    states = np.full((batch_size, num_lanes),
+                     state_lower_bound,
+                     dtype=np.uint64)
+    # Every push emits at most one word
+    words = np.empty((batch_size, num_rows * num_lanes), dtype=np.uint16)
+    num_words = np.zeros(batch_size, dtype=np.int64)
+
+    # The decoder pops the rows in order, so they are pushed in reverse
+    for row in reversed(range(num_rows)):
+        s = padded[:, row]
+        freqs = table.freqs[s]
+        overflow = states >= x_max_factor * freqs
+        if overflow.any():
+            positions = num_words[:, None] + np.cumsum(overflow, axis=1) - 1
+            batch_indices = np.nonzero(overflow)[0]
+            words[batch_indices, positions[overflow]] = states[overflow] & np.uint64(
+                word_mask)
+            states[overflow] >>= np.uint64(word_bits)
+            num_words += overflow.sum(axis=1)
+        states = ((states // freqs) << precision) + states % freqs + table.starts[s]
+
+    messages = []
+    for b in range(batch_size):
+        messages.append(states[b].astype("<u4").tobytes() +
+                        words[b, :num_words[b]].astype("<u2").tobytes())
+    return messages
+
+
+# Inverse of encode. Returns (batch_size, num_symbols) symbol indices.
+def decode(messages, table, num_symbols, num_lanes):
+    batch_size = len(messages)
+    num_rows, _ = lane_shape(num_symbols, num_lanes)
+    head_size = 4 * num_lanes
+    for message in messages:
+        if len(message) < head_size or (len(message) - head_size) % 2:
+            raise ValueError("corrupted message")
+    states = np.stack([
+        np.frombuffer(message[:head_size], dtype="<u4")
+        for message in messages
+    ]).astype(np.uint64)
+    num_words = np.array(
+        [(len(message) - head_size) // 2 for message in messages],
+        dtype=np.int64)
+    words = np.zeros((batch_size, max(num_words.max(), 1)), dtype=np.uint64)
+    for b, message in enumerate(messages):
+        words[b, :num_words[b]] = np.frombuffer(
+            message[head_size:], dtype="<u2")
+
+    precision = np.uint64(table.precision)
+    cumulative_mask = np.uint64((1 << table.precision) - 1)
+    symbols = np.empty((batch_size, num_rows, num_lanes), dtype=np.int64)
+    for row in range(num_rows):
+        cumulative = states & cumulative_mask
+        s = table.symbols[cumulative.astype(np.int64)]
+        states = table.freqs[s] * (states >> precision) + cumulative - table.starts[s]
+        underflow = states < np.uint64(state_lower_bound)
+        if underflow.any():
+            counts = underflow.sum(axis=1)
+            if np.any(counts > num_words):
+                raise ValueError("corrupted message")
+            positions = (num_words - counts)[:, None] + np.cumsum(
+                underflow, axis=1) - 1
+            batch_indices = np.nonzero(underflow)[0]
+            states[underflow] = (states[underflow] << np.uint64(word_bits)
+                                 ) | words[batch_indices, positions[underflow]]
+            num_words -= counts
+        symbols[:, row] = s
+
+    if np.any(num_words != 0) or np.any(states != state_lower_bound):
+        raise ValueError("corrupted message")
+    return symbols.reshape(batch_size, -1)[:, :num_symbols]
@@ -1,3 +1,8 @@
 from .dataset import Dataset
-from .sampler import Sampler
-from .iterator import Iterator
\ No newline at end of file
+from .ingest import ingest_image_directory
+from .packed import PackedDataset, PackedDatasetWriter, build_packed_dataset
+from .sampler import Sampler, DistributedSampler
+from .iterator import Iterator
+from .prefetch import PrefetchIterator
+from .streaming import ShardedDataset, StreamingIterator
+from .transforms import Dequantize
\ No newline at end of file
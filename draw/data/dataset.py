@@ -6,6 +6,17 @@ class Dataset():
     def __init__(self, data):
         self.data = data
 
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def take(self, indices, out=None):
+        return np.take(self.data, indices, axis=0, out=out)
+
     def __getitem__(self, indices):
         return self.data[indices]
 
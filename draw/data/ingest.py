@@ -0,0 +1,158 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .packed import PackedDataset, PackedDatasetWriter
+
+image_extensions = (".png", ".jpg", ".jpeg")
+
+
+def list_images(directory):
+    paths = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.lower().endswith(image_extensions):
+                paths.append(
+                    os.path.relpath(os.path.join(root, filename), directory))
+    paths.sort()
+    return paths
+
+
+def hash_file(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+# Scales the shorter side to fit `image_size` (height, width), crops the
+# center and returns uint8 NHWC: one image, or two with `flip` augmentation.
+def decode_image(path, image_size, flip=False):
+    from PIL import Image
+
+    height, width = image_size
+    try:
+        with Image.open(path) as image:
+            image = image.convert("RGB")
+            scale = max(width / image.width, height / image.height)
+            resized_width = max(width, int(round(image.width * scale)))
+            resized_height = max(height, int(round(image.height * scale)))
+            image = image.resize((resized_width, resized_height),
+                                 Image.BICUBIC)
+            left = (resized_width - width) // 2
+            top = (resized_height - height) // 2
+            image = image.crop((left, top, left + width, top + height))
+            array = np.asarray(image, dtype=np.uint8)
+    except (OSError, ValueError) as error:
+        print("skipping {}: {}".format(path, error))
+        return None
+    if flip:
+        return np.stack((array, array[:, ::-1]))
+    return array[None, ...]
+
+
+def _decode(args):
+    return decode_image(*args)
+
+
+def stat_file(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+# Decodes every PNG/JPEG under `image_directory` on a process pool and writes
+# the packed dataset to `output_directory`. Every index entry records the
+# size, modification time and SHA-1 of its file. When the same directory is
+# ingested again with the same settings, only files whose size or
+# modification time changed are hashed and only content that is not in the
+# existing store is decoded. If every file of the existing store is still
+# there with the same content, the other files are appended to the store;
+# otherwise the store is rewritten, copying unchanged records from the
+# previous one.
+def ingest_image_directory(image_directory,
+                           output_directory,
+                           image_size=(64, 64),
+                           flip=False,
+                           num_workers=None):
+    metadata = {"image_size": list(image_size), "flip": flip}
+    paths = list_images(image_directory)
+    full_paths = [os.path.join(image_directory, path) for path in paths]
+    stats = [stat_file(path) for path in full_paths]
+
+    previous_files = []
+    cache = {}
+    cached_images = None
+    index_path = os.path.join(output_directory, PackedDataset.index_filename)
+    if os.path.isfile(index_path):
+        previous = PackedDataset(output_directory)
+        if previous.metadata == metadata:
+            previous_files = previous.files
+            cached_images = previous.images
+            for file in previous_files:
+                if "digest" in file:
+                    cache[file["digest"]] = file
+    files_by_name = {file["name"]: file for file in previous_files}
+
+    digests = [None] * len(paths)
+    changed = []
+    for i, (path, stat) in enumerate(zip(paths, stats)):
+        file = files_by_name.get(path)
+        if file is not None and "digest" in file and file.get("stat") == stat:
+            digests[i] = file["digest"]
+        else:
+            changed.append(i)
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        chunksize = max(1, len(changed) // (4 * (num_workers or 8)))
+        for i, digest in zip(
+                changed,
+                executor.map(
+                    hash_file, [full_paths[i] for i in changed],
+                    chunksize=chunksize)):
+            digests[i] = digest
+
+        current = dict(zip(paths, zip(digests, stats)))
+        append = len(previous_files) > 0 and all(
+            file["name"] in current
+            and file.get("digest") == current[file["name"]][0]
+            for file in previous_files)
+        if append:
+            targets = [
+                i for i, path in enumerate(paths) if path not in files_by_name
+            ]
+        else:
+            targets = range(len(paths))
+
+        missing = [(full_paths[i], image_size, flip) for i in targets
+                   if digests[i] not in cache]
+        chunksize = max(1, len(missing) // (4 * (num_workers or 8)))
+        decoded = executor.map(_decode, missing, chunksize=chunksize)
+
+        num_cached = 0
+        with PackedDatasetWriter(
+                output_directory, metadata, append=append) as writer:
+            for file in writer.files:
+                file["stat"] = current[file["name"]][1]
+            for i in targets:
+                digest = digests[i]
+                if digest in cache:
+                    file = cache[digest]
+                    images = cached_images[file["offset"]:file["offset"] +
+                                           file["count"]]
+                    # The writer expects NHWC
+                    images = images.transpose((0, 2, 3, 1))
+                    num_cached += 1
+                else:
+                    images = next(decoded)
+                    if images is None:
+                        continue
+                writer.append(
+                    images, name=paths[i], digest=digest, stat=stats[i])
+
+    print("ingested {} files ({} hashed, {} decoded, {} copied, {})".format(
+        len(paths), len(changed), len(missing), num_cached,
+        "appended" if append else "rewritten"))
+    return PackedDataset(output_directory)
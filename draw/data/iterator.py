@@ -1,20 +1,57 @@
+import numpy as np
+
 from .sampler import Sampler
 
 class Iterator:
-    def __init__(self, dataset, batch_size, drop_last=True):
-        self.sampler = Sampler(dataset)
+    def __init__(self,
+                 dataset,
+                 batch_size,
+                 drop_last=True,
+                 sort_indices=False,
+                 sampler=None):
+        self.sampler = Sampler(dataset) if sampler is None else sampler
         self.drop_last = drop_last
         self.batch_size = batch_size
+        # Sorting the indices of each batch makes reads from a memory-mapped
+        # dataset sequential within the batch
+        self.sort_indices = sort_indices
+        # Number of batches of the current epoch that have been yielded
+        self.offset = 0
 
     def __len__(self):
         return len(self.sampler) // self.batch_size
 
+    @property
+    def epoch(self):
+        return self.sampler.epoch
+
+    def state_dict(self):
+        state = self.sampler.state_dict()
+        state["offset"] = self.offset
+        return state
+
+    def load_state_dict(self, state):
+        self.sampler.load_state_dict(state)
+        self.offset = state["offset"]
+
     def __iter__(self):
-        batch = []
-        for index in self.sampler:
-            batch.append(int(index))
-            if len(batch) == self.batch_size:
-                yield batch
-                batch = []
-        if len(batch) > 0 and not self.drop_last:
+        indices = self.sampler.indices()
+        num_batches = indices.shape[0] // self.batch_size
+        num_full = num_batches * self.batch_size
+        batches = indices[:num_full].reshape((num_batches, self.batch_size))
+        if self.sort_indices:
+            batches = np.sort(batches, axis=1)
+        if num_full < indices.shape[0] and not self.drop_last:
+            last_batch = indices[num_full:]
+            if self.sort_indices:
+                last_batch = np.sort(last_batch)
+            num_batches += 1
+        while self.offset < num_batches:
+            if self.offset < batches.shape[0]:
+                batch = batches[self.offset]
+            else:
+                batch = last_batch
+            self.offset += 1
             yield batch
+        self.offset = 0
+        self.sampler.set_epoch(self.sampler.epoch + 1)
@@ -0,0 +1,209 @@
+import json
+import os
+import uuid
+
+import numpy as np
+
+# Packed dataset layout:
+#   <directory>/images-<id>.bin  raw uint8 images stored as NCHW
+#   <directory>/index.json       name of the images file, shape of the store
+#                                and the offset of every source file in it
+#
+# A writer streams the images into a file under a fresh name and publishes
+# it by replacing index.json last, so readers never see a partial store and
+# an interrupted write leaves the previous one in place. Stores written
+# before the index named its images file use images.bin.
+
+
+class PackedDataset():
+    images_filename = "images.bin"
+    index_filename = "index.json"
+
+    def __init__(self, directory, indices=None):
+        self.directory = directory
+        with open(os.path.join(directory, self.index_filename), "r") as f:
+            self.index = json.load(f)
+        shape = tuple(self.index["shape"])
+        if shape[0] == 0:
+            self.images = np.zeros(shape, dtype=np.uint8)
+        else:
+            self.images = np.memmap(
+                os.path.join(directory, self.images_path),
+                dtype=np.uint8,
+                mode="r",
+                shape=shape)
+        self.indices = indices
+
+    @property
+    def images_path(self):
+        return self.index.get("images", self.images_filename)
+
+    @property
+    def files(self):
+        return self.index["files"]
+
+    @property
+    def metadata(self):
+        return self.index.get("metadata")
+
+    @property
+    def shape(self):
+        return (len(self), ) + self.images.shape[1:]
+
+    @property
+    def dtype(self):
+        return self.images.dtype
+
+    def subset(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        if self.indices is not None:
+            indices = self.indices[indices]
+        dataset = PackedDataset.__new__(PackedDataset)
+        dataset.directory = self.directory
+        dataset.index = self.index
+        dataset.images = self.images
+        dataset.indices = indices
+        return dataset
+
+    def take(self, indices, out=None):
+        if self.indices is not None:
+            indices = self.indices[indices]
+        return np.take(self.images, indices, axis=0, out=out)
+
+    def __getitem__(self, indices):
+        x = self.take(indices).astype(np.float32)
+        x /= 255
+        return x
+
+    def __len__(self):
+        if self.indices is not None:
+            return self.indices.shape[0]
+        return self.images.shape[0]
+
+
+# With `append`, images are added after those of the store already in
+# `directory` instead of replacing it. Its images file is extended in place;
+# the records it holds stay valid for readers of the previous index.
+class PackedDatasetWriter():
+    chunk_size = 1024
+
+    def __init__(self, directory, metadata=None, append=False):
+        self.directory = directory
+        self.metadata = metadata
+        self.files = []
+        self.shape = None
+        self.num_images = 0
+        os.makedirs(directory, exist_ok=True)
+        index_path = os.path.join(directory, PackedDataset.index_filename)
+        self.previous_images_path = None
+        if os.path.isfile(index_path):
+            previous = PackedDataset(directory)
+            self.previous_images_path = previous.images_path
+            if append:
+                if metadata is not None and previous.metadata != metadata:
+                    raise ValueError(
+                        "metadata mismatch: expected {}, got {}".format(
+                            previous.metadata, metadata))
+                self.metadata = previous.metadata
+                self.files = list(previous.files)
+                self.num_images = len(previous)
+                if self.num_images > 0:
+                    self.shape = previous.images.shape[1:]
+        if append and self.previous_images_path is not None:
+            self.images_path = self.previous_images_path
+            self.f = open(os.path.join(directory, self.images_path), "r+b")
+            # Drops whatever an interrupted append left after the last record
+            self.previous_size = self.num_images * int(
+                np.prod(self.shape or (0, )))
+            self.f.truncate(self.previous_size)
+            self.f.seek(self.previous_size)
+        else:
+            self.images_path = "images-{}.bin".format(uuid.uuid4().hex)
+            self.f = open(os.path.join(directory, self.images_path), "wb")
+            self.previous_size = None
+
+    # images: uint8 array in NHWC
+    def append(self, images, name=None, digest=None, stat=None):
+        images = np.asarray(images)
+        if images.dtype != np.uint8:
+            raise ValueError("images must be uint8, got {}".format(
+                images.dtype))
+        if images.ndim == 3:
+            images = images[None, ...]
+        images = images.transpose((0, 3, 1, 2))
+        if self.shape is None:
+            self.shape = images.shape[1:]
+        elif images.shape[1:] != self.shape:
+            raise ValueError("image shape mismatch: expected {}, got {}".format(
+                self.shape, images.shape[1:]))
+        for start in range(0, images.shape[0], self.chunk_size):
+            chunk = images[start:start + self.chunk_size]
+            self.f.write(np.ascontiguousarray(chunk).tobytes())
+        entry = {
+            "name": name,
+            "offset": self.num_images,
+            "count": images.shape[0]
+        }
+        if digest is not None:
+            entry["digest"] = digest
+        if stat is not None:
+            entry["stat"] = stat
+        self.files.append(entry)
+        self.num_images += images.shape[0]
+
+    def close(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+        shape = (self.num_images, ) + tuple(self.shape or (0, 0, 0))
+        tmp_index_path = os.path.join(self.directory,
+                                      PackedDataset.index_filename + ".tmp")
+        with open(tmp_index_path, "w") as f:
+            json.dump({
+                "images": self.images_path,
+                "shape": shape,
+                "files": self.files,
+                "metadata": self.metadata
+            },
+                      f,
+                      indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_index_path,
+                   os.path.join(self.directory, PackedDataset.index_filename))
+        if self.previous_images_path not in (None, self.images_path):
+            previous_path = os.path.join(self.directory,
+                                         self.previous_images_path)
+            if os.path.isfile(previous_path):
+                os.remove(previous_path)
+
+    # Leaves the previous store untouched
+    def abort(self):
+        if self.previous_size is None:
+            self.f.close()
+            os.remove(os.path.join(self.directory, self.images_path))
+        else:
+            self.f.truncate(self.previous_size)
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def build_packed_dataset(npy_directory, output_directory):
+    files = os.listdir(npy_directory)
+    files.sort()
+    with PackedDatasetWriter(output_directory) as writer:
+        for filename in files:
+            if not filename.endswith(".npy"):
+                continue
+            images = np.load(
+                os.path.join(npy_directory, filename), mmap_mode="r")
+            writer.append(images, name=filename)
+    return PackedDataset(output_directory)
@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class PrefetchIterator:
+    # Assembles the next `num_prefetch` batches on a thread pool while the
+    # training loop runs. Raw batches are read with `dataset.take` into a fixed
+    # set of reusable buffers. `transform(batch, out)` runs on the worker and
+    # receives whatever it returned last time for the same buffer, so it can
+    # write into it instead of allocating. `converter(batch)` runs last, e.g.
+    # to copy the batch to the device.
+    # If `dataset` is None, `iterator` yields the raw batches itself (e.g.
+    # StreamingIterator) and is advanced on the workers; indices are None.
+    def __init__(self,
+                 dataset,
+                 iterator,
+                 num_prefetch=2,
+                 num_workers=1,
+                 transform=None,
+                 converter=None):
+        assert num_prefetch > 0
+        self.dataset = dataset
+        self.iterator = iterator
+        self.num_prefetch = num_prefetch
+        self.num_workers = num_workers
+        self.transform = transform
+        self.converter = converter
+        self.lock = threading.Lock()
+        self.slots = []
+        for _ in range(num_prefetch + 1):
+            buffer = None
+            if dataset is not None:
+                buffer = np.empty(
+                    (iterator.batch_size, ) + tuple(dataset.shape[1:]),
+                    dtype=dataset.dtype)
+            self.slots.append({"buffer": buffer, "out": None})
+        self.wait_time = 0
+        self.num_batches = 0
+        self.state = None
+
+    def __len__(self):
+        return len(self.iterator)
+
+    @property
+    def mean_wait_time(self):
+        if self.num_batches == 0:
+            return 0
+        return self.wait_time / self.num_batches
+
+    # The wrapped iterator runs ahead of the training loop, so its own state
+    # would skip the prefetched batches on resume. This tracks the batches
+    # that have actually been handed out instead.
+    def state_dict(self):
+        if self.state is None:
+            return self.iterator.state_dict()
+        return dict(self.state)
+
+    def load_state_dict(self, state):
+        self.iterator.load_state_dict(state)
+        self.state = None
+
+    def load(self, item, slot):
+        if self.dataset is None:
+            indices = None
+            with self.lock:
+                batch = next(item, None)
+            if batch is None:
+                return None, None
+        else:
+            indices = item
+            batch = slot["buffer"][:len(indices)]
+            self.dataset.take(indices, out=batch)
+        if self.transform is not None:
+            batch = self.transform(batch, slot["out"])
+            slot["out"] = batch
+        if self.converter is not None:
+            batch = self.converter(batch)
+        return indices, batch
+
+    def __iter__(self):
+        self.wait_time = 0
+        self.num_batches = 0
+        free_slots = deque(self.slots)
+        pending = deque()
+        if self.dataset is not None:
+            self.state = self.iterator.state_dict()
+        batches = iter(self.iterator)
+        exhausted = False
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+
+            def submit():
+                if exhausted:
+                    return
+                if self.dataset is None:
+                    item = batches
+                else:
+                    item = next(batches, None)
+                    if item is None:
+                        return
+                slot = free_slots.popleft()
+                future = executor.submit(self.load, item, slot)
+                pending.append((slot, future))
+
+            for _ in range(self.num_prefetch):
+                submit()
+
+            prev_slot = None
+            while len(pending) > 0:
+                slot, future = pending.popleft()
+                start_time = time.perf_counter()
+                indices, batch = future.result()
+                self.wait_time += time.perf_counter() - start_time
+
+                if prev_slot is not None:
+                    free_slots.append(prev_slot)
+                    prev_slot = None
+                if batch is None:
+                    exhausted = True
+                    free_slots.append(slot)
+                    continue
+                submit()
+
+                self.num_batches += 1
+                if self.state is not None:
+                    self.state["offset"] += 1
+                yield indices, batch
+                prev_slot = slot
+
+        if self.dataset is not None:
+            self.state = self.iterator.state_dict()
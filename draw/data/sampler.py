@@ -1,12 +1,60 @@
 import numpy as np
 
 
+# The permutation of every epoch is a function of (seed, epoch), so a sampler
+# can be restored from its state_dict and reproduce the remaining batches.
 class Sampler:
-    def __init__(self, dataset):
+    def __init__(self, dataset, seed=None):
         self.dataset = dataset
+        if seed is None:
+            seed = int(np.random.randint(0, 2**31 - 1))
+        self.seed = seed
+        self.epoch = 0
 
     def __len__(self):
         return len(self.dataset)
 
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def state_dict(self):
+        return {"seed": self.seed, "epoch": self.epoch}
+
+    def load_state_dict(self, state):
+        self.seed = state["seed"]
+        self.epoch = state["epoch"]
+
+    def indices(self):
+        rng = np.random.default_rng((self.seed, self.epoch))
+        return rng.permutation(len(self.dataset))
+
     def __iter__(self):
-        return iter(np.random.permutation(len(self.dataset)))
\ No newline at end of file
+        return iter(self.indices())
+
+
+# Partitions the sample indices evenly across `num_replicas` ranks. Every rank
+# draws the same permutation from the shared seed and the epoch, then takes
+# every `num_replicas`-th index starting from `rank`. The permutation is padded
+# by wrapping around (or truncated if `drop_last`) so that all ranks see the
+# same number of samples and therefore run the same number of steps.
+class DistributedSampler(Sampler):
+    def __init__(self, dataset, num_replicas, rank, seed=0, drop_last=False):
+        assert 0 <= rank < num_replicas
+        super().__init__(dataset, seed=seed)
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.drop_last = drop_last
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.dataset) // self.num_replicas
+        return -(-len(self.dataset) // self.num_replicas)
+
+    def indices(self):
+        indices = super().indices()
+        total_size = len(self) * self.num_replicas
+        if total_size > indices.shape[0]:
+            indices = np.resize(indices, total_size)
+        else:
+            indices = indices[:total_size]
+        return indices[self.rank::self.num_replicas]
@@ -0,0 +1,117 @@
+import os
+
+import numpy as np
+
+
+class ShardedDataset():
+    # A directory of .npy shards (uint8, NHWC) that is never loaded as a whole.
+    # Only the headers are read up front to build the per-shard record counts.
+    def __init__(self, directory):
+        self.directory = directory
+        files = os.listdir(directory)
+        files.sort()
+        self.shards = []
+        image_shape = None
+        for filename in files:
+            if not filename.endswith(".npy"):
+                continue
+            array = np.load(os.path.join(directory, filename), mmap_mode="r")
+            if image_shape is None:
+                image_shape = array.shape[1:]
+            elif array.shape[1:] != image_shape:
+                raise ValueError(
+                    "shard shape mismatch in {}: expected {}, got {}".format(
+                        filename, image_shape, array.shape[1:]))
+            self.shards.append({"name": filename, "count": array.shape[0]})
+        if image_shape is None:
+            raise ValueError("no .npy shards found in {}".format(directory))
+        height, width, channels = image_shape
+        self.image_shape = (channels, height, width)
+        self.num_images = sum(shard["count"] for shard in self.shards)
+
+    @property
+    def shape(self):
+        return (self.num_images, ) + self.image_shape
+
+    @property
+    def dtype(self):
+        return np.dtype(np.uint8)
+
+    # Returns the shard as a memory-mapped NCHW view
+    def read_shard(self, shard_index):
+        array = np.load(
+            os.path.join(self.directory, self.shards[shard_index]["name"]),
+            mmap_mode="r")
+        return array.transpose((0, 3, 1, 2))
+
+    def __len__(self):
+        return self.num_images
+
+
+class StreamingIterator:
+    # Yields uint8 NCHW batches. Shards are visited in random order and read in
+    # randomly ordered contiguous blocks of `batch_size` records, which are
+    # mixed through a shuffle buffer of `shuffle_buffer_size` records. Memory is
+    # bounded by the shuffle buffer regardless of the number of shards.
+    def __init__(self,
+                 dataset,
+                 batch_size,
+                 shuffle_buffer_size=10000,
+                 drop_last=True,
+                 seed=None):
+        assert shuffle_buffer_size >= batch_size
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.drop_last = drop_last
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return len(self.dataset) // self.batch_size
+
+    def blocks(self):
+        for shard_index in self.rng.permutation(len(self.dataset.shards)):
+            shard = self.dataset.read_shard(shard_index)
+            num_blocks = -(-shard.shape[0] // self.batch_size)
+            for block_index in self.rng.permutation(num_blocks):
+                start = block_index * self.batch_size
+                yield shard[start:start + self.batch_size]
+
+    def shuffled(self):
+        buffer = np.empty(
+            (self.shuffle_buffer_size, ) + self.dataset.shape[1:],
+            dtype=self.dataset.dtype)
+        num_buffered = 0
+        for block in self.blocks():
+            if num_buffered < self.shuffle_buffer_size:
+                n = min(self.shuffle_buffer_size - num_buffered,
+                        block.shape[0])
+                buffer[num_buffered:num_buffered + n] = block[:n]
+                num_buffered += n
+                block = block[n:]
+                if block.shape[0] == 0:
+                    continue
+            # Swap the block with randomly chosen records of the buffer
+            slots = self.rng.choice(
+                self.shuffle_buffer_size, block.shape[0], replace=False)
+            yield buffer[slots]
+            buffer[slots] = block
+        yield buffer[:num_buffered][self.rng.permutation(num_buffered)]
+
+    def __iter__(self):
+        batch = np.empty(
+            (self.batch_size, ) + self.dataset.shape[1:],
+            dtype=self.dataset.dtype)
+        num_batched = 0
+        for records in self.shuffled():
+            while records.shape[0] > 0:
+                n = min(self.batch_size - num_batched, records.shape[0])
+                batch[num_batched:num_batched + n] = records[:n]
+                num_batched += n
+                records = records[n:]
+                if num_batched == self.batch_size:
+                    yield batch
+                    batch = np.empty_like(batch)
+                    num_batched = 0
+        if num_batched > 0 and not self.drop_last:
+            yield batch[:num_batched]
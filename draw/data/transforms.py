@@ -0,0 +1,41 @@
+import threading
+
+import numpy as np
+
+
+class Dequantize:
+    # Maps uint8 images to float32 x / scale and adds uniform dequantization
+    # noise of width 1/256 in a single in-place pass over the output buffer.
+    # Follows the PrefetchIterator transform protocol: `out` is reused when its
+    # shape matches.
+    def __init__(self, noise=True, seed=None, scale=255):
+        self.noise = noise
+        self.scale = scale
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    # np.random.Generator is not thread-safe, so every worker thread gets its
+    # own stream spawned from the same seed
+    @property
+    def generator(self):
+        generator = getattr(self.local, "generator", None)
+        if generator is None:
+            with self.lock:
+                seed = self.seed_sequence.spawn(1)[0]
+            generator = np.random.default_rng(seed)
+            self.local.generator = generator
+        return generator
+
+    def __call__(self, x, out=None):
+        if out is None or out.shape != x.shape:
+            out = np.empty(x.shape, dtype=np.float32)
+        if self.noise:
+            # x / scale + u / 256 = (x + u * scale / 256) / scale, u ~ U[0, 1)
+            self.generator.random(dtype=np.float32, out=out)
+            out *= self.scale / 256
+            out += x
+            out *= 1 / self.scale
+        else:
+            np.multiply(x, np.float32(1 / self.scale), out=out)
+        return out
@@ -0,0 +1,67 @@
+import math
+
+import numpy as np
+
+
+# Running mean and variance of a stream of samples of a fixed shape, updated
+# a batch at a time. The batch moments are merged into the running ones with
+# the parallel form of Welford's algorithm (Chan et al.), so memory does not
+# grow with the number of samples and large sums are not accumulated in
+# float32.
+class RunningStatistics():
+    def __init__(self, shape=()):
+        self.shape = tuple(shape)
+        self.count = 0
+        self.mean = np.zeros(self.shape, dtype=np.float64)
+        self.m2 = np.zeros(self.shape, dtype=np.float64)
+
+    # values: array of shape (batch_size, ) + shape
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape[1:] != self.shape:
+            raise ValueError("expected samples of shape {}, got {}".format(
+                self.shape, values.shape[1:]))
+        batch_count = values.shape[0]
+        if batch_count == 0:
+            return
+        batch_mean = values.mean(axis=0)
+        batch_m2 = ((values - batch_mean)**2).sum(axis=0)
+        count = self.count + batch_count
+        delta = batch_mean - self.mean
+        self.mean = self.mean + delta * (batch_count / count)
+        self.m2 = self.m2 + batch_m2 + delta**2 * (
+            self.count * batch_count / count)
+        self.count = count
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / count)
+        self.m2 = self.m2 + other.m2 + delta**2 * (
+            self.count * other.count / count)
+        self.count = count
+
+    # Unbiased sample variance
+    @property
+    def variance(self):
+        if self.count < 2:
+            return np.full(self.shape, math.nan)
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    # Standard error of the mean
+    @property
+    def stderr(self):
+        return self.std / math.sqrt(max(self.count, 1))
+
+    def to_dict(self):
+        return {
+            "mean": self.mean.tolist(),
+            "std": self.std.tolist(),
+            "stderr": self.stderr.tolist(),
+        }
@@ -1,2 +1,12 @@
-from . import single_layer
-from . import functions
\ No newline at end of file
+try:
+    import chainer
+except ImportError:
+    chainer = None
+
+if chainer is not None:
+    from . import single_layer
+    from . import functions
+from . import serializers
+if chainer is not None:
+    from . import precision
+    from . import losses
@@ -1,13 +1,12 @@
 import math
-import cupy
 import chainer
 import chainer.functions as cf
 
+from ... import backend
+
 
 def get_array_module(array):
-    if isinstance(array, chainer.Variable):
-        return cupy.get_array_module(array.data)
-    return cupy.get_array_module(array)
+    return backend.get_array_module(array)
 
 
 # https://en.wikipedia.org/wiki/Multivariate_normal_distribution#Kullback%E2%80%93Leibler_divergence
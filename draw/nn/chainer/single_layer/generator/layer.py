@@ -1,6 +1,5 @@
 import chainer
 import chainer.functions as cf
-import cupy
 import math
 
 from .... import base
@@ -1,8 +1,9 @@
 import math
-import cupy
 import chainer
 import chainer.functions as cf
 
+from .precision import as_float32
+
 
 # https://en.wikipedia.org/wiki/Multivariate_normal_distribution#Kullback%E2%80%93Leibler_divergence
 def gaussian_kl_divergence(mu_q, ln_var_q, mu_p, ln_var_p):
@@ -22,3 +23,36 @@ def gaussian_negative_log_likelihood(x, mu, var, ln_var):
     diff = x - mu
     return 0.5 * (k * math.log(2 * math.pi) + cf.sum(
         ln_var + diff * diff / var, axis=(1, 2, 3)))
+
+
+# KL divergence of every element of two diagonal Gaussians, not reduced.
+# var_q / var_p is computed as exp(ln_var_q - ln_var_p), which does not
+# overflow when both log variances are large.
+def gaussian_kl_divergence_elementwise(mu_q, ln_var_q, mu_p, ln_var_p):
+    ln_var_ratio = ln_var_q - ln_var_p
+    diff = mu_p - mu_q
+    return 0.5 * (cf.exp(ln_var_ratio) + diff * diff * cf.exp(-ln_var_p) -
+                  ln_var_ratio - 1)
+
+
+# KL divergence of all generation steps at once. z_t_params_array holds
+# (mu_q, ln_var_q, mu_p, ln_var_p) for every step, which are stacked into
+# (steps, batch, channels, height, width). The statistics are converted to
+# float32 before the reduction. Returns the divergence of each step summed
+# over the batch and the total.
+def gaussian_kl_divergence_over_steps(z_t_params_array):
+    mu_q, ln_var_q, mu_p, ln_var_p = [
+        as_float32(cf.stack(params)) for params in zip(*z_t_params_array)
+    ]
+    kld = gaussian_kl_divergence_elementwise(mu_q, ln_var_q, mu_p, ln_var_p)
+    kld_per_step = cf.sum(kld, axis=(1, 2, 3, 4))
+    return kld_per_step, cf.sum(kld_per_step)
+
+
+# Squared error between x and the canvas of every step, summed over the batch
+# in float32. Returns the error of each step and the total.
+def squared_error_over_steps(r_t_array, x):
+    r = as_float32(cf.stack(r_t_array))
+    diff = r - cf.broadcast_to(as_float32(x)[None], r.shape)
+    sse_per_step = cf.sum(diff * diff, axis=(1, 2, 3, 4))
+    return sse_per_step, cf.sum(sse_per_step)
@@ -0,0 +1,109 @@
+import chainer
+import chainer.functions as cf
+
+from . import functions
+from .precision import as_float32
+
+# Loss accumulators receive the contribution of every generation step from
+# LSTMModel.accumulate_loss while the steps run. reduce() returns the
+# (nll, kld, sse) sums over the batch, which are reduced in float32.
+
+
+# Reduces every contribution as soon as it is received so that no per-step
+# tensor is referenced beyond what the graph needs
+class LossAccumulator():
+    def __init__(self):
+        self.loss_nll = 0
+        self.loss_kld = 0
+        self.loss_sse = 0
+
+    def add_kl_divergence(self, t, mean_z_q, ln_var_z_q, mean_z_p,
+                          ln_var_z_p):
+        # Same per-element form as gaussian_kl_divergence_over_steps, with a
+        # single reduction per step
+        self.loss_kld += cf.sum(
+            functions.gaussian_kl_divergence_elementwise(
+                as_float32(mean_z_q), as_float32(ln_var_z_q),
+                as_float32(mean_z_p), as_float32(ln_var_z_p)))
+
+    def add_squared_error(self, t, r_t, x):
+        self.loss_sse += cf.sum(
+            cf.squared_error(as_float32(r_t), as_float32(x)))
+
+    def add_negative_log_likelihood(self, x, mu_x, ln_var_x):
+        self.loss_nll += cf.gaussian_nll(
+            as_float32(x), as_float32(mu_x), as_float32(ln_var_x))
+
+    def reduce(self):
+        return self.loss_nll, self.loss_kld, self.loss_sse
+
+
+# Keeps the per-step statistics and reduces all steps at once (see
+# functions.gaussian_kl_divergence_over_steps)
+class StackedLossAccumulator(LossAccumulator):
+    def __init__(self):
+        super().__init__()
+        self.z_t_params_array = []
+        self.r_t_array = []
+        self.x = None
+
+    def add_kl_divergence(self, t, mean_z_q, ln_var_z_q, mean_z_p,
+                          ln_var_z_p):
+        self.z_t_params_array.append((mean_z_q, ln_var_z_q, mean_z_p,
+                                      ln_var_z_p))
+
+    def add_squared_error(self, t, r_t, x):
+        self.r_t_array.append(r_t)
+        self.x = x
+
+    def reduce(self):
+        if self.z_t_params_array:
+            _, self.loss_kld = functions.gaussian_kl_divergence_over_steps(
+                self.z_t_params_array)
+            self.z_t_params_array = []
+        if self.r_t_array:
+            _, self.loss_sse = functions.squared_error_over_steps(
+                self.r_t_array, self.x)
+            self.r_t_array = []
+        return self.loss_nll, self.loss_kld, self.loss_sse
+
+
+# Keeps the per-image value of every term as arrays for evaluation. Run it
+# under chainer.no_backprop_mode(). The squared error of the last step is
+# that of the mean of p(x). The arrays are float32 and on the same device as
+# the model.
+class PerImageLossAccumulator(LossAccumulator):
+    def __init__(self):
+        super().__init__()
+        self.kld = []
+        self.sse = []
+        self.nll = None
+
+    def add_kl_divergence(self, t, mean_z_q, ln_var_z_q, mean_z_p,
+                          ln_var_z_p):
+        kld = functions.gaussian_kl_divergence(
+            as_float32(mean_z_q), as_float32(ln_var_z_q),
+            as_float32(mean_z_p), as_float32(ln_var_z_p))
+        self.kld.append(kld.array)
+
+    def add_squared_error(self, t, r_t, x):
+        sse = cf.sum(
+            cf.squared_error(as_float32(r_t), as_float32(x)), axis=(1, 2, 3))
+        self.sse.append(sse.array)
+
+    def add_negative_log_likelihood(self, x, mu_x, ln_var_x):
+        x, mu_x = as_float32(x), as_float32(mu_x)
+        nll = cf.gaussian_nll(x, mu_x, as_float32(ln_var_x), reduce="no")
+        self.nll = cf.sum(nll, axis=(1, 2, 3)).array
+        self.add_squared_error(len(self.sse), mu_x, x)
+
+    # Returns the KL divergence of every step and the squared error after
+    # every step, both of shape (batch_size, generation_steps), and the
+    # negative log-likelihood of shape (batch_size, )
+    def per_image(self):
+        xp = chainer.backend.get_array_module(self.nll)
+        return xp.stack(self.kld, axis=1), xp.stack(self.sse, axis=1), self.nll
+
+    def reduce(self):
+        kld, sse, nll = self.per_image()
+        return nll.sum(), kld.sum(), sse[:, :-1].sum()
@@ -0,0 +1,37 @@
+import functools
+
+import chainer
+import chainer.functions as cf
+import numpy as np
+
+# Compute dtypes a model can run in. In float16 the parameters are stored in
+# float16 while the optimizer keeps float32 master copies (see
+# Optimizer.enable_mixed_precision in the run scripts).
+# NumPy and CuPy have no bfloat16, so it is not offered.
+dtypes = ("float32", "float16")
+
+
+def get_dtype(name):
+    if name not in dtypes:
+        raise ValueError("dtype must be one of {}, got {}".format(
+            dtypes, name))
+    return np.dtype(name)
+
+
+# Runs a model method with chainer.config.dtype set to the model's dtype so
+# that lazily initialized and deserialized parameters are created in it
+def using_model_dtype(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with chainer.using_config("dtype", self.dtype):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+# Losses are reduced in float32 since sums over a batch of images overflow
+# float16
+def as_float32(x):
+    if x.dtype == np.float32:
+        return x
+    return cf.cast(x, np.float32)
@@ -0,0 +1,3 @@
+from . import functions
+from . import links
+from . import single_layer
@@ -0,0 +1,64 @@
+import math
+
+import torch
+
+
+def gaussian(mean, ln_var):
+    return mean + torch.exp(0.5 * ln_var) * torch.randn_like(mean)
+
+
+# Same channel layout as chainer.functions.space2depth, which differs from
+# torch.nn.functional.pixel_unshuffle
+def space2depth(x, r):
+    b, c, h, w = x.shape
+    x = x.reshape(b, c, h // r, r, w // r, r)
+    x = x.permute(0, 3, 5, 1, 2, 4)
+    return x.reshape(b, r * r * c, h // r, w // r)
+
+
+# Same channel layout as chainer.functions.depth2space
+def depth2space(x, r):
+    b, c, h, w = x.shape
+    x = x.reshape(b, r, r, c // (r * r), h, w)
+    x = x.permute(0, 3, 4, 1, 5, 2)
+    return x.reshape(b, c // (r * r), h * r, w * r)
+
+
+# https://en.wikipedia.org/wiki/Multivariate_normal_distribution#Kullback%E2%80%93Leibler_divergence
+def gaussian_kl_divergence(mu_q, ln_var_q, mu_p, ln_var_p):
+    ln_det_q = torch.sum(ln_var_q, dim=(1, 2, 3))
+    ln_det_p = torch.sum(ln_var_p, dim=(1, 2, 3))
+    var_p = torch.exp(ln_var_p)
+    var_q = torch.exp(ln_var_q)
+    trace_qp = torch.sum(var_q / var_p, dim=(1, 2, 3))
+    k = mu_q.shape[1] * mu_q.shape[2] * mu_q.shape[3]
+    diff = mu_p - mu_q
+    term2 = torch.sum(diff * diff / var_p, dim=(1, 2, 3))
+    return 0.5 * (trace_qp + term2 - k + ln_det_p - ln_det_q)
+
+
+# Equivalent to chainer.functions.gaussian_nll with reduce="sum"
+def gaussian_nll(x, mean, ln_var):
+    diff = x - mean
+    return 0.5 * torch.sum(
+        ln_var + math.log(2 * math.pi) + diff * diff * torch.exp(-ln_var))
+
+
+# See draw.nn.functions.gaussian_kl_divergence_over_steps
+def gaussian_kl_divergence_over_steps(z_t_params_array):
+    mu_q, ln_var_q, mu_p, ln_var_p = [
+        torch.stack(params) for params in zip(*z_t_params_array)
+    ]
+    ln_var_ratio = ln_var_q - ln_var_p
+    diff = mu_p - mu_q
+    kld = torch.exp(ln_var_ratio) + diff * diff * torch.exp(
+        -ln_var_p) - ln_var_ratio - 1
+    kld_per_step = 0.5 * torch.sum(kld, dim=(1, 2, 3, 4))
+    return kld_per_step, torch.sum(kld_per_step)
+
+
+# See draw.nn.functions.squared_error_over_steps
+def squared_error_over_steps(r_t_array, x):
+    diff = torch.stack(r_t_array) - x
+    sse_per_step = torch.sum(diff * diff, dim=(1, 2, 3, 4))
+    return sse_per_step, torch.sum(sse_per_step)
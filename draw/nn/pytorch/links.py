@@ -0,0 +1,31 @@
+import math
+
+import torch
+
+
+# Convolution with the input channels inferred on the first call, like
+# chainer.links.Convolution2D(None, ...), initialized with HeNormal(scale)
+class Convolution2D(torch.nn.LazyConv2d):
+    def __init__(self, out_channels, ksize, stride=1, pad=0, nobias=False,
+                 scale=0.1):
+        super().__init__(
+            out_channels,
+            ksize,
+            stride=stride,
+            padding=pad,
+            bias=not nobias)
+        self.scale = scale
+
+    def reset_parameters(self):
+        if self.has_uninitialized_params() or self.in_channels == 0:
+            return
+        fan_in = self.weight[0].numel()
+        torch.nn.init.normal_(
+            self.weight, std=self.scale * math.sqrt(2 / fan_in))
+        if self.bias is not None:
+            torch.nn.init.zeros_(self.bias)
+
+
+# chainer.links.BatchNormalization defaults
+def BatchNormalization(size):
+    return torch.nn.BatchNorm2d(size, eps=2e-5, momentum=0.1)
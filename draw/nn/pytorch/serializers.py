@@ -0,0 +1,44 @@
+import numpy as np
+import torch
+
+from .. import serializers
+
+# Chainer parameter and persistent names -> torch state dict names
+state_dict_names = {
+    "W": "weight",
+    "b": "bias",
+    "gamma": "weight",
+    "beta": "bias",
+    "avg_mean": "running_mean",
+    "avg_var": "running_var",
+    "N": "num_batches_tracked",
+}
+
+
+# Links whose weight was never initialized are skipped entirely (bias
+# included) and stay lazy on the torch side
+def convert_arrays(arrays):
+    uninitialized_links = set(
+        key.rsplit("/", 1)[0] for key, array in arrays.items()
+        if serializers.is_uninitialized(array))
+    state_dict = {}
+    for key, array in arrays.items():
+        if key.rsplit("/", 1)[0] in uninitialized_links:
+            continue
+        path = key.split("/")
+        path[-1] = state_dict_names[path[-1]]
+        state_dict[".".join(path)] = torch.from_numpy(np.asarray(array))
+    return state_dict
+
+
+# Loads a snapshot written by chainer.serializers.save_hdf5 from a ChainList
+# into a torch.nn.ModuleList holding the same links in the same order
+def load_hdf5(filepath, module_list):
+    arrays = serializers.load_hdf5_arrays(filepath)
+    for index, module in enumerate(module_list):
+        if hasattr(module, "fuse_snapshot_arrays"):
+            module.fuse_snapshot_arrays(arrays, "{}/".format(index))
+    result = module_list.load_state_dict(convert_arrays(arrays), strict=False)
+    if result.unexpected_keys:
+        raise ValueError("Unexpected parameters in {}: {}".format(
+            filepath, ", ".join(result.unexpected_keys)))
@@ -0,0 +1,4 @@
+from . import generator
+from . import inference
+from . import downsampler
+from . import upsampler
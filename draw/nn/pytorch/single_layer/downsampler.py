@@ -0,0 +1,33 @@
+import torch
+
+from .. import functions, links
+
+
+class SingleLayeredConvDownsampler(torch.nn.Module):
+    def __init__(self, channels):
+        super().__init__()
+        self.conv_1 = links.Convolution2D(channels, ksize=4, stride=2, pad=1)
+
+    def downsample(self, x):
+        return self.conv_1(x)
+
+
+class TwoLayeredConvDownsampler(torch.nn.Module):
+    def __init__(self, channels):
+        super().__init__()
+        self.conv_1 = links.Convolution2D(channels, ksize=2, stride=2, pad=0)
+        self.conv_2 = links.Convolution2D(channels, ksize=2, stride=2, pad=0)
+
+    def downsample(self, x):
+        out = torch.relu(self.conv_1(x))
+        out = self.conv_2(out)
+        return out
+
+
+class SpaceToDepthDownsampler(torch.nn.Module):
+    def __init__(self, scale):
+        super().__init__()
+        self.scale = scale
+
+    def downsample(self, x):
+        return functions.space2depth(x, r=self.scale)
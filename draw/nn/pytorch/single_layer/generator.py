@@ -0,0 +1,170 @@
+import torch
+
+from ... import serializers
+from .. import functions, links
+
+# The gates are always fused (see draw.nn.single_layer.generator with
+# fused=True). Unfused Chainer snapshots are converted by
+# fuse_snapshot_arrays when loaded.
+
+
+class LSTMCore(torch.nn.Module):
+    def __init__(self, chz_channels, batchnorm_enabled, batchnorm_steps):
+        super().__init__()
+        # Gates i, f, tanh, o over the shared input in one convolution
+        self.lstm_gates = links.Convolution2D(
+            4 * chz_channels, ksize=5, stride=1, pad=2)
+        # Peephole connections of i, f (c_{t-1}) and o (c_t)
+        self.lstm_peephole_if = links.Convolution2D(
+            2 * chz_channels, ksize=5, stride=1, pad=2, nobias=True)
+        self.lstm_peephole_o = links.Convolution2D(
+            chz_channels, ksize=5, stride=1, pad=2, nobias=True)
+
+        if batchnorm_enabled:
+            self.batchnorm_i_array = torch.nn.ModuleList([
+                links.BatchNormalization(chz_channels)
+                for t in range(batchnorm_steps)
+            ])
+            self.batchnorm_f_array = torch.nn.ModuleList([
+                links.BatchNormalization(chz_channels)
+                for t in range(batchnorm_steps)
+            ])
+            self.batchnorm_o_array = torch.nn.ModuleList([
+                links.BatchNormalization(chz_channels)
+                for t in range(batchnorm_steps)
+            ])
+            self.batchnorm_tanh_array = torch.nn.ModuleList([
+                links.BatchNormalization(chz_channels)
+                for t in range(batchnorm_steps)
+            ])
+        else:
+            self.batchnorm_i_array = None
+            self.batchnorm_f_array = None
+            self.batchnorm_o_array = None
+            self.batchnorm_tanh_array = None
+
+    def batchnorm_i(self, x, t):
+        if self.batchnorm_i_array is not None:
+            return self.batchnorm_i_array[t](x)
+        return x
+
+    def batchnorm_f(self, x, t):
+        if self.batchnorm_f_array is not None:
+            return self.batchnorm_f_array[t](x)
+        return x
+
+    def batchnorm_o(self, x, t):
+        if self.batchnorm_o_array is not None:
+            return self.batchnorm_o_array[t](x)
+        return x
+
+    def batchnorm_tanh(self, x, t):
+        if self.batchnorm_tanh_array is not None:
+            return self.batchnorm_tanh_array[t](x)
+        return x
+
+    def forward(self, prev_hg, prev_cg, prev_z, downsampled_prev_r,
+                batchnorm_step):
+        lstm_in = torch.cat((prev_hg, prev_z, downsampled_prev_r), dim=1)
+        gate_i, gate_f, gate_tanh, gate_o = torch.chunk(
+            self.lstm_gates(lstm_in), 4, dim=1)
+        peephole_i, peephole_f = torch.chunk(
+            self.lstm_peephole_if(prev_cg), 2, dim=1)
+        forget_gate = torch.sigmoid(
+            self.batchnorm_f(gate_f + peephole_f, batchnorm_step))
+        input_gate = torch.sigmoid(
+            self.batchnorm_i(gate_i + peephole_i, batchnorm_step))
+        next_c = forget_gate * prev_cg + input_gate * torch.tanh(
+            self.batchnorm_tanh(gate_tanh, batchnorm_step))
+        output_gate = torch.sigmoid(
+            self.batchnorm_o(gate_o + self.lstm_peephole_o(next_c),
+                             batchnorm_step))
+        next_h = output_gate * torch.tanh(next_c)
+        return next_h, next_c
+
+    def fuse_snapshot_arrays(self, arrays, prefix):
+        serializers.fuse_lstm_arrays(arrays, prefix)
+
+
+class GRUCore(torch.nn.Module):
+    def __init__(self, chz_channels, batchnorm_enabled, batchnorm_steps):
+        super().__init__()
+        # Gates u, r over the shared input in one convolution
+        self.gru_gates = links.Convolution2D(
+            2 * chz_channels, ksize=5, stride=1, pad=2)
+        self.gru_tanh = links.Convolution2D(
+            chz_channels, ksize=5, stride=1, pad=2)
+
+        if batchnorm_enabled:
+            self.batchnorm_r_array = torch.nn.ModuleList([
+                links.BatchNormalization(chz_channels)
+                for t in range(batchnorm_steps)
+            ])
+            self.batchnorm_u_array = torch.nn.ModuleList([
+                links.BatchNormalization(chz_channels)
+                for t in range(batchnorm_steps)
+            ])
+            self.batchnorm_tanh_array = torch.nn.ModuleList([
+                links.BatchNormalization(chz_channels)
+                for t in range(batchnorm_steps)
+            ])
+        else:
+            self.batchnorm_r_array = None
+            self.batchnorm_u_array = None
+            self.batchnorm_tanh_array = None
+
+    def batchnorm_r(self, x, t):
+        if self.batchnorm_r_array is not None:
+            return self.batchnorm_r_array[t](x)
+        return x
+
+    def batchnorm_u(self, x, t):
+        if self.batchnorm_u_array is not None:
+            return self.batchnorm_u_array[t](x)
+        return x
+
+    def batchnorm_tanh(self, x, t):
+        if self.batchnorm_tanh_array is not None:
+            return self.batchnorm_tanh_array[t](x)
+        return x
+
+    def forward(self, prev_hg, prev_z, downsampled_prev_r, batchnorm_step):
+        lstm_in = torch.cat((prev_hg, prev_z, downsampled_prev_r), dim=1)
+        gate_u, gate_r = torch.chunk(self.gru_gates(lstm_in), 2, dim=1)
+        update_gate = torch.sigmoid(self.batchnorm_u(gate_u, batchnorm_step))
+        reset_gate = torch.sigmoid(self.batchnorm_r(gate_r, batchnorm_step))
+
+        lstm_in_tanh = torch.cat(
+            (prev_z, downsampled_prev_r, reset_gate * prev_hg), dim=1)
+        lstm_h = torch.tanh(
+            self.batchnorm_tanh(self.gru_tanh(lstm_in_tanh), batchnorm_step))
+        next_h = (1.0 - update_gate) * prev_hg + update_gate * lstm_h
+
+        return next_h
+
+    def fuse_snapshot_arrays(self, arrays, prefix):
+        serializers.fuse_gru_arrays(arrays, prefix)
+
+
+class Prior(torch.nn.Module):
+    def __init__(self, channels_z):
+        super().__init__()
+        self.mean_ln_var_z = links.Convolution2D(
+            channels_z * 2, ksize=5, stride=1, pad=2)
+
+    def compute_mean_z(self, h):
+        return self.compute_mean_and_ln_var_z(h)[0]
+
+    def compute_ln_var_z(self, h):
+        return self.compute_mean_and_ln_var_z(h)[1]
+
+    def compute_mean_and_ln_var_z(self, h):
+        mean, ln_var = torch.chunk(self.mean_ln_var_z(h), 2, dim=1)
+        return mean, ln_var
+
+    def sample_z(self, h):
+        mean, ln_var = self.compute_mean_and_ln_var_z(h)
+        return functions.gaussian(mean, ln_var)
+
+    def fuse_snapshot_arrays(self, arrays, prefix):
+        serializers.fuse_gaussian_arrays(arrays, prefix)
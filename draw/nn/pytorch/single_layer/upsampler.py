@@ -0,0 +1,13 @@
+import torch
+
+from .. import functions, links
+
+
+class SubPixelConvolutionUpsampler(torch.nn.Module):
+    def __init__(self, channels, scale):
+        super().__init__()
+        self.scale = scale
+        self.conv = links.Convolution2D(channels, ksize=4, stride=2, pad=1)
+
+    def forward(self, x):
+        return functions.depth2space(self.conv(x), r=self.scale)
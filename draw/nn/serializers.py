@@ -0,0 +1,84 @@
+import numpy as np
+
+# h5py and Chainer are imported where they are used, so that the PyTorch
+# backend can use the functions that rewrite the arrays without them.
+
+
+# Reads every array of a snapshot written by chainer.serializers.save_hdf5
+# into a flat {"0/lstm_i/W": array, ...} dictionary so that it can be
+# rewritten before being loaded
+def load_hdf5_arrays(filepath):
+    import h5py
+    arrays = {}
+
+    def visit(name, obj):
+        if isinstance(obj, h5py.Dataset):
+            if obj.shape is None:
+                # Uninitialized parameter
+                arrays[name] = np.array(None, dtype=object)
+            else:
+                arrays[name] = obj[()]
+
+    with h5py.File(filepath, "r") as f:
+        f.visititems(visit)
+    return arrays
+
+
+def is_uninitialized(array):
+    return array.dtype == object
+
+
+def load_arrays(arrays, obj):
+    from chainer.serializers import NpzDeserializer
+    NpzDeserializer(arrays).load(obj)
+
+
+# LSTM gates i, f, tanh, o are stacked along the output channels of one
+# convolution over the shared input. The peephole parts of i, f (over c_{t-1})
+# and o (over c_t) are the trailing input channels of the unfused weights.
+def fuse_lstm_arrays(arrays, prefix):
+    if prefix + "lstm_i/W" not in arrays:
+        return
+    names = ("lstm_i", "lstm_f", "lstm_tanh", "lstm_o")
+    W_i, W_f, W_tanh, W_o = [arrays.pop(prefix + name + "/W") for name in names]
+    biases = [arrays.pop(prefix + name + "/b") for name in names]
+    if is_uninitialized(W_tanh):
+        for name in ("lstm_gates/W", "lstm_peephole_if/W", "lstm_peephole_o/W"):
+            arrays[prefix + name] = W_tanh
+        arrays[prefix + "lstm_gates/b"] = np.concatenate(biases, axis=0)
+        return
+    in_channels = W_tanh.shape[1]
+    arrays[prefix + "lstm_gates/W"] = np.concatenate(
+        (W_i[:, :in_channels], W_f[:, :in_channels], W_tanh,
+         W_o[:, :in_channels]),
+        axis=0)
+    arrays[prefix + "lstm_gates/b"] = np.concatenate(biases, axis=0)
+    arrays[prefix + "lstm_peephole_if/W"] = np.concatenate(
+        (W_i[:, in_channels:], W_f[:, in_channels:]), axis=0)
+    arrays[prefix + "lstm_peephole_o/W"] = W_o[:, in_channels:]
+
+
+# GRU gates u, r are stacked along the output channels
+def fuse_gru_arrays(arrays, prefix):
+    if prefix + "gru_u/W" not in arrays:
+        return
+    concat_arrays(arrays, prefix, ("gru_u", "gru_r"), "gru_gates")
+
+
+# mean_z and ln_var_z are stacked along the output channels
+def fuse_gaussian_arrays(arrays, prefix):
+    if prefix + "mean_z/W" not in arrays:
+        return
+    concat_arrays(arrays, prefix, ("mean_z", "ln_var_z"), "mean_ln_var_z")
+
+
+# Stacks the W and b of the links `names` along the output channels into
+# the link `fused_name`
+def concat_arrays(arrays, prefix, names, fused_name):
+    weights = [arrays.pop(prefix + name + "/W") for name in names]
+    biases = [arrays.pop(prefix + name + "/b") for name in names]
+    if is_uninitialized(weights[0]):
+        arrays[prefix + fused_name + "/W"] = weights[0]
+    else:
+        arrays[prefix + fused_name + "/W"] = np.concatenate(weights, axis=0)
+    arrays[prefix + fused_name + "/b"] = np.concatenate(biases, axis=0)
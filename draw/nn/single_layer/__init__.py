@@ -1,4 +1,5 @@
 from . import generator
 from . import inference
 from . import downsampler
-from . import upsampler
\ No newline at end of file
+from . import upsampler
+from . import inputs
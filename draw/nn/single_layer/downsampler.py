@@ -52,3 +52,88 @@ class SpaceToDepthDownsampler(chainer.Chain):
 
     def downsample(self, x):
         return cf.space2depth(x, r=self.scale)
+
+
+# Downsamples the canvas r_t for the generator and x - r_t for the inference
+# network at every step. update(r, delta) is called after every step with the
+# new canvas r = r_t + delta.
+class CanvasDownsampler():
+    def __init__(self,
+                 downsampler_r,
+                 downsampler_diff_xr,
+                 x,
+                 r,
+                 no_backprop_diff_xr=False):
+        self.downsampler_r = downsampler_r
+        self.downsampler_diff_xr = downsampler_diff_xr
+        self.x = x
+        self.r = r
+        self.no_backprop_diff_xr = no_backprop_diff_xr
+
+    def update(self, r, delta):
+        self.r = r
+
+    def downsample_r(self):
+        return self.downsampler_r.downsample(self.r)
+
+    def downsample_diff_xr(self):
+        diff_xr = self.x - self.r
+        if self.no_backprop_diff_xr:
+            diff_xr = chainer.as_array(diff_xr)
+        return self.downsampler_diff_xr.downsample(diff_xr)
+
+
+# Same as CanvasDownsampler for two SingleLayeredConvDownsamplers, which are
+# linear in their input. Both outputs are computed once for the initial
+# canvas and then kept as running sums: after r_{t+1} = r_t + delta_t, the
+# bias-free convolution of delta_t with the weights of both downsamplers
+# (stacked into a single convolution) is added to the downsampled canvas and
+# subtracted from the downsampled x - r. This replaces two convolutions of
+# the full resolution canvas per step with one.
+class IncrementalCanvasDownsampler(CanvasDownsampler):
+    def __init__(self,
+                 downsampler_r,
+                 downsampler_diff_xr,
+                 x,
+                 r,
+                 no_backprop_diff_xr=False):
+        for downsampler in (downsampler_r, downsampler_diff_xr):
+            if not isinstance(downsampler, SingleLayeredConvDownsampler):
+                raise ValueError(
+                    "incremental downsampling needs SingleLayeredConvDownsampler, got {}".
+                    format(type(downsampler).__name__))
+        super().__init__(downsampler_r, downsampler_diff_xr, x, r,
+                         no_backprop_diff_xr)
+        self.downsampled_r = super().downsample_r()
+        self.downsampled_diff_xr = super().downsample_diff_xr()
+        conv_r = downsampler_r.conv_1
+        conv_diff_xr = downsampler_diff_xr.conv_1
+        self.stride = conv_r.stride
+        self.pad = conv_r.pad
+        self.num_channels_r = conv_r.out_channels
+        self.W_diff_xr = conv_diff_xr.W
+        if no_backprop_diff_xr:
+            self.W = conv_r.W
+        else:
+            self.W = cf.concat((conv_r.W, conv_diff_xr.W), axis=0)
+
+    def update(self, r, delta):
+        self.r = r
+        out = cf.convolution_2d(delta, self.W, stride=self.stride, pad=self.pad)
+        if self.no_backprop_diff_xr:
+            # The gradient does not flow from x - r into the canvas
+            delta = chainer.as_array(delta)
+            out_diff_xr = cf.convolution_2d(
+                delta, self.W_diff_xr, stride=self.stride, pad=self.pad)
+            out_r = out
+        else:
+            out_r, out_diff_xr = cf.split_axis(
+                out, [self.num_channels_r], axis=1)
+        self.downsampled_r = self.downsampled_r + out_r
+        self.downsampled_diff_xr = self.downsampled_diff_xr - out_diff_xr
+
+    def downsample_r(self):
+        return self.downsampled_r
+
+    def downsample_diff_xr(self):
+        return self.downsampled_diff_xr
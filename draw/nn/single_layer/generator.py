@@ -3,43 +3,77 @@ import math
 import chainer
 import chainer.functions as cf
 import chainer.links as nn
-import cupy
 from chainer.backends import cuda
 from chainer.initializers import HeNormal
 
+from .. import serializers
+from . import inputs
+
 
 class LSTMCore(chainer.Chain):
-    def __init__(self, chz_channels, batchnorm_enabled, batchnorm_steps):
+    def __init__(self,
+                 chz_channels,
+                 batchnorm_enabled,
+                 batchnorm_steps,
+                 fused=False):
         super().__init__()
+        self.fused = fused
         with self.init_scope():
-            self.lstm_tanh = nn.Convolution2D(
-                None,
-                chz_channels,
-                ksize=5,
-                stride=1,
-                pad=2,
-                initialW=HeNormal(0.1))
-            self.lstm_i = nn.Convolution2D(
-                None,
-                chz_channels,
-                ksize=5,
-                stride=1,
-                pad=2,
-                initialW=HeNormal(0.1))
-            self.lstm_f = nn.Convolution2D(
-                None,
-                chz_channels,
-                ksize=5,
-                stride=1,
-                pad=2,
-                initialW=HeNormal(0.1))
-            self.lstm_o = nn.Convolution2D(
-                None,
-                chz_channels,
-                ksize=5,
-                stride=1,
-                pad=2,
-                initialW=HeNormal(0.1))
+            if fused:
+                # Gates i, f, tanh, o over the shared input in one convolution
+                self.lstm_gates = nn.Convolution2D(
+                    None,
+                    4 * chz_channels,
+                    ksize=5,
+                    stride=1,
+                    pad=2,
+                    initialW=HeNormal(0.1))
+                # Peephole connections of i, f (c_{t-1}) and o (c_t)
+                self.lstm_peephole_if = nn.Convolution2D(
+                    chz_channels,
+                    2 * chz_channels,
+                    ksize=5,
+                    stride=1,
+                    pad=2,
+                    nobias=True,
+                    initialW=HeNormal(0.1))
+                self.lstm_peephole_o = nn.Convolution2D(
+                    chz_channels,
+                    chz_channels,
+                    ksize=5,
+                    stride=1,
+                    pad=2,
+                    nobias=True,
+                    initialW=HeNormal(0.1))
+            else:
+                self.lstm_tanh = nn.Convolution2D(
+                    None,
+                    chz_channels,
+                    ksize=5,
+                    stride=1,
+                    pad=2,
+                    initialW=HeNormal(0.1))
+                self.lstm_i = nn.Convolution2D(
+                    None,
+                    chz_channels,
+                    ksize=5,
+                    stride=1,
+                    pad=2,
+                    initialW=HeNormal(0.1))
+                self.lstm_f = nn.Convolution2D(
+                    None,
+                    chz_channels,
+                    ksize=5,
+                    stride=1,
+                    pad=2,
+                    initialW=HeNormal(0.1))
+                self.lstm_o = nn.Convolution2D(
+                    None,
+                    chz_channels,
+                    ksize=5,
+                    stride=1,
+                    pad=2,
+                    initialW=HeNormal(0.1))
 
             if batchnorm_enabled:
                 batchnorm_i_array = chainer.ChainList()
@@ -85,42 +119,99 @@ class LSTMCore(chainer.Chain):
             return self.batchnorm_tanh_array[t](x)
         return x
 
+    # The states may be ZeroStates (see .inputs)
     def forward_onestep(self, prev_hg, prev_cg, prev_z, downsampled_prev_r,
                         batchnorm_step):
-        lstm_in = cf.concat((prev_hg, prev_z, downsampled_prev_r), axis=1)
-        lstm_in_peephole = cf.concat((lstm_in, prev_cg))
-        forget_gate = cf.sigmoid(
-            self.batchnorm_f(self.lstm_f(lstm_in_peephole), batchnorm_step))
+        lstm_in = inputs.concat((prev_hg, prev_z, downsampled_prev_r))
+        if self.fused:
+            return self.forward_onestep_fused(
+                inputs.convolution(self.lstm_gates, lstm_in), prev_cg,
+                batchnorm_step)
+        if inputs.is_zero(prev_cg):
+            # The forget gate is not needed, but its weights are initialized
+            # in the same order as when it runs
+            inputs.initialize(self.lstm_f, lstm_in + (prev_cg, ))
         input_gate = cf.sigmoid(
-            self.batchnorm_i(self.lstm_i(lstm_in_peephole), batchnorm_step))
-        next_c = forget_gate * prev_cg + input_gate * cf.tanh(
-            self.batchnorm_tanh(self.lstm_tanh(lstm_in), batchnorm_step))
-        lstm_in_peephole = cf.concat((lstm_in, next_c))
+            self.batchnorm_i(
+                inputs.convolution(self.lstm_i, lstm_in + (prev_cg, )),
+                batchnorm_step))
+        next_c = input_gate * cf.tanh(
+            self.batchnorm_tanh(
+                inputs.convolution(self.lstm_tanh, lstm_in), batchnorm_step))
+        if not inputs.is_zero(prev_cg):
+            forget_gate = cf.sigmoid(
+                self.batchnorm_f(
+                    inputs.convolution(self.lstm_f, lstm_in + (prev_cg, )),
+                    batchnorm_step))
+            next_c = forget_gate * prev_cg + next_c
         output_gate = cf.sigmoid(
-            self.batchnorm_o(self.lstm_o(lstm_in_peephole), batchnorm_step))
+            self.batchnorm_o(
+                inputs.convolution(self.lstm_o, lstm_in + (next_c, )),
+                batchnorm_step))
         next_h = output_gate * cf.tanh(next_c)
 
         return next_h, next_c
 
+    # gates: output of lstm_gates
+    def forward_onestep_fused(self, gates, prev_c, batchnorm_step):
+        gate_i, gate_f, gate_tanh, gate_o = cf.split_axis(gates, 4, axis=1)
+        if inputs.is_zero(prev_c):
+            input_gate = cf.sigmoid(self.batchnorm_i(gate_i, batchnorm_step))
+            next_c = input_gate * cf.tanh(
+                self.batchnorm_tanh(gate_tanh, batchnorm_step))
+        else:
+            peephole_i, peephole_f = cf.split_axis(
+                self.lstm_peephole_if(prev_c), 2, axis=1)
+            forget_gate = cf.sigmoid(
+                self.batchnorm_f(gate_f + peephole_f, batchnorm_step))
+            input_gate = cf.sigmoid(
+                self.batchnorm_i(gate_i + peephole_i, batchnorm_step))
+            next_c = forget_gate * prev_c + input_gate * cf.tanh(
+                self.batchnorm_tanh(gate_tanh, batchnorm_step))
+        output_gate = cf.sigmoid(
+            self.batchnorm_o(gate_o + self.lstm_peephole_o(next_c),
+                             batchnorm_step))
+        next_h = output_gate * cf.tanh(next_c)
+        return next_h, next_c
+
+    # Converts the weights of an unfused snapshot (see draw.nn.serializers)
+    def fuse_snapshot_arrays(self, arrays, prefix):
+        serializers.fuse_lstm_arrays(arrays, prefix)
+
 
 class GRUCore(chainer.Chain):
-    def __init__(self, chz_channels, batchnorm_enabled, batchnorm_steps):
+    def __init__(self,
+                 chz_channels,
+                 batchnorm_enabled,
+                 batchnorm_steps,
+                 fused=False):
         super().__init__()
+        self.fused = fused
         with self.init_scope():
-            self.gru_u = nn.Convolution2D(
-                None,
-                chz_channels,
-                ksize=5,
-                stride=1,
-                pad=2,
-                initialW=HeNormal(0.1))
-            self.gru_r = nn.Convolution2D(
-                None,
-                chz_channels,
-                ksize=5,
-                stride=1,
-                pad=2,
-                initialW=HeNormal(0.1))
+            if fused:
+                # Gates u, r over the shared input in one convolution
+                self.gru_gates = nn.Convolution2D(
+                    None,
+                    2 * chz_channels,
+                    ksize=5,
+                    stride=1,
+                    pad=2,
+                    initialW=HeNormal(0.1))
+            else:
+                self.gru_u = nn.Convolution2D(
+                    None,
+                    chz_channels,
+                    ksize=5,
+                    stride=1,
+                    pad=2,
+                    initialW=HeNormal(0.1))
+                self.gru_r = nn.Convolution2D(
+                    None,
+                    chz_channels,
+                    ksize=5,
+                    stride=1,
+                    pad=2,
+                    initialW=HeNormal(0.1))
             self.gru_tanh = nn.Convolution2D(
                 None,
                 chz_channels,
@@ -166,10 +257,13 @@ class GRUCore(chainer.Chain):
     def forward_onestep(self, prev_hg, prev_z, downsampled_prev_r,
                         batchnorm_step):
         lstm_in = cf.concat((prev_hg, prev_z, downsampled_prev_r), axis=1)
-        update_gate = cf.sigmoid(
-            self.batchnorm_u(self.gru_u(lstm_in), batchnorm_step))
-        reset_gate = cf.sigmoid(
-            self.batchnorm_r(self.gru_r(lstm_in), batchnorm_step))
+        if self.fused:
+            gate_u, gate_r = cf.split_axis(self.gru_gates(lstm_in), 2, axis=1)
+        else:
+            gate_u = self.gru_u(lstm_in)
+            gate_r = self.gru_r(lstm_in)
+        update_gate = cf.sigmoid(self.batchnorm_u(gate_u, batchnorm_step))
+        reset_gate = cf.sigmoid(self.batchnorm_r(gate_r, batchnorm_step))
 
         lstm_in_tanh = cf.concat(
             (prev_z, downsampled_prev_r, reset_gate * prev_hg), axis=1)
@@ -179,33 +273,62 @@ class GRUCore(chainer.Chain):
 
         return next_h
 
+    # Converts the weights of an unfused snapshot (see draw.nn.serializers)
+    def fuse_snapshot_arrays(self, arrays, prefix):
+        serializers.fuse_gru_arrays(arrays, prefix)
+
 
 class Prior(chainer.Chain):
-    def __init__(self, channels_z):
+    def __init__(self, channels_z, fused=False):
         super().__init__()
+        self.fused = fused
         with self.init_scope():
-            self.mean_z = nn.Convolution2D(
-                None,
-                channels_z,
-                ksize=5,
-                stride=1,
-                pad=2,
-                initialW=HeNormal(0.1))
-            self.ln_var_z = nn.Convolution2D(
-                None,
-                channels_z,
-                ksize=5,
-                stride=1,
-                pad=2,
-                initialW=HeNormal(0.1))
+            if fused:
+                self.mean_ln_var_z = nn.Convolution2D(
+                    None,
+                    channels_z * 2,
+                    ksize=5,
+                    stride=1,
+                    pad=2,
+                    initialW=HeNormal(0.1))
+            else:
+                self.mean_z = nn.Convolution2D(
+                    None,
+                    channels_z,
+                    ksize=5,
+                    stride=1,
+                    pad=2,
+                    initialW=HeNormal(0.1))
+                self.ln_var_z = nn.Convolution2D(
+                    None,
+                    channels_z,
+                    ksize=5,
+                    stride=1,
+                    pad=2,
+                    initialW=HeNormal(0.1))
 
+    # h may be a ZeroState, in which case only the bias is computed
     def compute_mean_z(self, h):
-        return self.mean_z(h)
+        if self.fused:
+            return self.compute_mean_and_ln_var_z(h)[0]
+        return inputs.convolution(self.mean_z, (h, ))
 
     def compute_ln_var_z(self, h):
-        return self.ln_var_z(h)
+        if self.fused:
+            return self.compute_mean_and_ln_var_z(h)[1]
+        return inputs.convolution(self.ln_var_z, (h, ))
+
+    def compute_mean_and_ln_var_z(self, h):
+        if self.fused:
+            mean, ln_var = cf.split_axis(
+                inputs.convolution(self.mean_ln_var_z, (h, )), 2, axis=1)
+            return mean, ln_var
+        return inputs.convolution(self.mean_z, (h, )), inputs.convolution(
+            self.ln_var_z, (h, ))
 
     def sample_z(self, h):
-        mean = self.compute_mean_z(h)
-        ln_var = self.compute_ln_var_z(h)
-        return cf.gaussian(mean, ln_var)
\ No newline at end of file
+        mean, ln_var = self.compute_mean_and_ln_var_z(h)
+        return cf.gaussian(mean, ln_var)
+
+    def fuse_snapshot_arrays(self, arrays, prefix):
+        serializers.fuse_gaussian_arrays(arrays, prefix)
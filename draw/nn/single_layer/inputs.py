@@ -0,0 +1,157 @@
+import chainer
+import chainer.functions as cf
+import numpy as np
+from chainer.utils import conv
+
+# Special inputs of the cores and heads. A convolution over concatenated
+# inputs is the sum of the convolutions over each of them, so convolution()
+# below skips the inputs that are known to be zero and computes the inputs
+# that do not change between steps only once.
+
+_zeros = {}
+
+
+# Zeros of the given shape and dtype, allocated once per device. The NumPy
+# arrays are read-only since they are shared.
+def zeros(shape, dtype, xp):
+    device = None if xp is np else xp.cuda.Device().id
+    key = (tuple(shape), np.dtype(dtype), device)
+    if key not in _zeros:
+        array = xp.zeros(shape, dtype=dtype)
+        if xp is np:
+            array.flags.writeable = False
+        _zeros[key] = array
+    return _zeros[key]
+
+
+# Recurrent state that is known to be zero, i.e. the initial h and c.
+class ZeroState():
+    def __init__(self, shape, dtype, xp):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.xp = xp
+
+    @property
+    def array(self):
+        return zeros(self.shape, self.dtype, self.xp)
+
+
+def is_zero(x):
+    return isinstance(x, ZeroState)
+
+
+# The array of a ZeroState, or x itself
+def as_array(x):
+    if is_zero(x):
+        return x.array
+    return x
+
+
+# An input of the inference cores that is the same at every step, i.e. the
+# downsampled x. Its contribution (and the bias) to every gate is computed
+# the first time the gate is used and added at the later steps, which
+# convolve the remaining inputs only.
+# Create one per forward pass, since the contributions are part of its graph.
+class InvariantInput():
+    def __init__(self, x):
+        self.x = x
+        self.contributions = {}
+
+    @property
+    def shape(self):
+        return self.x.shape
+
+
+# Inputs of a gate convolution: concatenated once if they are all arrays,
+# otherwise kept as a tuple for convolution()
+def concat(xs):
+    if any(is_zero(x) or isinstance(x, InvariantInput) for x in xs):
+        return tuple(xs)
+    return (cf.concat(xs, axis=1), )
+
+
+# Initializes the weights of a link as its first call on `inputs` would, for
+# a convolution that is skipped because its output is not needed
+def initialize(link, inputs):
+    if link.W.array is None:
+        link._initialize_params(sum(x.shape[1] for x in inputs))
+
+
+# Same as link(cf.concat(inputs, axis=1)) where `inputs` may contain
+# ZeroStates, whose part of the convolution is skipped, and an
+# InvariantInput. If every input is zero, the output is the bias broadcast
+# to the output shape, or a ZeroState for a link without a bias.
+def convolution(link, inputs):
+    if not any(is_zero(x) or isinstance(x, InvariantInput) for x in inputs):
+        if len(inputs) == 1:
+            return link(inputs[0])
+        return link(cf.concat(inputs, axis=1))
+
+    channels = [x.shape[1] for x in inputs]
+    initialize(link, inputs)
+    stride, pad = link.stride, link.pad
+    if isinstance(stride, int):
+        stride = (stride, stride)
+    if isinstance(pad, int):
+        pad = (pad, pad)
+
+    invariant = None
+    others = []
+    slices = []
+    offset = 0
+    for x, num_channels in zip(inputs, channels):
+        if isinstance(x, InvariantInput):
+            invariant = x
+            invariant_slice = slice(offset, offset + num_channels)
+        elif not is_zero(x):
+            others.append(x)
+            slices.append(slice(offset, offset + num_channels))
+        offset += num_channels
+
+    def weights_of_others():
+        if not slices:
+            return None
+        if len(slices) == 1:
+            return link.W[:, slices[0]]
+        return cf.concat([link.W[:, s] for s in slices], axis=1)
+
+    b = link.b
+    y = None
+    W_others = None
+    if invariant is None:
+        W_others = weights_of_others()
+    else:
+        # The slices of the weights are cached as well, for every set of
+        # inputs that are zero
+        key = id(link)
+        if key not in invariant.contributions:
+            invariant.contributions[key] = cf.convolution_2d(
+                invariant.x,
+                link.W[:, invariant_slice],
+                b,
+                stride=stride,
+                pad=pad)
+        y = invariant.contributions[key]
+        key = (id(link), tuple(is_zero(x) for x in inputs))
+        if key not in invariant.contributions:
+            invariant.contributions[key] = weights_of_others()
+        W_others = invariant.contributions[key]
+        b = None
+
+    if others:
+        x = others[0] if len(others) == 1 else cf.concat(others, axis=1)
+        out = cf.convolution_2d(x, W_others, b, stride=stride, pad=pad)
+        return out if y is None else out + y
+    if y is not None:
+        return y
+
+    batch_size, _, height, width = inputs[0].shape
+    kh, kw = link.ksize if isinstance(link.ksize, tuple) else (link.ksize,
+                                                               link.ksize)
+    shape = (batch_size, link.out_channels,
+             conv.get_conv_outsize(height, kh, stride[0], pad[0]),
+             conv.get_conv_outsize(width, kw, stride[1], pad[1]))
+    if b is None:
+        return ZeroState(shape, link.W.dtype, chainer.backend.get_array_module(
+            link.W.array))
+    return cf.broadcast_to(cf.reshape(b, (1, -1, 1, 1)), shape)
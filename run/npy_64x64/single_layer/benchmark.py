@@ -0,0 +1,418 @@
+import argparse
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+import chainer
+import numpy as np
+
+sys.path.append(os.path.join("..", "..", ".."))
+import draw
+from hyperparams import HyperParameters
+from models import LSTMModel, PosteriorSampler, PriorSampler
+
+
+def measure(func, xp, repeat, warmup=3):
+    for _ in range(warmup):
+        func()
+    draw.backend.synchronize(xp)
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    draw.backend.synchronize(xp)
+    return (time.perf_counter() - start_time) / repeat
+
+
+def benchmark_heads(args, xp):
+    h = xp.random.normal(
+        0, 1, (args.batch_size, args.chz_channels, 32, 32)).astype(xp.float32)
+    rows = []
+    for name, fused in (("separate", False), ("fused", True)):
+        prior = draw.nn.single_layer.generator.Prior(
+            channels_z=args.chz_channels, fused=fused)
+        if xp is not np:
+            prior.to_gpu()
+        with chainer.no_backprop_mode():
+            elapsed = measure(lambda: prior.sample_z(h), xp, args.repeat)
+        rows.append((name, elapsed))
+
+    baseline = rows[0][1]
+    for name, elapsed in rows:
+        print("{:<10} {:8.3f} ms/step  x{:.2f}".format(
+            name, elapsed * 1000, baseline / elapsed))
+
+
+# Peak bytes allocated while func runs, above what is allocated when it is
+# called. On the GPU this is the growth of the memory pool, which keeps the
+# blocks it has allocated, after its free blocks are released.
+def peak_bytes(func, xp):
+    if xp is np:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak - base
+    memory_pool = xp.get_default_memory_pool()
+    draw.backend.synchronize(xp)
+    memory_pool.free_all_blocks()
+    base = memory_pool.total_bytes()
+    func()
+    draw.backend.synchronize(xp)
+    return memory_pool.total_bytes() - base
+
+
+def build_model(args, xp, **hyperparams_values):
+    hyperparams = HyperParameters()
+    hyperparams.chz_channels = args.chz_channels
+    hyperparams.generator_generation_steps = args.generation_steps
+    hyperparams.generator_share_core = True
+    hyperparams.inference_share_core = True
+    for key, value in hyperparams_values.items():
+        setattr(hyperparams, key, value)
+    model = LSTMModel(hyperparams)
+    if xp is not np:
+        model.to_gpu()
+    return model
+
+
+# Peak memory and time of a forward and backward pass for each segment
+# length. The peak covers the recomputation of the segments and the
+# gradients during the backward pass.
+def benchmark_checkpointing(args, xp):
+    x = xp.random.uniform(
+        0, 1, (args.batch_size, 3, 64, 64)).astype(xp.float32)
+    for segment_length in args.segment_lengths:
+        model = build_model(
+            args, xp, checkpoint_segment_length=segment_length)
+        def forward():
+            z_t_params_array, (mu_x, ln_var_x), r_t_array = model.sample_z_and_x_params_from_posterior(
+                x)
+            _, loss_kld = draw.nn.functions.gaussian_kl_divergence_over_steps(
+                z_t_params_array)
+            _, loss_sse = draw.nn.functions.squared_error_over_steps(
+                r_t_array, x)
+            return chainer.functions.gaussian_nll(x, mu_x,
+                                                  ln_var_x) + loss_kld + loss_sse
+
+        def step():
+            model.cleargrads()
+            forward().backward()
+
+        step()
+        step_bytes = peak_bytes(step, xp)
+        elapsed = measure(step, xp, args.repeat, warmup=0)
+        print(
+            "segment_length {:>3}: peak {:9.1f} MiB  {:8.1f} ms/batch  {:6.1f} images/sec".
+            format(segment_length, step_bytes / 2**20, elapsed * 1000,
+                   args.batch_size / elapsed))
+
+
+def benchmark_prior_sampling(args, xp):
+    model = build_model(args, xp)
+    with chainer.no_backprop_mode():
+        model.sample_image_at_each_step_from_prior(1, xp)
+    sampler = PriorSampler(model, max_batch_size=args.batch_size)
+
+    def sample_with_graph():
+        with chainer.no_backprop_mode():
+            model.sample_image_at_each_step_from_prior(args.batch_size, xp)
+
+    rows = [
+        ("model", sample_with_graph),
+        ("sampler", lambda: sampler.sample_at_each_step(args.batch_size)),
+        ("final_only", lambda: sampler.sample(args.batch_size)),
+    ]
+    baseline = None
+    for name, func in rows:
+        elapsed = measure(func, xp, args.repeat)
+        baseline = baseline or elapsed
+        print("{:<10} {:8.1f} ms/batch  {:8.1f} images/sec  x{:.2f}".format(
+            name, elapsed * 1000, args.batch_size / elapsed,
+            baseline / elapsed))
+
+
+# Time from the previous yield (or the call) to each yield of a progressive
+# generator
+def step_latencies(iterator, xp):
+    latencies = []
+    start_time = time.perf_counter()
+    for t, r_t in iterator:
+        draw.backend.synchronize(xp)
+        now = time.perf_counter()
+        latencies.append(now - start_time)
+        start_time = now
+    return latencies
+
+
+def benchmark_progressive(args, xp):
+    model = build_model(args, xp)
+    x = xp.random.uniform(
+        0, 1, (args.batch_size, 3, 64, 64)).astype(xp.float32)
+    iterators = {
+        "posterior": lambda: model.iterate_images_from_posterior(x),
+        "prior": lambda: model.iterate_images_from_prior(args.batch_size, xp),
+    }
+    latencies = {}
+    for name, iterate in iterators.items():
+        step_latencies(iterate(), xp)
+        latencies[name] = np.mean(
+            [step_latencies(iterate(), xp) for _ in range(args.repeat)],
+            axis=0)
+
+    print("{:>4}  {:>14} {:>14}  {:>14} {:>14}".format(
+        "step", "posterior ms", "cumulative ms", "prior ms", "cumulative ms"))
+    cumulative = {name: np.cumsum(values) for name, values in latencies.items()}
+    for t in range(args.generation_steps):
+        print("{:>4}  {:14.1f} {:14.1f}  {:14.1f} {:14.1f}".format(
+            t, latencies["posterior"][t] * 1000,
+            cumulative["posterior"][t] * 1000, latencies["prior"][t] * 1000,
+            cumulative["prior"][t] * 1000))
+
+
+# Time of a training step and of a forward pass without a graph, downsampling
+# the canvas from scratch at every step and incrementally
+def benchmark_downsampling(args, xp):
+    model = build_model(args, xp)
+    x = xp.random.uniform(
+        0, 1, (args.batch_size, 3, 64, 64)).astype(xp.float32)
+
+    def step():
+        accumulator = draw.nn.losses.LossAccumulator()
+        model.accumulate_loss(x, accumulator)
+        model.cleargrads()
+        sum(accumulator.reduce()).backward()
+
+    def forward():
+        with chainer.no_backprop_mode():
+            model.accumulate_loss(x, draw.nn.losses.LossAccumulator())
+
+    for func_name, func in (("train", step), ("forward", forward)):
+        baseline = None
+        for name, incremental in (("full", False), ("incremental", True)):
+            model.hyperparams.incremental_downsampling = incremental
+            elapsed = measure(func, xp, args.repeat)
+            baseline = baseline or elapsed
+            print("{:<8} {:<12} {:8.1f} ms/batch  x{:.2f}".format(
+                func_name, name, elapsed * 1000, baseline / elapsed))
+
+
+# Time of a training step and of a forward pass without a graph with and
+# without the contribution of downsampled x to the inference gates computed
+# once, with separate and fused gates. The share of the inference gate
+# inputs that are x is the part of their convolutions that is saved.
+def benchmark_hoisting(args, xp):
+    x = xp.random.uniform(
+        0, 1, (args.batch_size, 3, 64, 64)).astype(xp.float32)
+    for fused_gates in (False, True):
+        model = build_model(args, xp, fused_gates=fused_gates)
+        x_channels = model.hyperparams.inference_downsampler_channels
+        in_channels = 2 * args.chz_channels + 2 * x_channels
+
+        def step():
+            accumulator = draw.nn.losses.LossAccumulator()
+            model.accumulate_loss(x, accumulator)
+            model.cleargrads()
+            sum(accumulator.reduce()).backward()
+
+        def forward():
+            with chainer.no_backprop_mode():
+                model.accumulate_loss(x, draw.nn.losses.LossAccumulator())
+
+        print(
+            "fused_gates={} - x is {:.1f}% of the inference gate inputs without peepholes".
+            format(fused_gates, 100 * x_channels / in_channels))
+        for func_name, func in (("train", step), ("forward", forward)):
+            baseline = None
+            for name, hoist in (("per step", False), ("hoisted", True)):
+                model.hyperparams.hoist_inference_x = hoist
+                elapsed = measure(func, xp, args.repeat)
+                baseline = baseline or elapsed
+                print("  {:<8} {:<9} {:8.1f} ms/batch  x{:.2f}".format(
+                    func_name, name, elapsed * 1000, baseline / elapsed))
+
+
+# Time of a training step with the shared prior computed at every step and
+# once over the hidden states of all steps, and of the prior alone
+def benchmark_batched_prior(args, xp):
+    model = build_model(args, xp, generator_share_prior=True)
+    x = xp.random.uniform(
+        0, 1, (args.batch_size, 3, 64, 64)).astype(xp.float32)
+    h_t_gen_array = [
+        chainer.Variable(
+            xp.random.normal(0, 1, (args.batch_size, args.chz_channels, 32,
+                                    32)).astype(xp.float32))
+        for _ in range(args.generation_steps)
+    ]
+    prior = model.get_generation_prior(0)
+
+    def step():
+        accumulator = draw.nn.losses.StackedLossAccumulator()
+        model.accumulate_loss(x, accumulator)
+        model.cleargrads()
+        sum(accumulator.reduce()).backward()
+
+    def prior_per_step():
+        model.cleargrads()
+        loss = 0
+        for h in h_t_gen_array:
+            mean_z_p, ln_var_z_p = prior.compute_mean_and_ln_var_z(h)
+            loss += chainer.functions.sum(mean_z_p) + chainer.functions.sum(
+                ln_var_z_p)
+        loss.backward()
+
+    def prior_batched():
+        model.cleargrads()
+        loss = 0
+        for mean_z_p, ln_var_z_p in model.compute_prior_over_steps(
+                h_t_gen_array):
+            loss += chainer.functions.sum(mean_z_p) + chainer.functions.sum(
+                ln_var_z_p)
+        loss.backward()
+
+    baseline = measure(prior_per_step, xp, args.repeat)
+    elapsed = measure(prior_batched, xp, args.repeat)
+    print("{:<6} {:<9} {:8.1f} ms/batch".format("prior", "per step",
+                                                  baseline * 1000))
+    print("{:<6} {:<9} {:8.1f} ms/batch  x{:.2f}".format(
+        "prior", "batched", elapsed * 1000, baseline / elapsed))
+    baseline = None
+    for name, batched in (("per step", False), ("batched", True)):
+        model.hyperparams.batched_prior = batched
+        elapsed = measure(step, xp, args.repeat)
+        baseline = baseline or elapsed
+        print("{:<6} {:<9} {:8.1f} ms/batch  x{:.2f}".format(
+            "train", name, elapsed * 1000, baseline / elapsed))
+
+
+# Generation of single images, as generate.py does, with the initial state as
+# ZeroStates against zero arrays: the first step alone and all the steps
+def benchmark_zero_state(args, xp):
+    model = build_model(args, xp)
+    generate_initial_state = model.generate_initial_state
+    prior = model.get_generation_prior(0)
+    core = model.get_generation_core(0)
+
+    def generate_initial_arrays(batch_size, xp, zero_states=False):
+        return generate_initial_state(batch_size, xp)
+
+    def first_step(zero_states):
+        h0_gen, c0_gen, r0, _, _ = generate_initial_state(
+            1, xp, zero_states=zero_states)
+        mean_z_p, ln_var_z_p = prior.compute_mean_and_ln_var_z(h0_gen)
+        z_t = chainer.functions.gaussian(mean_z_p, ln_var_z_p)
+        downsampled_r = model.generation_downsampler.downsample(r0)
+        core.forward_onestep(h0_gen, c0_gen, z_t, downsampled_r, 0)
+
+    def generate():
+        model.sample_image_at_each_step_from_prior(1, xp)
+
+    with chainer.no_backprop_mode(), chainer.using_config("train", False):
+        baseline = measure(lambda: first_step(False), xp, args.repeat)
+        elapsed = measure(lambda: first_step(True), xp, args.repeat)
+        print("{:<10} {:<7} {:8.2f} ms/image".format("first step", "arrays",
+                                                    baseline * 1000))
+        print("{:<10} {:<7} {:8.2f} ms/image  x{:.2f}".format(
+            "first step", "zero", elapsed * 1000, baseline / elapsed))
+        model.generate_initial_state = generate_initial_arrays
+        baseline = measure(generate, xp, args.repeat)
+        model.generate_initial_state = generate_initial_state
+        elapsed = measure(generate, xp, args.repeat)
+        print("{:<10} {:<7} {:8.2f} ms/image".format("generate", "arrays",
+                                                    baseline * 1000))
+        print("{:<10} {:<7} {:8.2f} ms/image  x{:.2f}".format(
+            "generate", "zero", elapsed * 1000, baseline / elapsed))
+
+
+# Peak bytes allocated by func above what is alive when it is called, and
+# the minor page faults it causes, which count the pages of freshly
+# allocated buffers touched for the first time. Page faults are only
+# measured on the CPU.
+def allocation_profile(func, xp):
+    if xp is np:
+        tracemalloc.start()
+        page_faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+        func()
+        page_faults = resource.getrusage(
+            resource.RUSAGE_SELF).ru_minflt - page_faults
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak, page_faults
+    memory_pool = xp.get_default_memory_pool()
+    draw.backend.synchronize(xp)
+    base = memory_pool.total_bytes()
+    func()
+    draw.backend.synchronize(xp)
+    return memory_pool.total_bytes() - base, 0
+
+
+# Reconstruction of a batch without a graph by LSTMModel, which allocates
+# every temporary of every step, and by PosteriorSampler, which reuses the
+# buffers of its Workspace. The workspace must not allocate after the first
+# batch.
+def benchmark_workspace(args, xp):
+    model = build_model(args, xp)
+    x = xp.random.uniform(
+        0, 1, (args.batch_size, 3, 64, 64)).astype(xp.float32)
+    with chainer.no_backprop_mode():
+        model.sample_z_and_x_params_from_posterior(x)
+    sampler = PosteriorSampler(model, max_batch_size=args.batch_size)
+
+    def sample_with_model():
+        with chainer.no_backprop_mode(), chainer.using_config(
+                "train", False):
+            model.sample_image_at_each_step_from_posterior(x)
+
+    rows = [
+        ("model", sample_with_model),
+        ("workspace", lambda: sampler.sample_at_each_step(x)),
+    ]
+    print("{:<10} {:>12} {:>14} {:>12} {:>10}".format(
+        "", "ms/batch", "peak MiB", "page faults", "buffers"))
+    baseline = None
+    for name, func in rows:
+        elapsed = measure(func, xp, args.repeat)
+        baseline = baseline or elapsed
+        num_allocations = sampler.workspace.num_allocations
+        peak, page_faults = allocation_profile(func, xp)
+        buffers = "-" if func is sample_with_model else str(
+            sampler.workspace.num_allocations - num_allocations)
+        print("{:<10} {:12.1f} {:14.1f} {:12d} {:>10}  x{:.2f}".format(
+            name, elapsed * 1000, peak / 2**20, page_faults, buffers,
+            baseline / elapsed))
+
+
+targets = {
+    "heads": benchmark_heads,
+    "checkpointing": benchmark_checkpointing,
+    "prior_sampling": benchmark_prior_sampling,
+    "progressive": benchmark_progressive,
+    "downsampling": benchmark_downsampling,
+    "hoisting": benchmark_hoisting,
+    "batched_prior": benchmark_batched_prior,
+    "zero_state": benchmark_zero_state,
+    "workspace": benchmark_workspace,
+}
+
+
+def main():
+    xp = draw.backend.get_xp(args.gpu_device)
+    targets[args.target](args, xp)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--target", "-target", type=str, choices=targets.keys(), required=True)
+    parser.add_argument("--gpu-device", "-gpu", type=int, default=-1)
+    parser.add_argument("--batch-size", "-b", type=int, default=36)
+    parser.add_argument("--chz-channels", "-z", type=int, default=320)
+    parser.add_argument("--repeat", "-repeat", type=int, default=20)
+    parser.add_argument("--generation-steps", "-gsteps", type=int, default=32)
+    parser.add_argument(
+        "--segment-lengths", type=int, nargs="+", default=[0, 1, 4, 8])
+    args = parser.parse_args()
+    main()
@@ -0,0 +1,242 @@
+import argparse
+import io
+import math
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.join("..", "..", ".."))
+import draw
+from hyperparams import HyperParameters
+from models import LSTMModel
+from models.codec import LatentCodec
+
+
+def printr(string):
+    sys.stdout.write(string)
+    sys.stdout.write("\r")
+    sys.stdout.flush()
+
+
+def make_uint8(x):
+    x = draw.backend.to_cpu(x).astype(np.float32)
+    return np.uint8(np.clip(x * 255, 0, 255)).transpose((0, 2, 3, 1))
+
+
+def load_codec(args):
+    hyperparams = HyperParameters(snapshot_directory=args.snapshot_directory)
+    model = LSTMModel(hyperparams, snapshot_directory=args.snapshot_directory)
+    if args.gpu_device >= 0:
+        model.to_gpu()
+    quantizer = draw.codec.LatentQuantizer(
+        step=args.quantization_step, max_deviation=args.max_deviation)
+    return LatentCodec(model, quantizer, num_lanes=args.num_lanes)
+
+
+def iterate_batches(args, xp):
+    images = draw.data.PackedDataset(args.dataset_path)
+    num_images = len(images)
+    if args.num_images is not None:
+        num_images = min(num_images, args.num_images)
+    dequantize = draw.data.Dequantize(noise=False)
+    for start in range(0, num_images, args.batch_size):
+        indices = np.arange(start, min(start + args.batch_size, num_images))
+        x_uint8 = images.take(indices)
+        x = dequantize(x_uint8)
+        if xp is not np:
+            x = draw.backend.to_gpu(x)
+        yield indices, x_uint8, x
+
+
+# x, y: uint8 images in NCHW
+def psnr(x, y):
+    mse = np.mean(
+        (x.astype(np.float64) - y.astype(np.float64))**2, axis=(1, 2, 3))
+    with np.errstate(divide="ignore"):
+        return 10 * np.log10(255**2 / mse)
+
+
+# Size in bytes and reconstruction of every image coded with PIL
+def baseline_codec(x_uint8, format, **options):
+    sizes = []
+    reconstructions = []
+    for image in x_uint8.transpose((0, 2, 3, 1)):
+        f = io.BytesIO()
+        Image.fromarray(image).save(f, format=format, **options)
+        sizes.append(f.tell())
+        f.seek(0)
+        reconstructions.append(np.asarray(Image.open(f).convert("RGB")))
+    return np.array(sizes), np.stack(reconstructions).transpose((0, 3, 1, 2))
+
+
+def encode(args):
+    xp = draw.backend.get_xp(args.gpu_device)
+    codec = load_codec(args)
+    os.makedirs(args.output_directory, exist_ok=True)
+    num_images = 0
+    total_bytes = 0
+    start_time = time.time()
+    for indices, x_uint8, x in iterate_batches(args, xp):
+        bitstreams, _, _ = codec.encode(x)
+        for index, bitstream in zip(indices, bitstreams):
+            data = bitstream.to_bytes()
+            with open(
+                    os.path.join(args.output_directory,
+                                 "{:08d}.draw".format(index)), "wb") as f:
+                f.write(data)
+            total_bytes += len(data)
+        num_images += len(indices)
+        printr("{} images - {:.1f} images/sec".format(
+            num_images, num_images / (time.time() - start_time)))
+    num_dims = num_images * 3 * np.prod(codec.model.hyperparams.image_size)
+    print("\033[2Kencoded {} images - {:.4f} bits/dim - {:.1f} images/sec".
+          format(num_images, total_bytes * 8 / num_dims,
+                 num_images / (time.time() - start_time)))
+
+
+def decode(args):
+    xp = draw.backend.get_xp(args.gpu_device)
+    codec = load_codec(args)
+    os.makedirs(args.output_directory, exist_ok=True)
+    filenames = sorted(
+        filename for filename in os.listdir(args.input_directory)
+        if filename.endswith(".draw"))
+    start_time = time.time()
+    for start in range(0, len(filenames), args.batch_size):
+        batch_filenames = filenames[start:start + args.batch_size]
+        bitstreams = []
+        for filename in batch_filenames:
+            with open(os.path.join(args.input_directory, filename), "rb") as f:
+                bitstream = draw.codec.Bitstream.from_bytes(f.read())
+            bitstreams.append(bitstream.truncate(args.steps))
+        r_t_array = codec.decode(bitstreams, xp=xp)
+        for filename, image in zip(batch_filenames,
+                                   make_uint8(r_t_array[-1])):
+            Image.fromarray(image).save(
+                os.path.join(args.output_directory,
+                             os.path.splitext(filename)[0] + ".png"))
+        num_images = start + len(batch_filenames)
+        printr("{} / {} images - {:.1f} images/sec".format(
+            num_images, len(filenames),
+            num_images / (time.time() - start_time)))
+    print("\033[2Kdecoded {} images".format(len(filenames)))
+
+
+# Rate and distortion after every step, checked against the decoder, next to
+# PNG and JPEG on the same images
+def evaluate(args):
+    xp = draw.backend.get_xp(args.gpu_device)
+    codec = load_codec(args)
+    generation_steps = codec.model.generation_steps
+    num_dims = 3 * np.prod(codec.model.hyperparams.image_size)
+    num_images = 0
+    rate = np.zeros(generation_steps)
+    kl_rate = np.zeros(generation_steps)
+    distortion = np.zeros(generation_steps)
+    baselines = [("png", "PNG", {})] + [("jpeg q{}".format(quality), "JPEG", {
+        "quality": quality
+    }) for quality in args.jpeg_quality]
+    baseline_rate = np.zeros(len(baselines))
+    baseline_distortion = np.zeros(len(baselines))
+    encode_time = 0
+    decode_time = 0
+
+    for indices, x_uint8, x in iterate_batches(args, xp):
+        start_time = time.time()
+        bitstreams, r_t_array, kld = codec.encode(x)
+        draw.backend.synchronize(xp)
+        encode_time += time.time() - start_time
+
+        start_time = time.time()
+        bitstreams = [
+            draw.codec.Bitstream.from_bytes(bitstream.to_bytes())
+            for bitstream in bitstreams
+        ]
+        decoded_r_t_array = codec.decode(bitstreams, xp=xp)
+        draw.backend.synchronize(xp)
+        decode_time += time.time() - start_time
+        error = max(
+            float(abs(a - b).max())
+            for a, b in zip(r_t_array, decoded_r_t_array))
+        if error > args.tolerance:
+            raise RuntimeError(
+                "decoded images differ from the encoder by {}".format(error))
+
+        for t in range(generation_steps):
+            rate[t] += sum(bitstream.size(t + 1) for bitstream in bitstreams)
+            distortion[t] += psnr(
+                x_uint8,
+                make_uint8(r_t_array[t]).transpose((0, 3, 1, 2))).sum()
+        kl_rate += np.cumsum(kld.sum(axis=1))
+        for k, (name, format, options) in enumerate(baselines):
+            sizes, reconstructions = baseline_codec(x_uint8, format,
+                                                    **options)
+            baseline_rate[k] += sizes.sum()
+            baseline_distortion[k] += psnr(x_uint8, reconstructions).sum()
+        num_images += len(indices)
+        printr("{} images".format(num_images))
+
+    print("\033[2K{} images - encode {:.1f} images/sec - decode {:.1f} images/sec".
+          format(num_images, num_images / encode_time,
+                 num_images / decode_time))
+    print("{:>10} {:>10} {:>12} {:>8}".format("steps", "bits/dim",
+                                             "kl bits/dim", "psnr"))
+    for t in range(generation_steps):
+        print("{:>10} {:10.4f} {:12.4f} {:8.2f}".format(
+            t + 1, rate[t] * 8 / num_images / num_dims,
+            kl_rate[t] / math.log(2) / num_images / num_dims,
+            distortion[t] / num_images))
+    for k, (name, _, _) in enumerate(baselines):
+        print("{:>10} {:10.4f} {:>12} {:8.2f}".format(
+            name, baseline_rate[k] * 8 / num_images / num_dims, "",
+            baseline_distortion[k] / num_images))
+
+
+def add_codec_arguments(parser):
+    parser.add_argument(
+        "--snapshot-directory", "-snapshot", type=str, required=True)
+    parser.add_argument("--gpu-device", "-gpu", type=int, default=-1)
+    parser.add_argument("--batch-size", "-b", type=int, default=64)
+    parser.add_argument("--quantization-step", type=float, default=1.0)
+    parser.add_argument("--max-deviation", type=float, default=8.0)
+    parser.add_argument("--num-lanes", type=int, default=64)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    encode_parser = subparsers.add_parser("encode")
+    add_codec_arguments(encode_parser)
+    encode_parser.add_argument(
+        "--dataset-path", "-dataset", type=str, required=True)
+    encode_parser.add_argument(
+        "--output-directory", "-output", type=str, required=True)
+    encode_parser.add_argument("--num-images", "-n", type=int, default=None)
+    encode_parser.set_defaults(func=encode)
+
+    decode_parser = subparsers.add_parser("decode")
+    add_codec_arguments(decode_parser)
+    decode_parser.add_argument(
+        "--input-directory", "-input", type=str, required=True)
+    decode_parser.add_argument(
+        "--output-directory", "-output", type=str, required=True)
+    decode_parser.add_argument("--steps", type=int, default=None)
+    decode_parser.set_defaults(func=decode)
+
+    evaluate_parser = subparsers.add_parser("evaluate")
+    add_codec_arguments(evaluate_parser)
+    evaluate_parser.add_argument(
+        "--dataset-path", "-dataset", type=str, required=True)
+    evaluate_parser.add_argument("--num-images", "-n", type=int, default=None)
+    evaluate_parser.add_argument(
+        "--jpeg-quality", type=int, nargs="+", default=[50, 90])
+    evaluate_parser.add_argument("--tolerance", type=float, default=1e-4)
+    evaluate_parser.set_defaults(func=evaluate)
+
+    args = parser.parse_args()
+    args.func(args)
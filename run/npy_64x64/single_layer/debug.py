@@ -8,8 +8,6 @@ import chainer
 import chainer.functions as cf
 import matplotlib.pyplot as plt
 import numpy as np
-import cupy as cp
-from chainer.backends import cuda
 from PIL import Image
 
 sys.path.append(os.path.join("..", "..", ".."))
@@ -24,20 +22,8 @@ def printr(string):
     sys.stdout.write("\r")
 
 
-def to_gpu(array):
-    if cuda.get_array_module(array) is np:
-        return cuda.to_gpu(array)
-    return array
-
-
-def to_cpu(array):
-    if cuda.get_array_module(array) is cp:
-        return cuda.to_cpu(array)
-    return array
-
-
 def make_uint8(x):
-    x = to_cpu(x)
+    x = draw.backend.to_cpu(x)
     if x.shape[0] == 3:
         x = x.transpose(1, 2, 0)
     return np.uint8(np.clip((x + 1) * 0.5 * 255, 0, 255))
@@ -65,11 +51,8 @@ def main():
     images_train = images[:args.batch_size]
     images_dev = images[args.batch_size:]
 
-    xp = np
     using_gpu = args.gpu_device >= 0
-    if using_gpu:
-        cuda.get_device(args.gpu_device).use()
-        xp = cp
+    xp = draw.backend.get_xp(args.gpu_device)
 
     hyperparams = HyperParameters()
     hyperparams.generator_share_core = args.generator_share_core
@@ -114,7 +97,9 @@ def main():
     axis_5 = figure.add_subplot(1, 5, 5)
 
     for iteration in range(args.training_steps):
-        x = to_gpu(images_train)
+        x = images_train
+        if using_gpu:
+            x = draw.backend.to_gpu(x)
         loss_kld = 0
 
         z_t_params_array, r_final = model.generate_z_params_and_x_from_posterior(
@@ -163,7 +148,9 @@ def main():
 
             with chainer.using_config("train", False), chainer.using_config(
                     "enable_backprop", False):
-                x_dev = to_gpu(x_dev)[None, ...]
+                x_dev = x_dev[None, ...]
+                if using_gpu:
+                    x_dev = draw.backend.to_gpu(x_dev)
                 _, r_final = model.generate_z_params_and_x_from_posterior(
                     x_dev)
                 mean_x_enc = r_final
@@ -181,7 +168,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "--snapshot-directory", "-snapshot", type=str, default="snapshot")
     parser.add_argument("--batch-size", "-b", type=int, default=36)
-    parser.add_argument("--gpu-device", "-gpu", type=int, default=0)
+    parser.add_argument("--gpu-device", "-gpu", type=int, default=-1)
     parser.add_argument("--training-steps", type=int, default=10**6)
     parser.add_argument("--generation-steps", "-gsteps", type=int, default=8)
     parser.add_argument(
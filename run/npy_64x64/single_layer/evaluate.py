@@ -0,0 +1,158 @@
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+import chainer
+import numpy as np
+
+sys.path.append(os.path.join("..", "..", ".."))
+import draw
+from hyperparams import HyperParameters
+from models import LSTMModel
+
+
+def printr(string):
+    sys.stdout.write(string)
+    sys.stdout.write("\r")
+    sys.stdout.flush()
+
+
+# Evaluates a snapshot on a held-out tail of the dataset (the images after
+# the first `--train-dev-split` fraction) with a single pass of the posterior
+# per batch. This split does not overlap the training images, unlike the dev
+# images of train.py, which start at num_dev_images and cover 90% of the
+# dataset. Every statistic is computed per image and aggregated with
+# draw.metrics.RunningStatistics. The rate-distortion curve is the cumulative
+# KL divergence against the squared error of the intermediate canvas r_t
+# after every step. These canvases are not the reconstructions of
+# sample_image_at_each_step_from_posterior(step_limit=k), which apply
+# generation_final_upsampler at step k - 1.
+def main():
+    xp = draw.backend.get_xp(args.gpu_device)
+
+    images = draw.data.PackedDataset(args.dataset_path)
+    num_images = len(images)
+    num_train_images = int(num_images * args.train_dev_split)
+    dataset = images.subset(np.arange(num_train_images, num_images))
+    if args.num_images is not None:
+        dataset = dataset.subset(np.arange(min(args.num_images,
+                                               len(dataset))))
+
+    hyperparams = HyperParameters(snapshot_directory=args.snapshot_directory)
+    hyperparams.print()
+    if hyperparams.use_gru:
+        raise ValueError("evaluate.py supports LSTMModel only")
+    model = LSTMModel(hyperparams, snapshot_directory=args.snapshot_directory)
+    if args.gpu_device >= 0:
+        model.to_gpu()
+
+    iterator = draw.data.Iterator(
+        dataset,
+        batch_size=args.batch_size,
+        drop_last=False,
+        sort_indices=True,
+        sampler=draw.data.Sampler(dataset, seed=args.seed))
+    loader = draw.data.PrefetchIterator(
+        dataset,
+        iterator,
+        num_prefetch=args.prefetch,
+        transform=draw.data.Dequantize(
+            noise=not args.no_dequantization_noise, seed=args.seed),
+        converter=lambda x: draw.backend.to_gpu(x, device=args.gpu_device)
+        if args.gpu_device >= 0 else x)
+
+    generation_steps = hyperparams.generator_generation_steps
+    num_dims = 3 * np.prod(hyperparams.image_size)
+    statistics = {
+        name: draw.metrics.RunningStatistics(shape)
+        for name, shape in (
+            ("negative_elbo", ()),
+            ("bits_per_dim", ()),
+            ("nll", ()),
+            ("kld", ()),
+            ("kld_per_step", (generation_steps, )),
+            ("rate_bits_per_dim", (generation_steps, )),
+            ("mse", (generation_steps, )),
+            ("psnr", (generation_steps, )),
+        )
+    }
+
+    start_time = time.time()
+    num_evaluated = 0
+    with chainer.no_backprop_mode(), chainer.using_config("train", False):
+        for _, x in loader:
+            accumulator = draw.nn.losses.PerImageLossAccumulator()
+            model.accumulate_loss(x, accumulator)
+            kld, sse, nll = [
+                draw.backend.to_cpu(array).astype(np.float64)
+                for array in accumulator.per_image()
+            ]
+            negative_elbo = nll + kld.sum(axis=1)
+            mse = sse / num_dims
+            with np.errstate(divide="ignore"):
+                psnr = 10 * np.log10(1 / mse)
+            # Densities of x in [0, 1] are turned into probabilities of the
+            # 256 levels of each dimension
+            statistics["negative_elbo"].update(negative_elbo)
+            statistics["bits_per_dim"].update(
+                (negative_elbo / num_dims + math.log(256)) / math.log(2))
+            statistics["nll"].update(nll)
+            statistics["kld"].update(kld.sum(axis=1))
+            statistics["kld_per_step"].update(kld)
+            statistics["rate_bits_per_dim"].update(
+                np.cumsum(kld, axis=1) / num_dims / math.log(2))
+            statistics["mse"].update(mse)
+            statistics["psnr"].update(psnr)
+
+            num_evaluated += x.shape[0]
+            printr("{} / {} images - {:.1f} images/sec".format(
+                num_evaluated, len(dataset),
+                num_evaluated / (time.time() - start_time)))
+    elapsed_time = time.time() - start_time
+
+    results = {
+        "snapshot_directory": args.snapshot_directory,
+        "dataset_path": args.dataset_path,
+        "num_images": num_evaluated,
+        "dequantization_noise": not args.no_dequantization_noise,
+        "elapsed_time": elapsed_time,
+        "statistics":
+        {name: stats.to_dict()
+         for name, stats in statistics.items()},
+    }
+    with open(args.output_path, "w") as f:
+        json.dump(results, f, indent=4)
+
+    print("\033[2K{} images - bits/dim: {:.4f} - negative elbo: {:.2f} nats - {:.1f} images/sec".
+          format(num_evaluated, float(statistics["bits_per_dim"].mean),
+                 float(statistics["negative_elbo"].mean),
+                 num_evaluated / elapsed_time))
+    print("{:>10} {:>12} {:>10} {:>8}".format("steps", "kl bits/dim", "mse",
+                                             "psnr"))
+    for t in range(generation_steps):
+        print("{:>10} {:12.4f} {:10.6f} {:8.2f}".format(
+            t + 1, statistics["rate_bits_per_dim"].mean[t],
+            statistics["mse"].mean[t], statistics["psnr"].mean[t]))
+    print("wrote {}".format(args.output_path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset-path", "-dataset", type=str, required=True)
+    parser.add_argument(
+        "--snapshot-directory", "-snapshot", type=str, required=True)
+    parser.add_argument(
+        "--output-path", "-output", type=str, default="evaluation.json")
+    parser.add_argument("--gpu-device", "-gpu", type=int, default=-1)
+    parser.add_argument("--batch-size", "-b", type=int, default=64)
+    parser.add_argument("--num-images", "-n", type=int, default=None)
+    parser.add_argument("--train-dev-split", type=float, default=0.9)
+    parser.add_argument("--prefetch", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-dequantization-noise", action="store_true")
+    args = parser.parse_args()
+    main()
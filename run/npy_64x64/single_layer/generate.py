@@ -8,8 +8,6 @@ import chainer
 import chainer.functions as cf
 import matplotlib.pyplot as plt
 import numpy as np
-import cupy as cp
-from chainer.backends import cuda
 from PIL import Image
 
 sys.path.append(os.path.join("..", "..", ".."))
@@ -24,20 +22,8 @@ def printr(string):
     sys.stdout.write("\r")
 
 
-def to_gpu(array):
-    if cuda.get_array_module(array) is np:
-        return cuda.to_gpu(array)
-    return array
-
-
-def to_cpu(array):
-    if cuda.get_array_module(array) is cp:
-        return cuda.to_cpu(array)
-    return array
-
-
 def make_uint8(x):
-    x = to_cpu(x)
+    x = draw.backend.to_cpu(x)
     if x.shape[0] == 3:
         x = x.transpose(1, 2, 0)
     return np.uint8(np.clip(x * 255, 0, 255))
@@ -49,28 +35,16 @@ def main():
     except:
         pass
 
-    images = []
-    files = os.listdir(args.dataset_path)
-    files.sort()
-    for filename in files:
-        image = np.load(os.path.join(args.dataset_path, filename))
-        image = image / 255
-        images.append(image)
-
-    images = np.vstack(images)
-    images = images.transpose((0, 3, 1, 2)).astype(np.float32)
+    images = draw.data.PackedDataset(args.dataset_path)
     train_dev_split = 0.9
-    num_images = images.shape[0]
+    num_images = len(images)
     num_train_images = int(num_images * train_dev_split)
     num_dev_images = num_images - num_train_images
-    images_train = images[:num_train_images]
-    images_dev = images[num_dev_images:]
+    images_train = images.subset(np.arange(num_train_images))
+    images_dev = images.subset(np.arange(num_dev_images, num_images))
 
-    xp = np
     using_gpu = args.gpu_device >= 0
-    if using_gpu:
-        cuda.get_device(args.gpu_device).use()
-        xp = cp
+    xp = draw.backend.get_xp(args.gpu_device)
 
     hyperparams = HyperParameters(snapshot_directory=args.snapshot_directory)
     hyperparams.print()
@@ -84,7 +58,7 @@ def main():
     if using_gpu:
         model.to_gpu()
 
-    dataset = draw.data.Dataset(images_dev)
+    dataset = images_dev
     iterator = draw.data.Iterator(dataset, batch_size=1)
 
     cols = hyperparams.generator_generation_steps
@@ -109,7 +83,8 @@ def main():
         with chainer.using_config("train", False), chainer.using_config(
                 "enable_backprop", False):
             x = dataset[data_indices]
-            x = to_gpu(x)
+            if using_gpu:
+                x = draw.backend.to_gpu(x)
             axis_1.imshow(make_uint8(x[0]))
 
             r_t_array, x_param = model.sample_image_at_each_step_from_posterior(
@@ -117,21 +92,21 @@ def main():
                 zero_variance=args.zero_variance,
                 step_limit=args.step_limit)
             for r_t, axis in zip(r_t_array, axis_rec_array[:-1]):
-                r_t = to_cpu(r_t)
+                r_t = draw.backend.to_cpu(r_t)
                 axis.imshow(make_uint8(r_t[0]))
 
             mu_x, ln_var_x = x_param
-            mu_x = to_cpu(mu_x.data)
+            mu_x = draw.backend.to_cpu(mu_x.data)
             axis_rec_array[-1].imshow(make_uint8(mu_x[0]))
 
             r_t_array, x_param = model.sample_image_at_each_step_from_prior(
                 batch_size=1, xp=xp)
             for r_t, axis in zip(r_t_array, axis_gen_array[:-1]):
-                r_t = to_cpu(r_t)
+                r_t = draw.backend.to_cpu(r_t)
                 axis.imshow(make_uint8(r_t[0]))
 
             mu_x, ln_var_x = x_param
-            mu_x = to_cpu(mu_x.data)
+            mu_x = draw.backend.to_cpu(mu_x.data)
             axis_gen_array[-1].imshow(make_uint8(mu_x[0]))
 
             plt.pause(0.01)
@@ -142,7 +117,7 @@ if __name__ == "__main__":
     parser.add_argument("--dataset-path", "-dataset", type=str, required=True)
     parser.add_argument(
         "--snapshot-directory", "-snapshot", type=str, required=True)
-    parser.add_argument("--gpu-device", "-gpu", type=int, default=0)
+    parser.add_argument("--gpu-device", "-gpu", type=int, default=-1)
     parser.add_argument("--step-limit", "-steps", type=int, default=None)
     parser.add_argument("--zero-variance", "-zero", action="store_true")
     args = parser.parse_args()
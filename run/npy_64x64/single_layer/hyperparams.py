@@ -19,6 +19,13 @@ class HyperParameters():
         self.batch_normalization_enabled = False
         self.no_backprop_diff_xr = False
         self.use_gru = False
+        self.fused_gates = False
+        self.fused_heads = False
+        self.checkpoint_segment_length = 0
+        self.incremental_downsampling = False
+        self.hoist_inference_x = False
+        self.batched_prior = False
+        self.dtype = "float32"
 
         if snapshot_directory is not None:
             json_path = os.path.join(snapshot_directory, self.filename)
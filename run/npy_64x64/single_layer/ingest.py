@@ -0,0 +1,30 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join("..", "..", ".."))
+import draw
+
+
+def main():
+    dataset = draw.data.ingest_image_directory(
+        args.image_directory,
+        args.output_directory,
+        image_size=(args.image_size, args.image_size),
+        flip=args.flip,
+        num_workers=args.num_workers)
+    print("packed {} images of shape {} into {}".format(
+        len(dataset), dataset.shape[1:], args.output_directory))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--image-directory", "-images", type=str, required=True)
+    parser.add_argument(
+        "--output-directory", "-output", type=str, required=True)
+    parser.add_argument("--image-size", type=int, default=64)
+    parser.add_argument("--flip", action="store_true")
+    parser.add_argument("--num-workers", "-workers", type=int, default=None)
+    args = parser.parse_args()
+    main()
@@ -1,2 +1,10 @@
-from .gru import GRUModel
-from .lstm import LSTMModel
\ No newline at end of file
+try:
+    import chainer
+except ImportError:
+    # Only PyTorchModel (models.pytorch) can be used without Chainer
+    chainer = None
+
+if chainer is not None:
+    from .gru import GRUModel
+    from .lstm import LSTMModel
+    from .sampler import PosteriorSampler, PriorSampler
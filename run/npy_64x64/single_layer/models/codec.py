@@ -0,0 +1,153 @@
+import os
+import sys
+
+import chainer
+import numpy as np
+
+sys.path.append(os.path.join("..", "..", "..", ".."))
+import draw
+
+
+# Lossy codec on top of an LSTMModel. Each step codes the posterior mean of
+# z_t quantized against the prior (see draw.codec.LatentQuantizer) in its
+# own chunk of the bitstream (see draw.codec.Bitstream). The encoder runs
+# the generator on the quantized latents, so its canvas after step t is the
+# one the decoder reconstructs from the first t + 1 chunks.
+# Encoder and decoder have to use the same snapshot and the same kind of
+# device. The prior is recomputed by the decoder and any difference only
+# changes the reconstruction slightly, since decoding the symbols does not
+# depend on it.
+class LatentCodec():
+    def __init__(self, model, quantizer, num_lanes=64):
+        self.model = model
+        self.quantizer = quantizer
+        self.num_lanes = num_lanes
+
+    def encode_symbols(self, symbols):
+        symbols = draw.backend.to_cpu(symbols)
+        return draw.codec.rans.encode(
+            symbols.reshape(symbols.shape[0], -1), self.quantizer.table,
+            self.num_lanes)
+
+    # Returns a Bitstream per image, the canvas after every step and the KL
+    # divergence of every step in nats of shape (generation_steps, batch_size)
+    def encode(self, x):
+        model = self.model
+        x = model.as_model_dtype(x)
+        batch_size = x.shape[0]
+        xp = draw.backend.get_array_module(x)
+        chunks = [[] for _ in range(batch_size)]
+        r_t_array = []
+        kld = []
+
+        with model.inference_scope():
+            h_t_gen, c_t_gen, r_t, h_t_enc, c_t_enc = model.generate_initial_state(
+                batch_size, xp, zero_states=True)
+            downsampled_x = model.downsample_x(x)
+
+            for t in range(model.generation_steps):
+                is_final_step = t == model.generation_steps - 1
+
+                mean_z_q, ln_var_z_q = model.get_inference_posterior(
+                    t).compute_mean_and_ln_var_z(h_t_enc)
+                mean_z_p, ln_var_z_p = model.get_generation_prior(
+                    t).compute_mean_and_ln_var_z(h_t_gen)
+                symbols = self.quantizer.quantize(mean_z_q.array,
+                                                  mean_z_p.array,
+                                                  ln_var_z_p.array)
+                z_t = self.quantizer.dequantize(symbols, mean_z_p.array,
+                                                ln_var_z_p.array)
+                for b, message in enumerate(self.encode_symbols(symbols)):
+                    chunks[b].append(message)
+                kld.append(
+                    draw.backend.to_cpu(
+                        draw.nn.functions.gaussian_kl_divergence(
+                            *[
+                                draw.nn.precision.as_float32(v)
+                                for v in (mean_z_q, ln_var_z_q, mean_z_p,
+                                          ln_var_z_p)
+                            ]).array))
+
+                batchnorm_step = t if model.hyperparams.generator_share_core else 1
+                downsampled_r = model.generation_downsampler.downsample(r_t)
+                h_next_gen, c_t_gen = model.get_generation_core(
+                    t).forward_onestep(h_t_gen, c_t_gen, z_t, downsampled_r,
+                                       batchnorm_step)
+
+                if is_final_step:
+                    x_param = model.generation_final_upsampler(h_next_gen)
+                    r_t = x_param[:, :3] + r_t
+                else:
+                    downsampled_diff_xr = model.inference_downsampler_diff_xr.downsample(
+                        x - r_t)
+                    batchnorm_step = t if model.hyperparams.inference_share_core else 1
+                    h_t_enc, c_t_enc = model.get_inference_core(
+                        t).forward_onestep(h_t_gen, h_t_enc, c_t_enc,
+                                           downsampled_x, downsampled_diff_xr,
+                                           batchnorm_step)
+                    r_t = r_t + model.get_generation_upsampler(t)(h_next_gen)
+                h_t_gen = h_next_gen
+                r_t_array.append(chainer.as_array(r_t))
+
+        bitstreams = [
+            draw.codec.Bitstream(chunks[b], self.num_lanes,
+                                 self.quantizer.step, self.quantizer.max_index)
+            for b in range(batch_size)
+        ]
+        return bitstreams, r_t_array, np.stack(kld)
+
+    # Decodes bitstreams that have the same number of steps and the same
+    # quantizer, which may be fewer steps than the model has. Returns the
+    # canvas after every decoded step.
+    def decode(self, bitstreams, xp=np):
+        model = self.model
+        bitstream = bitstreams[0]
+        for other in bitstreams[1:]:
+            if (other.num_steps, other.num_lanes, other.step,
+                    other.max_index) != (bitstream.num_steps,
+                                         bitstream.num_lanes, bitstream.step,
+                                         bitstream.max_index):
+                raise ValueError(
+                    "bitstreams decoded together must have the same steps and quantizer"
+                )
+        if bitstream.num_steps > model.generation_steps:
+            raise ValueError("bitstream has {} steps, the model {}".format(
+                bitstream.num_steps, model.generation_steps))
+        quantizer = draw.codec.LatentQuantizer(
+            bitstream.step, max_index=bitstream.max_index)
+        batch_size = len(bitstreams)
+        r_t_array = []
+
+        with model.inference_scope():
+            h_t_gen, c_t_gen, r_t, _, _ = model.generate_initial_state(
+                batch_size, xp, zero_states=True)
+            shape = h_t_gen.shape
+
+            for t in range(bitstream.num_steps):
+                is_final_step = t == model.generation_steps - 1
+
+                symbols = draw.codec.rans.decode(
+                    [other.chunks[t] for other in bitstreams],
+                    quantizer.table,
+                    int(np.prod(shape[1:])), bitstream.num_lanes)
+                if xp is not np:
+                    symbols = draw.backend.to_gpu(symbols)
+                mean_z_p, ln_var_z_p = model.get_generation_prior(
+                    t).compute_mean_and_ln_var_z(h_t_gen)
+                z_t = quantizer.dequantize(
+                    symbols.reshape(shape), mean_z_p.array, ln_var_z_p.array)
+
+                batchnorm_step = t if model.hyperparams.generator_share_core else 1
+                downsampled_r = model.generation_downsampler.downsample(r_t)
+                h_t_gen, c_t_gen = model.get_generation_core(
+                    t).forward_onestep(h_t_gen, c_t_gen, z_t, downsampled_r,
+                                       batchnorm_step)
+
+                if is_final_step:
+                    x_param = model.generation_final_upsampler(h_t_gen)
+                    r_t = x_param[:, :3] + r_t
+                else:
+                    r_t = r_t + model.get_generation_upsampler(t)(h_t_gen)
+                r_t_array.append(chainer.as_array(r_t))
+
+        return r_t_array
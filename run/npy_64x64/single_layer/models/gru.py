@@ -2,10 +2,8 @@ import os
 import sys
 import chainer
 import uuid
-import cupy
 import chainer.functions as cf
 from chainer.serializers import load_hdf5, save_hdf5
-from chainer.backends import cuda
 
 sys.path.append(os.path.join("..", "..", "..", ".."))
 import draw
@@ -18,6 +16,7 @@ class GRUModel():
         assert isinstance(hyperparams, HyperParameters)
         self.generation_steps = hyperparams.generator_generation_steps
         self.hyperparams = hyperparams
+        self.dtype = draw.nn.precision.get_dtype(hyperparams.dtype)
         self.parameters = chainer.ChainList()
 
         self.generation_cores, self.generation_priors, self.generation_downsampler, self.generation_upsamplers = self.build_generation_network(
@@ -37,10 +36,24 @@ class GRUModel():
                 filepath = os.path.join(snapshot_directory, self.filename)
                 if os.path.exists(filepath) and os.path.isfile(filepath):
                     print("loading {}".format(filepath))
-                    load_hdf5(filepath, self.parameters)
+                    self.load(filepath)
             except Exception as error:
                 print(error)
 
+    @draw.nn.precision.using_model_dtype
+    def load(self, filepath):
+        if not (self.hyperparams.fused_gates
+                or self.hyperparams.fused_heads):
+            load_hdf5(filepath, self.parameters)
+            return
+        # Snapshots saved without fused gates or heads are converted on the fly
+        arrays = draw.nn.serializers.load_hdf5_arrays(filepath)
+        for index, link in enumerate(self.parameters):
+            if getattr(link, "fused", False):
+                link.fuse_snapshot_arrays(arrays, "{}/".format(index))
+        draw.nn.serializers.load_arrays(arrays, self.parameters)
+
+    @draw.nn.precision.using_model_dtype
     def build_generation_network(self, generation_steps, chz_channels,
                                  downsampler_channels, batchnorm_enabled):
         core_array = []
@@ -54,7 +67,8 @@ class GRUModel():
                 core = draw.nn.single_layer.generator.GRUCore(
                     chz_channels=chz_channels,
                     batchnorm_enabled=batchnorm_enabled,
-                    batchnorm_steps=batchnorm_steps)
+                    batchnorm_steps=batchnorm_steps,
+                    fused=self.hyperparams.fused_gates)
                 core_array.append(core)
                 self.parameters.append(core)
 
@@ -62,7 +76,8 @@ class GRUModel():
             num_priors = 1 if self.hyperparams.generator_share_prior else generation_steps
             for _ in range(num_priors):
                 prior = draw.nn.single_layer.generator.Prior(
-                    channels_z=chz_channels)
+                    channels_z=chz_channels,
+                    fused=self.hyperparams.fused_heads)
                 prior_array.append(prior)
                 self.parameters.append(prior)
 
@@ -82,6 +97,7 @@ class GRUModel():
 
         return core_array, prior_array, downsampler_x_h, upsampler_h_x_array
 
+    @draw.nn.precision.using_model_dtype
     def build_inference_network(self, generation_steps, chz_channels,
                                 downsampler_channels, batchnorm_enabled):
         core_array = []
@@ -94,7 +110,8 @@ class GRUModel():
                 core = draw.nn.single_layer.inference.GRUCore(
                     chz_channels=chz_channels,
                     batchnorm_enabled=batchnorm_enabled,
-                    batchnorm_steps=batchnorm_steps)
+                    batchnorm_steps=batchnorm_steps,
+                    fused=self.hyperparams.fused_gates)
                 core_array.append(core)
                 self.parameters.append(core)
 
@@ -102,7 +119,8 @@ class GRUModel():
             num_posteriors = 1 if self.hyperparams.inference_share_posterior else generation_steps
             for t in range(num_posteriors):
                 posterior = draw.nn.single_layer.inference.Posterior(
-                    channels_z=chz_channels)
+                    channels_z=chz_channels,
+                    fused=self.hyperparams.fused_heads)
                 posteriors.append(posterior)
                 self.parameters.append(posterior)
 
@@ -119,9 +137,15 @@ class GRUModel():
     def to_gpu(self):
         self.parameters.to_gpu()
 
+    def to_cpu(self):
+        self.parameters.to_cpu()
+
     def cleargrads(self):
         self.parameters.cleargrads()
 
+    def as_model_dtype(self, x):
+        return x.astype(self.dtype, copy=False)
+
     @property
     def filename(self):
         return "model.hdf5"
@@ -142,29 +166,31 @@ class GRUModel():
                 batch_size,
                 self.hyperparams.chz_channels,
             ) + chrz_size,
-            dtype="float32")
+            dtype=self.dtype)
         r0 = xp.zeros(
             (
                 batch_size,
                 3,
-            ) + self.hyperparams.image_size, dtype="float32")
+            ) + self.hyperparams.image_size, dtype=self.dtype)
         h0_e = xp.zeros(
             (
                 batch_size,
                 self.hyperparams.chz_channels,
             ) + chrz_size,
-            dtype="float32")
+            dtype=self.dtype)
         return h0_g, r0, h0_e
 
+    @draw.nn.precision.using_model_dtype
     def sample_image_at_each_step_from_posterior(self, x, zero_variance=False):
+        x = self.as_model_dtype(x)
         batch_size = x.shape[0]
-        xp = cuda.get_array_module(x)
+        xp = draw.backend.get_array_module(x)
         h0_gen, r0, h0_enc = self.generate_initial_state(batch_size, xp)
 
         h_t_enc = h0_enc
         h_t_gen = h0_gen
         r_t = chainer.Variable(r0)
-        downsampled_x = self.inference_downsampler_x.downsample(x)
+        downsampled_x = self.downsample_x(x)
 
         r_t_array = []
 
@@ -181,8 +207,8 @@ class GRUModel():
             h_next_enc = inference_core.forward_onestep(
                 h_t_gen, h_t_enc, downsampled_x, diff_xr_d, batchnorm_step)
 
-            mean_z_q = inference_posterior.compute_mean_z(h_t_enc)
-            ln_var_z_q = inference_posterior.compute_ln_var_z(h_t_enc)
+            mean_z_q, ln_var_z_q = inference_posterior.compute_mean_and_ln_var_z(
+                h_t_enc)
             if zero_variance:
                 ze_t = mean_z_q
             else:
@@ -201,15 +227,17 @@ class GRUModel():
 
         return r_t_array
 
+    @draw.nn.precision.using_model_dtype
     def sample_z_params_and_x_from_posterior(self, x):
+        x = self.as_model_dtype(x)
         batch_size = x.shape[0]
-        xp = cuda.get_array_module(x)
+        xp = draw.backend.get_array_module(x)
         h0_gen, r0, h0_enc = self.generate_initial_state(batch_size, xp)
 
         h_t_enc = h0_enc
         h_t_gen = h0_gen
         r_t = chainer.Variable(r0)
-        downsampled_x = self.inference_downsampler_x.downsample(x)
+        downsampled_x = self.downsample_x(x)
 
         z_t_params_array = []
 
@@ -230,12 +258,12 @@ class GRUModel():
             h_next_enc = inference_core.forward_onestep(
                 h_t_gen, h_t_enc, downsampled_x, diff_xr_d, batchnorm_step)
 
-            mean_z_q = inference_posterior.compute_mean_z(h_t_enc)
-            ln_var_z_q = inference_posterior.compute_ln_var_z(h_t_enc)
+            mean_z_q, ln_var_z_q = inference_posterior.compute_mean_and_ln_var_z(
+                h_t_enc)
             ze_t = cf.gaussian(mean_z_q, ln_var_z_q)
 
-            mean_z_p = generation_piror.compute_mean_z(h_t_gen)
-            ln_var_z_p = generation_piror.compute_ln_var_z(h_t_gen)
+            mean_z_p, ln_var_z_p = generation_piror.compute_mean_and_ln_var_z(
+                h_t_gen)
 
             batchnorm_step = t if self.hyperparams.generator_share_core else 1
             downsampled_r_t = self.generation_downsampler.downsample(r_t)
@@ -251,6 +279,15 @@ class GRUModel():
 
         return z_t_params_array, r_t
 
+    # downsampled x for the inference cores, whose contribution to the gates
+    # is computed once if hyperparams.hoist_inference_x is set (see
+    # draw.nn.single_layer.inputs.InvariantInput)
+    def downsample_x(self, x):
+        downsampled_x = self.inference_downsampler_x.downsample(x)
+        if self.hyperparams.hoist_inference_x:
+            return draw.nn.single_layer.inputs.InvariantInput(downsampled_x)
+        return downsampled_x
+
     def get_generation_core(self, t):
         if self.hyperparams.generator_share_core:
             return self.generation_cores[0]
@@ -276,6 +313,7 @@ class GRUModel():
             return self.inference_posteriors[0]
         return self.inference_posteriors[t]
 
+    @draw.nn.precision.using_model_dtype
     def sample_image_at_each_step_from_prior(self, batch_size, xp):
         h0_gen, r0, _ = self.generate_initial_state(batch_size, xp)
         h_t_gen = h0_gen
@@ -288,9 +326,7 @@ class GRUModel():
 
             batchnorm_step = t if self.hyperparams.generator_share_core else 1
 
-            mean_z_q = generation_piror.compute_mean_z(h_t_gen)
-            ln_var_z_q = generation_piror.compute_ln_var_z(h_t_gen)
-            z_t_gen = cf.gaussian(mean_z_q, ln_var_z_q)
+            z_t_gen = generation_piror.sample_z(h_t_gen)
             downsampled_r_t = self.generation_downsampler.downsample(r_t)
             h_next_gen = generation_core.forward_onestep(
                 h_t_gen, z_t_gen, downsampled_r_t, batchnorm_step)
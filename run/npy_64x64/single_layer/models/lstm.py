@@ -1,11 +1,13 @@
+import contextlib
+import functools
 import os
 import sys
+import time
 import chainer
 import uuid
-import cupy
 import chainer.functions as cf
 from chainer.serializers import load_hdf5, save_hdf5
-from chainer.backends import cuda
+import numpy as np
 
 sys.path.append(os.path.join("..", "..", "..", ".."))
 import draw
@@ -18,6 +20,9 @@ class LSTMModel():
         assert isinstance(hyperparams, HyperParameters)
         self.generation_steps = hyperparams.generator_generation_steps
         self.hyperparams = hyperparams
+        self.dtype = draw.nn.precision.get_dtype(hyperparams.dtype)
+        if hyperparams.batched_prior and not hyperparams.generator_share_prior:
+            raise ValueError("batched_prior requires generator_share_prior")
         self.parameters = chainer.ChainList()
 
         self.generation_cores, self.generation_priors, self.generation_downsampler, self.generation_upsamplers, self.generation_final_upsampler = self.build_generation_network(
@@ -37,10 +42,24 @@ class LSTMModel():
                 filepath = os.path.join(snapshot_directory, self.filename)
                 if os.path.exists(filepath) and os.path.isfile(filepath):
                     print("loading {}".format(filepath))
-                    load_hdf5(filepath, self.parameters)
+                    self.load(filepath)
             except Exception as error:
                 print(error)
 
+    @draw.nn.precision.using_model_dtype
+    def load(self, filepath):
+        if not (self.hyperparams.fused_gates
+                or self.hyperparams.fused_heads):
+            load_hdf5(filepath, self.parameters)
+            return
+        # Snapshots saved without fused gates or heads are converted on the fly
+        arrays = draw.nn.serializers.load_hdf5_arrays(filepath)
+        for index, link in enumerate(self.parameters):
+            if getattr(link, "fused", False):
+                link.fuse_snapshot_arrays(arrays, "{}/".format(index))
+        draw.nn.serializers.load_arrays(arrays, self.parameters)
+
+    @draw.nn.precision.using_model_dtype
     def build_generation_network(self, generation_steps, chz_channels,
                                  downsampler_channels, batchnorm_enabled):
         core_array = []
@@ -54,7 +73,8 @@ class LSTMModel():
                 core = draw.nn.single_layer.generator.LSTMCore(
                     chz_channels=chz_channels,
                     batchnorm_enabled=batchnorm_enabled,
-                    batchnorm_steps=batchnorm_steps)
+                    batchnorm_steps=batchnorm_steps,
+                    fused=self.hyperparams.fused_gates)
                 core_array.append(core)
                 self.parameters.append(core)
 
@@ -62,7 +82,8 @@ class LSTMModel():
             num_priors = 1 if self.hyperparams.generator_share_prior else generation_steps
             for _ in range(num_priors):
                 prior = draw.nn.single_layer.generator.Prior(
-                    channels_z=chz_channels)
+                    channels_z=chz_channels,
+                    fused=self.hyperparams.fused_heads)
                 prior_array.append(prior)
                 self.parameters.append(prior)
 
@@ -87,6 +108,7 @@ class LSTMModel():
 
         return core_array, prior_array, downsampler_x_h, upsampler_h_x_array, final_upsampler
 
+    @draw.nn.precision.using_model_dtype
     def build_inference_network(self, generation_steps, chz_channels,
                                 downsampler_channels, batchnorm_enabled):
         core_array = []
@@ -99,7 +121,8 @@ class LSTMModel():
                 core = draw.nn.single_layer.inference.LSTMCore(
                     chz_channels=chz_channels,
                     batchnorm_enabled=batchnorm_enabled,
-                    batchnorm_steps=batchnorm_steps)
+                    batchnorm_steps=batchnorm_steps,
+                    fused=self.hyperparams.fused_gates)
                 core_array.append(core)
                 self.parameters.append(core)
 
@@ -107,7 +130,8 @@ class LSTMModel():
             num_posteriors = 1 if self.hyperparams.inference_share_posterior else generation_steps
             for t in range(num_posteriors):
                 posterior = draw.nn.single_layer.inference.Posterior(
-                    channels_z=chz_channels)
+                    channels_z=chz_channels,
+                    fused=self.hyperparams.fused_heads)
                 posteriors.append(posterior)
                 self.parameters.append(posterior)
 
@@ -124,9 +148,15 @@ class LSTMModel():
     def to_gpu(self):
         self.parameters.to_gpu()
 
+    def to_cpu(self):
+        self.parameters.to_cpu()
+
     def cleargrads(self):
         self.parameters.cleargrads()
 
+    def as_model_dtype(self, x):
+        return x.astype(self.dtype, copy=False)
+
     @property
     def filename(self):
         return "model.hdf5"
@@ -140,39 +170,26 @@ class LSTMModel():
         os.rename(
             os.path.join(path, tmp_filename), os.path.join(path, filename))
 
-    def generate_initial_state(self, batch_size, xp):
+    # The zeros are allocated once per batch size (see
+    # draw.nn.single_layer.inputs.zeros), so they must not be modified. With
+    # `zero_states`, h and c are ZeroStates, for which the first step skips
+    # the convolutions of h and c and computes the t=0 prior and posterior
+    # from their bias alone. Batch normalization needs every gate, so arrays
+    # are returned with it.
+    def generate_initial_state(self, batch_size, xp, zero_states=False):
         chrz_size = (32, 32)
-        initial_h_gen = xp.zeros(
-            (
-                batch_size,
-                self.hyperparams.chz_channels,
-            ) + chrz_size,
-            dtype="float32")
-        initial_c_gen = xp.zeros(
-            (
-                batch_size,
-                self.hyperparams.chz_channels,
-            ) + chrz_size,
-            dtype="float32")
-        initial_r = xp.zeros(
-            (
-                batch_size,
-                3,
-            ) + self.hyperparams.image_size, dtype="float32")
-        initial_h_enc = xp.zeros(
-            (
-                batch_size,
-                self.hyperparams.chz_channels,
-            ) + chrz_size,
-            dtype="float32")
-        initial_c_enc = xp.zeros(
-            (
-                batch_size,
-                self.hyperparams.chz_channels,
-            ) + chrz_size,
-            dtype="float32")
-        return initial_h_gen, initial_c_gen, initial_r, initial_h_enc, initial_c_enc
-
+        state_shape = (batch_size, self.hyperparams.chz_channels) + chrz_size
+        if zero_states and not self.hyperparams.batch_normalization_enabled:
+            zero_state = draw.nn.single_layer.inputs.ZeroState(
+                state_shape, self.dtype, xp)
+        else:
+            zero_state = draw.nn.single_layer.inputs.zeros(
+                state_shape, self.dtype, xp)
+        initial_r = draw.nn.single_layer.inputs.zeros(
+            (batch_size, 3) + self.hyperparams.image_size, self.dtype, xp)
+        return zero_state, zero_state, initial_r, zero_state, zero_state
+
+    @draw.nn.precision.using_model_dtype
     def sample_image_at_each_step_from_posterior(self,
                                                  x,
                                                  zero_variance=False,
@@ -180,17 +197,19 @@ class LSTMModel():
         if step_limit is None:
             step_limit = self.hyperparams.generator_generation_steps
 
+        x = self.as_model_dtype(x)
         batch_size = x.shape[0]
-        xp = cuda.get_array_module(x)
+        xp = draw.backend.get_array_module(x)
         h0_gen, c0_gen, initial_r, h0_enc, c0_enc = self.generate_initial_state(
-            batch_size, xp)
+            batch_size, xp, zero_states=True)
 
         h_t_enc = h0_enc
         c_t_enc = c0_enc
         h_t_gen = h0_gen
         c_t_gen = c0_gen
         r_t = chainer.Variable(initial_r)
-        downsampled_x = self.inference_downsampler_x.downsample(x)
+        downsampled_x = self.downsample_x(x)
+        canvas = self.canvas_downsampler(x, r_t)
 
         r_t_array = []
 
@@ -205,24 +224,22 @@ class LSTMModel():
             else:
                 generation_upsampler = self.get_generation_upsampler(t)
 
-            diff_xr = x - r_t
-            downsampled_diff_xr = self.inference_downsampler_diff_xr.downsample(
-                diff_xr)
+            downsampled_diff_xr = canvas.downsample_diff_xr()
 
             batchnorm_step = t if self.hyperparams.inference_share_core else 1
             h_next_enc, c_next_enc = inference_core.forward_onestep(
                 h_t_gen, h_t_enc, c_t_enc, downsampled_x, downsampled_diff_xr,
                 batchnorm_step)
 
-            mean_z_q = inference_posterior.compute_mean_z(h_t_enc)
-            ln_var_z_q = inference_posterior.compute_ln_var_z(h_t_enc)
+            mean_z_q, ln_var_z_q = inference_posterior.compute_mean_and_ln_var_z(
+                h_t_enc)
             if zero_variance:
                 z_t = mean_z_q
             else:
                 z_t = cf.gaussian(mean_z_q, ln_var_z_q)
 
             batchnorm_step = t if self.hyperparams.generator_share_core else 1
-            downsampled_r = self.generation_downsampler.downsample(r_t)
+            downsampled_r = canvas.downsample_r()
             h_next_gen, c_next_gen = generation_core.forward_onestep(
                 h_t_gen, c_t_gen, z_t, downsampled_r, batchnorm_step)
 
@@ -236,26 +253,36 @@ class LSTMModel():
                 h_t_enc = h_next_enc
                 c_t_enc = c_next_enc
 
-                r_t = r_t + generation_upsampler(h_next_gen)
+                delta = generation_upsampler(h_next_gen)
+                r_t = r_t + delta
+                canvas.update(r_t, delta)
                 r_t_array.append(r_t.data)
 
         return r_t_array, (mu_x, ln_var_x)
 
+    @draw.nn.precision.using_model_dtype
     def sample_z_and_x_params_from_posterior(self, x):
+        if self.hyperparams.checkpoint_segment_length > 0:
+            return self.sample_z_and_x_params_from_posterior_with_checkpointing(
+                x, self.hyperparams.checkpoint_segment_length)
+
+        x = self.as_model_dtype(x)
         batch_size = x.shape[0]
-        xp = cuda.get_array_module(x)
+        xp = draw.backend.get_array_module(x)
         h0_gen, c0_gen, initial_r, h0_enc, c0_enc = self.generate_initial_state(
-            batch_size, xp)
+            batch_size, xp, zero_states=True)
 
         h_t_enc = h0_enc
         c_t_enc = c0_enc
         h_t_gen = h0_gen
         c_t_gen = c0_gen
         r_t = chainer.Variable(initial_r)
-        downsampled_x = self.inference_downsampler_x.downsample(x)
+        downsampled_x = self.downsample_x(x)
+        canvas = self.canvas_downsampler(x, r_t)
 
         z_t_params_array = []
         r_t_array = []
+        h_t_gen_array = []
 
         for t in range(self.generation_steps):
             is_final_step = t == self.generation_steps - 1
@@ -270,47 +297,270 @@ class LSTMModel():
             else:
                 generation_upsampler = self.get_generation_upsampler(t)
 
-            diff_xr = x - r_t
-            if self.hyperparams.no_backprop_diff_xr:
-                diff_xr = diff_xr.data
-
-            downsampled_diff_xr = self.inference_downsampler_diff_xr.downsample(
-                diff_xr)
+            downsampled_diff_xr = canvas.downsample_diff_xr()
 
             batchnorm_step = t if self.hyperparams.inference_share_core else 1
             h_next_enc, c_next_enc = inference_core.forward_onestep(
                 h_t_gen, h_t_enc, c_t_enc, downsampled_x, downsampled_diff_xr,
                 batchnorm_step)
 
-            mean_z_q = inference_posterior.compute_mean_z(h_t_enc)
-            ln_var_z_q = inference_posterior.compute_ln_var_z(h_t_enc)
+            mean_z_q, ln_var_z_q = inference_posterior.compute_mean_and_ln_var_z(
+                h_t_enc)
             z_t = cf.gaussian(mean_z_q, ln_var_z_q)
 
-            mean_z_p = generation_piror.compute_mean_z(h_t_gen)
-            ln_var_z_p = generation_piror.compute_ln_var_z(h_t_gen)
+            if self.hyperparams.batched_prior:
+                h_t_gen_array.append(h_t_gen)
+                z_t_params_array.append((mean_z_q, ln_var_z_q))
+            else:
+                mean_z_p, ln_var_z_p = generation_piror.compute_mean_and_ln_var_z(
+                    h_t_gen)
+                z_t_params_array.append((mean_z_q, ln_var_z_q, mean_z_p,
+                                         ln_var_z_p))
 
             batchnorm_step = t if self.hyperparams.generator_share_core else 1
-            downsampled_r = self.generation_downsampler.downsample(r_t)
+            downsampled_r = canvas.downsample_r()
             h_next_gen, c_next_gen = generation_core.forward_onestep(
                 h_t_gen, c_t_gen, z_t, downsampled_r, batchnorm_step)
 
-            z_t_params_array.append((mean_z_q, ln_var_z_q, mean_z_p,
-                                     ln_var_z_p))
-
             if is_final_step:
                 x_param = generation_upsampler(h_next_gen)
                 mu_x = x_param[:, :3] + r_t
                 ln_var_x = x_param[:, 3:]
             else:
-                r_t = r_t + generation_upsampler(h_next_gen)
+                delta = generation_upsampler(h_next_gen)
+                r_t = r_t + delta
+                canvas.update(r_t, delta)
                 h_t_gen = h_next_gen
                 c_t_gen = c_next_gen
                 h_t_enc = h_next_enc
                 c_t_enc = c_next_enc
                 r_t_array.append(r_t)
 
+        if self.hyperparams.batched_prior:
+            z_t_params_array = [
+                params_q + params_p
+                for params_q, params_p in zip(
+                    z_t_params_array,
+                    self.compute_prior_over_steps(h_t_gen_array))
+            ]
+
+        return z_t_params_array, (mu_x, ln_var_x), r_t_array
+
+    # Training step that hands the KL divergence and the squared error of every
+    # step to `accumulator` (see draw.nn.losses) as soon as they are computed
+    # instead of returning them. Returns the parameters of p(x).
+    @draw.nn.precision.using_model_dtype
+    def accumulate_loss(self, x, accumulator):
+        if self.hyperparams.checkpoint_segment_length > 0:
+            z_t_params_array, (mu_x, ln_var_x), r_t_array = self.sample_z_and_x_params_from_posterior_with_checkpointing(
+                x, self.hyperparams.checkpoint_segment_length)
+            for t, params in enumerate(z_t_params_array):
+                accumulator.add_kl_divergence(t, *params)
+            for t, r_t in enumerate(r_t_array):
+                accumulator.add_squared_error(t, r_t, x)
+            accumulator.add_negative_log_likelihood(x, mu_x, ln_var_x)
+            return mu_x, ln_var_x
+
+        x = self.as_model_dtype(x)
+        batch_size = x.shape[0]
+        xp = draw.backend.get_array_module(x)
+        h_t_gen, c_t_gen, r_t, h_t_enc, c_t_enc = self.generate_initial_state(
+            batch_size, xp, zero_states=True)
+        downsampled_x = self.downsample_x(x)
+        canvas = self.canvas_downsampler(x, r_t)
+        z_q_params_array = []
+        h_t_gen_array = []
+
+        for t in range(self.generation_steps):
+            is_final_step = t == self.generation_steps - 1
+
+            inference_posterior = self.get_inference_posterior(t)
+            generation_core = self.get_generation_core(t)
+            generation_piror = self.get_generation_prior(t)
+
+            mean_z_q, ln_var_z_q = inference_posterior.compute_mean_and_ln_var_z(
+                h_t_enc)
+            z_t = cf.gaussian(mean_z_q, ln_var_z_q)
+
+            if self.hyperparams.batched_prior:
+                z_q_params_array.append((mean_z_q, ln_var_z_q))
+                h_t_gen_array.append(h_t_gen)
+            else:
+                mean_z_p, ln_var_z_p = generation_piror.compute_mean_and_ln_var_z(
+                    h_t_gen)
+                accumulator.add_kl_divergence(t, mean_z_q, ln_var_z_q,
+                                              mean_z_p, ln_var_z_p)
+
+            batchnorm_step = t if self.hyperparams.generator_share_core else 1
+            downsampled_r = canvas.downsample_r()
+            h_next_gen, c_next_gen = generation_core.forward_onestep(
+                h_t_gen, c_t_gen, z_t, downsampled_r, batchnorm_step)
+
+            if is_final_step:
+                x_param = self.generation_final_upsampler(h_next_gen)
+                mu_x = x_param[:, :3] + r_t
+                ln_var_x = x_param[:, 3:]
+                accumulator.add_negative_log_likelihood(x, mu_x, ln_var_x)
+                if self.hyperparams.batched_prior:
+                    for step, (params_q, params_p) in enumerate(
+                            zip(z_q_params_array,
+                                self.compute_prior_over_steps(
+                                    h_t_gen_array))):
+                        accumulator.add_kl_divergence(step, *params_q,
+                                                      *params_p)
+                return mu_x, ln_var_x
+
+            downsampled_diff_xr = canvas.downsample_diff_xr()
+
+            batchnorm_step = t if self.hyperparams.inference_share_core else 1
+            h_t_enc, c_t_enc = self.get_inference_core(t).forward_onestep(
+                h_t_gen, h_t_enc, c_t_enc, downsampled_x, downsampled_diff_xr,
+                batchnorm_step)
+
+            delta = self.get_generation_upsampler(t)(h_next_gen)
+            r_t = r_t + delta
+            canvas.update(r_t, delta)
+            h_t_gen = h_next_gen
+            c_t_gen = c_next_gen
+            accumulator.add_squared_error(t, r_t, x)
+
+    # Same as sample_z_and_x_params_from_posterior but only the recurrent state
+    # (h, c, r) at the boundaries of every segment of `segment_length` steps is
+    # kept. Each segment is run again during backward (see chainer.functions.forget).
+    # Every use of the parameters has to be inside a segment, so the final
+    # step is part of the last one.
+    @draw.nn.precision.using_model_dtype
+    def sample_z_and_x_params_from_posterior_with_checkpointing(
+            self, x, segment_length):
+        x = self.as_model_dtype(x)
+        batch_size = x.shape[0]
+        xp = draw.backend.get_array_module(x)
+        h0_gen, c0_gen, initial_r, h0_enc, c0_enc = self.generate_initial_state(
+            batch_size, xp)
+
+        # Every segment draws its noise from a generator seeded when the
+        # segment is entered, so that its recomputation reproduces z_t. Only
+        # the noise of the current step is allocated.
+        noise_dtype = self.dtype if self.dtype in (np.float32,
+                                                   np.float64) else np.float32
+
+        def forward_segment(seed, start, end, x, h_t_gen, c_t_gen, h_t_enc,
+                            c_t_enc, r_t):
+            random = draw.backend.random_generator(xp, seed)
+            downsampled_x = self.downsample_x(x)
+            canvas = self.canvas_downsampler(x, r_t)
+            outputs = []
+            for t in range(start, end):
+                is_final_step = t == self.generation_steps - 1
+
+                inference_core = self.get_inference_core(t)
+                inference_posterior = self.get_inference_posterior(t)
+                generation_core = self.get_generation_core(t)
+                generation_piror = self.get_generation_prior(t)
+
+                mean_z_q, ln_var_z_q = inference_posterior.compute_mean_and_ln_var_z(
+                    h_t_enc)
+                noise = random.standard_normal(
+                    h_t_enc.shape, dtype=noise_dtype).astype(
+                        self.dtype, copy=False)
+                z_t = mean_z_q + cf.exp(0.5 * ln_var_z_q) * noise
+
+                mean_z_p, ln_var_z_p = generation_piror.compute_mean_and_ln_var_z(
+                    h_t_gen)
+                outputs += [mean_z_q, ln_var_z_q, mean_z_p, ln_var_z_p]
+
+                batchnorm_step = t if self.hyperparams.generator_share_core else 1
+                downsampled_r = canvas.downsample_r()
+                h_next_gen, c_next_gen = generation_core.forward_onestep(
+                    h_t_gen, c_t_gen, z_t, downsampled_r, batchnorm_step)
+
+                if is_final_step:
+                    x_param = self.generation_final_upsampler(h_next_gen)
+                    outputs += [x_param[:, :3] + r_t, x_param[:, 3:]]
+                    break
+
+                downsampled_diff_xr = canvas.downsample_diff_xr()
+
+                batchnorm_step = t if self.hyperparams.inference_share_core else 1
+                h_next_enc, c_next_enc = inference_core.forward_onestep(
+                    h_t_gen, h_t_enc, c_t_enc, downsampled_x,
+                    downsampled_diff_xr, batchnorm_step)
+
+                delta = self.get_generation_upsampler(t)(h_next_gen)
+                r_t = r_t + delta
+                canvas.update(r_t, delta)
+                h_t_gen = h_next_gen
+                c_t_gen = c_next_gen
+                h_t_enc = h_next_enc
+                c_t_enc = c_next_enc
+                outputs.append(r_t)
+            return (h_t_gen, c_t_gen, h_t_enc, c_t_enc, r_t) + tuple(outputs)
+
+        state = (h0_gen, c0_gen, h0_enc, c0_enc, initial_r)
+
+        z_t_params_array = []
+        r_t_array = []
+
+        for start in range(0, self.generation_steps, segment_length):
+            end = min(start + segment_length, self.generation_steps)
+            seed = int(np.random.randint(2**31))
+            outputs = cf.forget(
+                functools.partial(forward_segment, seed, start, end), x,
+                *state)
+            state = outputs[:5]
+            outputs = outputs[5:]
+            for t in range(start, end):
+                z_t_params_array.append(tuple(outputs[:4]))
+                if t == self.generation_steps - 1:
+                    mu_x, ln_var_x = outputs[4:6]
+                else:
+                    r_t_array.append(outputs[4])
+                outputs = outputs[5:]
+
         return z_t_params_array, (mu_x, ln_var_x), r_t_array
 
+    # downsampled x for the inference cores, whose contribution to the gates
+    # is computed once if hyperparams.hoist_inference_x is set (see
+    # draw.nn.single_layer.inputs.InvariantInput)
+    def downsample_x(self, x):
+        downsampled_x = self.inference_downsampler_x.downsample(x)
+        if self.hyperparams.hoist_inference_x:
+            return draw.nn.single_layer.inputs.InvariantInput(downsampled_x)
+        return downsampled_x
+
+    # Mean and log variance of the shared prior for every step, computed with
+    # one convolution over the hidden states of all steps stacked along the
+    # batch axis (hyperparams.batched_prior). Returns a (mean, ln_var) pair
+    # per step. With checkpointing the prior is still computed at every step,
+    # since the hidden states are not kept.
+    def compute_prior_over_steps(self, h_t_gen_array):
+        mean_z_p, ln_var_z_p = self.get_generation_prior(
+            0).compute_mean_and_ln_var_z(
+                cf.concat([
+                    draw.nn.single_layer.inputs.as_array(h_t_gen)
+                    for h_t_gen in h_t_gen_array
+                ],
+                          axis=0))
+        num_steps = len(h_t_gen_array)
+        return list(
+            zip(
+                cf.split_axis(mean_z_p, num_steps, axis=0),
+                cf.split_axis(ln_var_z_p, num_steps, axis=0)))
+
+    # Downsamples the canvas and x - r_t for the posterior, incrementally if
+    # hyperparams.incremental_downsampling is set. `r` is the initial canvas.
+    def canvas_downsampler(self, x, r):
+        if self.hyperparams.incremental_downsampling:
+            canvas_downsampler_class = draw.nn.single_layer.downsampler.IncrementalCanvasDownsampler
+        else:
+            canvas_downsampler_class = draw.nn.single_layer.downsampler.CanvasDownsampler
+        return canvas_downsampler_class(
+            self.generation_downsampler,
+            self.inference_downsampler_diff_xr,
+            x,
+            r,
+            no_backprop_diff_xr=self.hyperparams.no_backprop_diff_xr)
+
     def get_generation_core(self, l):
         if self.hyperparams.generator_share_core:
             return self.generation_cores[0]
@@ -336,9 +586,10 @@ class LSTMModel():
             return self.inference_posteriors[0]
         return self.inference_posteriors[l]
 
+    @draw.nn.precision.using_model_dtype
     def sample_image_at_each_step_from_prior(self, batch_size, xp):
         h0_gen, c0_gen, initial_r, _, _ = self.generate_initial_state(
-            batch_size, xp)
+            batch_size, xp, zero_states=True)
         h_t_gen = h0_gen
         c_t_gen = c0_gen
         r_t = chainer.Variable(initial_r)
@@ -357,9 +608,7 @@ class LSTMModel():
 
             batchnorm_step = t if self.hyperparams.generator_share_core else 1
 
-            mean_z_q = generation_piror.compute_mean_z(h_t_gen)
-            ln_var_z_q = generation_piror.compute_ln_var_z(h_t_gen)
-            z_t = cf.gaussian(mean_z_q, ln_var_z_q)
+            z_t = generation_piror.sample_z(h_t_gen)
 
             downsampled_r = self.generation_downsampler.downsample(r_t)
             h_next_gen, c_next_gen = generation_core.forward_onestep(
@@ -376,3 +625,92 @@ class LSTMModel():
                 r_t_array.append(r_t.data)
 
         return r_t_array, (mu_x, ln_var_x)
+
+    # Every step of the generators below runs in this scope and leaves it
+    # before yielding, so the caller's configuration is not changed while a
+    # generator is suspended
+    @contextlib.contextmanager
+    def inference_scope(self):
+        with chainer.using_config("dtype",
+                                  self.dtype), chainer.no_backprop_mode():
+            yield
+
+    # Yields (t, r_t) as soon as step t is done, where r_t is the canvas after
+    # the step and the mean of p(x) after the last one. Stop iterating (or
+    # close the generator) to cancel the remaining steps. No step is started
+    # after `deadline`, a time.perf_counter() value.
+    def iterate_images_from_posterior(self,
+                                      x,
+                                      zero_variance=False,
+                                      deadline=None):
+        x = self.as_model_dtype(x)
+        batch_size = x.shape[0]
+        xp = draw.backend.get_array_module(x)
+        with self.inference_scope():
+            h_t_gen, c_t_gen, r_t, h_t_enc, c_t_enc = self.generate_initial_state(
+                batch_size, xp, zero_states=True)
+            downsampled_x = self.downsample_x(x)
+            canvas = self.canvas_downsampler(x, r_t)
+
+        for t in range(self.generation_steps):
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            is_final_step = t == self.generation_steps - 1
+
+            with self.inference_scope():
+                mean_z_q, ln_var_z_q = self.get_inference_posterior(
+                    t).compute_mean_and_ln_var_z(h_t_enc)
+                if zero_variance:
+                    z_t = mean_z_q
+                else:
+                    z_t = cf.gaussian(mean_z_q, ln_var_z_q)
+
+                batchnorm_step = t if self.hyperparams.generator_share_core else 1
+                downsampled_r = canvas.downsample_r()
+                h_t_gen_next, c_t_gen = self.get_generation_core(
+                    t).forward_onestep(h_t_gen, c_t_gen, z_t, downsampled_r,
+                                       batchnorm_step)
+
+                if is_final_step:
+                    x_param = self.generation_final_upsampler(h_t_gen_next)
+                    r_t = x_param[:, :3] + r_t
+                else:
+                    downsampled_diff_xr = canvas.downsample_diff_xr()
+                    batchnorm_step = t if self.hyperparams.inference_share_core else 1
+                    h_t_enc, c_t_enc = self.get_inference_core(
+                        t).forward_onestep(h_t_gen, h_t_enc, c_t_enc,
+                                           downsampled_x, downsampled_diff_xr,
+                                           batchnorm_step)
+                    delta = self.get_generation_upsampler(t)(h_t_gen_next)
+                    r_t = r_t + delta
+                    canvas.update(r_t, delta)
+                h_t_gen = h_t_gen_next
+
+            yield t, chainer.as_array(r_t)
+
+    # Same as iterate_images_from_posterior with z_t sampled from the prior
+    def iterate_images_from_prior(self, batch_size, xp, deadline=None):
+        with self.inference_scope():
+            h_t_gen, c_t_gen, r_t, _, _ = self.generate_initial_state(
+                batch_size, xp, zero_states=True)
+
+        for t in range(self.generation_steps):
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            is_final_step = t == self.generation_steps - 1
+
+            with self.inference_scope():
+                z_t = self.get_generation_prior(t).sample_z(h_t_gen)
+
+                batchnorm_step = t if self.hyperparams.generator_share_core else 1
+                downsampled_r = self.generation_downsampler.downsample(r_t)
+                h_t_gen, c_t_gen = self.get_generation_core(t).forward_onestep(
+                    h_t_gen, c_t_gen, z_t, downsampled_r, batchnorm_step)
+
+                if is_final_step:
+                    x_param = self.generation_final_upsampler(h_t_gen)
+                    r_t = x_param[:, :3] + r_t
+                else:
+                    r_t = r_t + self.get_generation_upsampler(t)(h_t_gen)
+
+            yield t, chainer.as_array(r_t)
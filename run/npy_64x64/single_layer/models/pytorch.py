@@ -0,0 +1,425 @@
+import os
+import sys
+import uuid
+
+import torch
+
+sys.path.append(os.path.join("..", "..", "..", ".."))
+import draw
+import draw.nn.pytorch
+
+from hyperparams import HyperParameters
+
+
+# PyTorch port of LSTMModel with the same methods. With hyperparams.use_gru the
+# cores are GRUs, laid out like the LSTM model (scale 4 upsamplers and a final
+# upsampler for the parameters of p(x)).
+# The parameters are appended to a ModuleList in the same order as
+# LSTMModel.parameters so that its model.hdf5 snapshots can be converted.
+class PyTorchModel():
+    def __init__(self,
+                 hyperparams: HyperParameters,
+                 snapshot_directory=None,
+                 device="cpu"):
+        assert isinstance(hyperparams, HyperParameters)
+        self.generation_steps = hyperparams.generator_generation_steps
+        self.hyperparams = hyperparams
+        self.device = torch.device(device)
+        self.parameters = torch.nn.ModuleList()
+
+        self.generation_cores, self.generation_priors, self.generation_downsampler, self.generation_upsamplers, self.generation_final_upsampler = self.build_generation_network(
+            generation_steps=self.generation_steps,
+            chz_channels=hyperparams.chz_channels,
+            downsampler_channels=hyperparams.generator_downsampler_channels,
+            batchnorm_enabled=hyperparams.batch_normalization_enabled)
+
+        self.inference_cores, self.inference_posteriors, self.inference_downsampler_x, self.inference_downsampler_diff_xr = self.build_inference_network(
+            generation_steps=self.generation_steps,
+            chz_channels=hyperparams.chz_channels,
+            downsampler_channels=hyperparams.inference_downsampler_channels,
+            batchnorm_enabled=hyperparams.batch_normalization_enabled)
+
+        if snapshot_directory:
+            try:
+                for filename in (self.filename, "model.hdf5"):
+                    filepath = os.path.join(snapshot_directory, filename)
+                    if os.path.exists(filepath) and os.path.isfile(filepath):
+                        print("loading {}".format(filepath))
+                        self.load(filepath)
+                        break
+            except Exception as error:
+                print(error)
+        self.parameters.to(self.device)
+
+    # Accepts both this model's snapshots and model.hdf5 written by LSTMModel.
+    # The converter needs h5py and is only imported for the latter.
+    def load(self, filepath):
+        if filepath.endswith(".hdf5"):
+            from draw.nn.pytorch import serializers
+            serializers.load_hdf5(filepath, self.parameters)
+            return
+        state_dict = torch.load(
+            filepath, map_location=self.device, weights_only=True)
+        result = self.parameters.load_state_dict(state_dict, strict=False)
+        if result.unexpected_keys:
+            raise ValueError("Unexpected parameters in {}: {}".format(
+                filepath, ", ".join(result.unexpected_keys)))
+
+    def build_generation_network(self, generation_steps, chz_channels,
+                                 downsampler_channels, batchnorm_enabled):
+        core_array = []
+        prior_array = []
+        upsampler_h_x_array = []
+
+        # LSTM core
+        num_cores = 1 if self.hyperparams.generator_share_core else generation_steps
+        batchnorm_steps = generation_steps if self.hyperparams.generator_share_core else 1
+        core_class = draw.nn.pytorch.single_layer.generator.LSTMCore
+        if self.hyperparams.use_gru:
+            core_class = draw.nn.pytorch.single_layer.generator.GRUCore
+        for _ in range(num_cores):
+            core = core_class(
+                chz_channels=chz_channels,
+                batchnorm_enabled=batchnorm_enabled,
+                batchnorm_steps=batchnorm_steps)
+            core_array.append(core)
+            self.parameters.append(core)
+
+        # z prior sampler
+        num_priors = 1 if self.hyperparams.generator_share_prior else generation_steps
+        for _ in range(num_priors):
+            prior = draw.nn.pytorch.single_layer.generator.Prior(
+                channels_z=chz_channels)
+            prior_array.append(prior)
+            self.parameters.append(prior)
+
+        # x downsampler
+        downsampler_x_h = draw.nn.pytorch.single_layer.downsampler.SingleLayeredConvDownsampler(
+            channels=downsampler_channels)
+        self.parameters.append(downsampler_x_h)
+
+        # upsampler (h -> r)
+        num_upsamplers = 1 if self.hyperparams.generator_share_upsampler else generation_steps - 1
+        scale = 4
+        for _ in range(num_upsamplers):
+            upsampler = draw.nn.pytorch.single_layer.upsampler.SubPixelConvolutionUpsampler(
+                channels=3 * scale**2, scale=scale)
+            upsampler_h_x_array.append(upsampler)
+            self.parameters.append(upsampler)
+
+        final_upsampler = draw.nn.pytorch.single_layer.upsampler.SubPixelConvolutionUpsampler(
+            channels=6 * scale**2, scale=scale)
+        upsampler_h_x_array.append(final_upsampler)
+        self.parameters.append(final_upsampler)
+
+        return core_array, prior_array, downsampler_x_h, upsampler_h_x_array, final_upsampler
+
+    def build_inference_network(self, generation_steps, chz_channels,
+                                downsampler_channels, batchnorm_enabled):
+        core_array = []
+        posteriors = []
+
+        # LSTM core
+        num_cores = 1 if self.hyperparams.inference_share_core else generation_steps
+        batchnorm_steps = generation_steps if self.hyperparams.generator_share_core else 1
+        core_class = draw.nn.pytorch.single_layer.inference.LSTMCore
+        if self.hyperparams.use_gru:
+            core_class = draw.nn.pytorch.single_layer.inference.GRUCore
+        for t in range(num_cores):
+            core = core_class(
+                chz_channels=chz_channels,
+                batchnorm_enabled=batchnorm_enabled,
+                batchnorm_steps=batchnorm_steps)
+            core_array.append(core)
+            self.parameters.append(core)
+
+        # z posterior sampler
+        num_posteriors = 1 if self.hyperparams.inference_share_posterior else generation_steps
+        for t in range(num_posteriors):
+            posterior = draw.nn.pytorch.single_layer.inference.Posterior(
+                channels_z=chz_channels)
+            posteriors.append(posterior)
+            self.parameters.append(posterior)
+
+        # x downsampler
+        downsampler_x_h = draw.nn.pytorch.single_layer.downsampler.SingleLayeredConvDownsampler(
+            channels=downsampler_channels)
+        downsampler_diff_xr_h = draw.nn.pytorch.single_layer.downsampler.SingleLayeredConvDownsampler(
+            channels=downsampler_channels)
+        self.parameters.append(downsampler_x_h)
+        self.parameters.append(downsampler_diff_xr_h)
+
+        return core_array, posteriors, downsampler_x_h, downsampler_diff_xr_h
+
+    def to_gpu(self, device="cuda"):
+        self.device = torch.device(device)
+        self.parameters.to(self.device)
+
+    def to_cpu(self):
+        self.device = torch.device("cpu")
+        self.parameters.to(self.device)
+
+    def train(self, mode=True):
+        self.parameters.train(mode)
+
+    def eval(self):
+        self.parameters.eval()
+
+    def cleargrads(self):
+        self.parameters.zero_grad(set_to_none=True)
+
+    @property
+    def filename(self):
+        return "model.pt"
+
+    def serialize(self, path):
+        self.serialize_parameter(path, self.filename, self.parameters)
+
+    # Links that never ran are left out, as in the hdf5 snapshots, and stay
+    # lazy when the snapshot is loaded
+    def serialize_parameter(self, path, filename, params):
+        tmp_filename = str(uuid.uuid4())
+        state_dict = {
+            key: value
+            for key, value in params.state_dict().items()
+            if not isinstance(value,
+                              torch.nn.parameter.UninitializedTensorMixin)
+        }
+        torch.save(state_dict, os.path.join(path, tmp_filename))
+        os.rename(
+            os.path.join(path, tmp_filename), os.path.join(path, filename))
+
+    # xp is accepted for compatibility with LSTMModel and ignored. The states
+    # are allocated on the device of the model.
+    def generate_initial_state(self, batch_size, xp=None):
+        chrz_size = (32, 32)
+        state_shape = (batch_size, self.hyperparams.chz_channels) + chrz_size
+        initial_h_gen = torch.zeros(state_shape, device=self.device)
+        initial_c_gen = torch.zeros(state_shape, device=self.device)
+        initial_r = torch.zeros(
+            (batch_size, 3) + self.hyperparams.image_size, device=self.device)
+        initial_h_enc = torch.zeros(state_shape, device=self.device)
+        initial_c_enc = torch.zeros(state_shape, device=self.device)
+        return initial_h_gen, initial_c_gen, initial_r, initial_h_enc, initial_c_enc
+
+    def as_tensor(self, x):
+        return torch.as_tensor(x, dtype=torch.float32, device=self.device)
+
+    def forward_generation_core(self, core, h, c, z, downsampled_r,
+                                batchnorm_step):
+        if self.hyperparams.use_gru:
+            return core(h, z, downsampled_r, batchnorm_step), c
+        return core(h, c, z, downsampled_r, batchnorm_step)
+
+    def forward_inference_core(self, core, h_gen, h, c, downsampled_x,
+                               downsampled_diff_xr, batchnorm_step):
+        if self.hyperparams.use_gru:
+            return core(h_gen, h, downsampled_x, downsampled_diff_xr,
+                        batchnorm_step), c
+        return core(h_gen, h, c, downsampled_x, downsampled_diff_xr,
+                    batchnorm_step)
+
+    def sample_image_at_each_step_from_posterior(self,
+                                                 x,
+                                                 zero_variance=False,
+                                                 step_limit=None):
+        if step_limit is None:
+            step_limit = self.hyperparams.generator_generation_steps
+
+        x = self.as_tensor(x)
+        batch_size = x.shape[0]
+        h0_gen, c0_gen, initial_r, h0_enc, c0_enc = self.generate_initial_state(
+            batch_size)
+
+        h_t_enc = h0_enc
+        c_t_enc = c0_enc
+        h_t_gen = h0_gen
+        c_t_gen = c0_gen
+        r_t = initial_r
+        downsampled_x = self.inference_downsampler_x.downsample(x)
+
+        r_t_array = []
+
+        for t in range(step_limit):
+            is_final_step = t == step_limit - 1
+
+            inference_core = self.get_inference_core(t)
+            inference_posterior = self.get_inference_posterior(t)
+            generation_core = self.get_generation_core(t)
+            if is_final_step:
+                generation_upsampler = self.generation_final_upsampler
+            else:
+                generation_upsampler = self.get_generation_upsampler(t)
+
+            diff_xr = x - r_t
+            downsampled_diff_xr = self.inference_downsampler_diff_xr.downsample(
+                diff_xr)
+
+            batchnorm_step = t if self.hyperparams.inference_share_core else 1
+            h_next_enc, c_next_enc = self.forward_inference_core(
+                inference_core, h_t_gen, h_t_enc, c_t_enc, downsampled_x,
+                downsampled_diff_xr, batchnorm_step)
+
+            mean_z_q, ln_var_z_q = inference_posterior.compute_mean_and_ln_var_z(
+                h_t_enc)
+            if zero_variance:
+                z_t = mean_z_q
+            else:
+                z_t = draw.nn.pytorch.functions.gaussian(mean_z_q, ln_var_z_q)
+
+            batchnorm_step = t if self.hyperparams.generator_share_core else 1
+            downsampled_r = self.generation_downsampler.downsample(r_t)
+            h_next_gen, c_next_gen = self.forward_generation_core(
+                generation_core, h_t_gen, c_t_gen, z_t, downsampled_r,
+                batchnorm_step)
+
+            if is_final_step:
+                x_param = generation_upsampler(h_next_gen)
+                mu_x = x_param[:, :3] + r_t
+                ln_var_x = x_param[:, 3:]
+            else:
+                h_t_gen = h_next_gen
+                c_t_gen = c_next_gen
+                h_t_enc = h_next_enc
+                c_t_enc = c_next_enc
+
+                r_t = r_t + generation_upsampler(h_next_gen)
+                r_t_array.append(r_t.detach())
+
+        return r_t_array, (mu_x, ln_var_x)
+
+    def sample_z_and_x_params_from_posterior(self, x):
+        x = self.as_tensor(x)
+        batch_size = x.shape[0]
+        h0_gen, c0_gen, initial_r, h0_enc, c0_enc = self.generate_initial_state(
+            batch_size)
+
+        h_t_enc = h0_enc
+        c_t_enc = c0_enc
+        h_t_gen = h0_gen
+        c_t_gen = c0_gen
+        r_t = initial_r
+        downsampled_x = self.inference_downsampler_x.downsample(x)
+
+        z_t_params_array = []
+        r_t_array = []
+
+        for t in range(self.generation_steps):
+            is_final_step = t == self.generation_steps - 1
+
+            inference_core = self.get_inference_core(t)
+            inference_posterior = self.get_inference_posterior(t)
+            generation_core = self.get_generation_core(t)
+            generation_piror = self.get_generation_prior(t)
+
+            if is_final_step:
+                generation_upsampler = self.generation_final_upsampler
+            else:
+                generation_upsampler = self.get_generation_upsampler(t)
+
+            diff_xr = x - r_t
+            if self.hyperparams.no_backprop_diff_xr:
+                diff_xr = diff_xr.detach()
+
+            downsampled_diff_xr = self.inference_downsampler_diff_xr.downsample(
+                diff_xr)
+
+            batchnorm_step = t if self.hyperparams.inference_share_core else 1
+            h_next_enc, c_next_enc = self.forward_inference_core(
+                inference_core, h_t_gen, h_t_enc, c_t_enc, downsampled_x,
+                downsampled_diff_xr, batchnorm_step)
+
+            mean_z_q, ln_var_z_q = inference_posterior.compute_mean_and_ln_var_z(
+                h_t_enc)
+            z_t = draw.nn.pytorch.functions.gaussian(mean_z_q, ln_var_z_q)
+
+            mean_z_p, ln_var_z_p = generation_piror.compute_mean_and_ln_var_z(
+                h_t_gen)
+
+            batchnorm_step = t if self.hyperparams.generator_share_core else 1
+            downsampled_r = self.generation_downsampler.downsample(r_t)
+            h_next_gen, c_next_gen = self.forward_generation_core(
+                generation_core, h_t_gen, c_t_gen, z_t, downsampled_r,
+                batchnorm_step)
+
+            z_t_params_array.append((mean_z_q, ln_var_z_q, mean_z_p,
+                                     ln_var_z_p))
+
+            if is_final_step:
+                x_param = generation_upsampler(h_next_gen)
+                mu_x = x_param[:, :3] + r_t
+                ln_var_x = x_param[:, 3:]
+            else:
+                r_t = r_t + generation_upsampler(h_next_gen)
+                h_t_gen = h_next_gen
+                c_t_gen = c_next_gen
+                h_t_enc = h_next_enc
+                c_t_enc = c_next_enc
+                r_t_array.append(r_t)
+
+        return z_t_params_array, (mu_x, ln_var_x), r_t_array
+
+    def get_generation_core(self, l):
+        if self.hyperparams.generator_share_core:
+            return self.generation_cores[0]
+        return self.generation_cores[l]
+
+    def get_generation_prior(self, l):
+        if self.hyperparams.generator_share_prior:
+            return self.generation_priors[0]
+        return self.generation_priors[l]
+
+    def get_generation_upsampler(self, t):
+        if self.hyperparams.generator_share_upsampler:
+            return self.generation_upsamplers[0]
+        return self.generation_upsamplers[t]
+
+    def get_inference_core(self, l):
+        if self.hyperparams.inference_share_core:
+            return self.inference_cores[0]
+        return self.inference_cores[l]
+
+    def get_inference_posterior(self, l):
+        if self.hyperparams.inference_share_posterior:
+            return self.inference_posteriors[0]
+        return self.inference_posteriors[l]
+
+    def sample_image_at_each_step_from_prior(self, batch_size, xp=None):
+        h0_gen, c0_gen, initial_r, _, _ = self.generate_initial_state(
+            batch_size)
+        h_t_gen = h0_gen
+        c_t_gen = c0_gen
+        r_t = initial_r
+        r_t_array = []
+
+        for t in range(self.generation_steps):
+            is_final_step = t == self.generation_steps - 1
+
+            generation_core = self.get_generation_core(t)
+            generation_piror = self.get_generation_prior(t)
+
+            if is_final_step:
+                generation_upsampler = self.generation_final_upsampler
+            else:
+                generation_upsampler = self.get_generation_upsampler(t)
+
+            batchnorm_step = t if self.hyperparams.generator_share_core else 1
+
+            z_t = generation_piror.sample_z(h_t_gen)
+
+            downsampled_r = self.generation_downsampler.downsample(r_t)
+            h_next_gen, c_next_gen = self.forward_generation_core(
+                generation_core, h_t_gen, c_t_gen, z_t, downsampled_r,
+                batchnorm_step)
+
+            if is_final_step:
+                x_param = generation_upsampler(h_next_gen)
+                mu_x = x_param[:, :3] + r_t
+                ln_var_x = x_param[:, 3:]
+            else:
+                h_t_gen = h_next_gen
+                c_t_gen = c_next_gen
+                r_t = r_t + generation_upsampler(h_next_gen)
+                r_t_array.append(r_t.detach())
+
+        return r_t_array, (mu_x, ln_var_x)
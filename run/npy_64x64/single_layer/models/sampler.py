@@ -0,0 +1,389 @@
+import os
+import sys
+
+import chainer
+import chainer.functions as cf
+import numpy as np
+
+sys.path.append(os.path.join("..", "..", "..", ".."))
+import draw
+
+
+def convolution(x, W, b, stride=1, pad=2):
+    return cf.convolution_2d(x, W, b, stride=stride, pad=pad).array
+
+
+def sigmoid_(x, xp):
+    x *= 0.5
+    xp.tanh(x, out=x)
+    x *= 0.5
+    x += 0.5
+
+
+# In-place LSTM cell on the output of the fused gate convolution (see
+# draw.nn.serializers.fuse_lstm_arrays). Updates c and h, with tanh_c as
+# scratch space.
+def lstm_(gates, c, h, W_peephole_if, W_peephole_o, tanh_c, xp):
+    C = c.shape[1]
+    gates[:, :2 * C] += convolution(c, W_peephole_if, None)
+    input_gate, forget_gate = gates[:, :C], gates[:, C:2 * C]
+    gate_tanh, output_gate = gates[:, 2 * C:3 * C], gates[:, 3 * C:]
+    sigmoid_(gates[:, :2 * C], xp)
+    xp.tanh(gate_tanh, out=gate_tanh)
+    c *= forget_gate
+    input_gate *= gate_tanh
+    c += input_gate
+    output_gate += convolution(c, W_peephole_o, None)
+    sigmoid_(output_gate, xp)
+    xp.tanh(c, out=tanh_c)
+    xp.multiply(output_gate, tanh_c, out=h)
+
+
+def link_arrays(link):
+    arrays = {}
+    for name, param in link.namedparams():
+        if param.array is None:
+            raise ValueError(
+                "{} is not initialized. Load a snapshot or run the model once before creating the sampler".
+                format(name))
+        arrays[name.lstrip("/")] = draw.backend.to_cpu(param.array)
+    return arrays
+
+
+# Arena for the temporaries of the samplers below. Every buffer is allocated
+# once for `max_batch_size` images and reused for every step and every
+# chunk: array(name, shape, dtype) returns the first shape[0] rows of the
+# buffer `name`, which is only reallocated if the rest of its shape or its
+# dtype change. num_allocations counts the buffers allocated so far.
+class Workspace():
+    def __init__(self, xp, max_batch_size):
+        self.xp = xp
+        self.max_batch_size = max_batch_size
+        self.buffers = {}
+        self.num_allocations = 0
+
+    def array(self, name, shape, dtype):
+        if shape[0] > self.max_batch_size:
+            raise ValueError("batch of {} images in a workspace for {}".format(
+                shape[0], self.max_batch_size))
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.shape[1:] != tuple(
+                shape[1:]) or buffer.dtype != dtype:
+            buffer = self.xp.empty(
+                (self.max_batch_size, ) + tuple(shape[1:]), dtype=dtype)
+            self.buffers[name] = buffer
+            self.num_allocations += 1
+        return buffer[:shape[0]]
+
+
+# Generator of an LSTMModel on raw arrays, shared by the samplers below. No
+# computational graph is built and the states, z and the canvas live in a
+# Workspace. Batches larger than `max_batch_size` are sampled in chunks.
+# The weights are read (and the gates and heads fused) when the sampler is
+# created, so create a new one after the parameters change.
+class Sampler():
+    def __init__(self, model, max_batch_size=256, seed=None):
+        hyperparams = model.hyperparams
+        if hyperparams.use_gru:
+            raise ValueError("{} supports LSTMModel only".format(
+                type(self).__name__))
+        if hyperparams.batch_normalization_enabled:
+            raise ValueError("{} does not support batch normalization".format(
+                type(self).__name__))
+        self.generation_steps = model.generation_steps
+        self.chz_channels = hyperparams.chz_channels
+        self.downsampler_channels = hyperparams.generator_downsampler_channels
+        self.image_size = hyperparams.image_size
+        self.chrz_size = (self.image_size[0] // 2, self.image_size[1] // 2)
+        self.max_batch_size = max_batch_size
+        self.dtype = model.dtype
+
+        downsampler = model.generation_downsampler.conv_1
+        self.xp = draw.backend.get_array_module(downsampler.W.array)
+        if self.xp is np:
+            self.random = np.random.default_rng(seed)
+        else:
+            self.random = self.xp.random.RandomState(seed)
+        self.workspace = Workspace(self.xp, max_batch_size)
+        self.device_array = downsampler.W.array
+        self.fused_arrays = {}
+
+        self.cores = []
+        self.priors = []
+        self.upsamplers = []
+        for t in range(self.generation_steps):
+            arrays = self.fuse(
+                model.get_generation_core(t),
+                draw.nn.serializers.fuse_lstm_arrays)
+            self.cores.append(
+                (arrays["lstm_gates/W"], arrays["lstm_gates/b"],
+                 arrays["lstm_peephole_if/W"], arrays["lstm_peephole_o/W"]))
+            arrays = self.fuse(
+                model.get_generation_prior(t),
+                draw.nn.serializers.fuse_gaussian_arrays)
+            self.priors.append((arrays["mean_ln_var_z/W"],
+                                arrays["mean_ln_var_z/b"]))
+            if t < self.generation_steps - 1:
+                upsampler = model.get_generation_upsampler(t)
+                self.upsamplers.append((upsampler.conv.W.array,
+                                        upsampler.conv.b.array))
+
+        # Only the mean of p(x) is needed. Its channels are interleaved with
+        # those of the log variance in the output of the final convolution.
+        upsampler = model.generation_final_upsampler
+        self.scale = upsampler.scale
+        W, b = upsampler.conv.W.array, upsampler.conv.b.array
+        W = W.reshape((self.scale, self.scale, 2, 3) + W.shape[1:])
+        b = b.reshape((self.scale, self.scale, 2, 3))
+        self.final_upsampler = (W[:, :, 0].reshape((-1, ) + W.shape[4:]),
+                                b[:, :, 0].reshape(-1))
+
+        self.downsampler = (downsampler.W.array, downsampler.b.array)
+
+    def to_device(self, array, like):
+        if self.xp is np:
+            return array
+        return draw.backend.to_gpu(array, device=like.device.id)
+
+    # The weights are fused on the CPU (see draw.nn.serializers), once per
+    # link since the links may be shared between steps
+    def fuse(self, link, fuse_arrays):
+        if id(link) not in self.fused_arrays:
+            arrays = link_arrays(link)
+            fuse_arrays(arrays, "")
+            for name, array in arrays.items():
+                arrays[name] = self.to_device(array, self.device_array)
+            self.fused_arrays[id(link)] = arrays
+        return self.fused_arrays[id(link)]
+
+    def fill_standard_normal(self, out):
+        if self.xp is np:
+            self.random.standard_normal(dtype=out.dtype, out=out)
+        else:
+            out[...] = self.random.standard_normal(
+                out.shape, dtype=out.dtype)
+
+    # z ~ N(mean, exp(ln_var)) for the output of a fused head, written to z.
+    # params is overwritten.
+    def sample_z_(self, params, z, zero_variance=False):
+        xp = self.xp
+        C = self.chz_channels
+        mean, ln_var = params[:, :C], params[:, C:]
+        if zero_variance:
+            z[...] = mean
+            return
+        noise = self.workspace.array("noise", z.shape, np.float32)
+        ln_var *= 0.5
+        xp.exp(ln_var, out=ln_var)
+        self.fill_standard_normal(noise)
+        ln_var *= noise
+        xp.add(mean, ln_var, out=z)
+
+    # One step of the generator. generation_in holds h, z and the downsampled
+    # canvas where the core expects them to be concatenated. Updates h, c and
+    # the canvas r, or writes the mean of p(x) to mu_x at the final step.
+    def generation_step(self, t, generation_in, c, r, mu_x, is_final_step):
+        xp = self.xp
+        C = self.chz_channels
+        h, downsampled_r = generation_in[:, :C], generation_in[:, 2 * C:]
+        tanh_c = self.workspace.array("tanh_c", c.shape, c.dtype)
+
+        W, b = self.downsampler
+        downsampled_r[...] = convolution(r, W, b, stride=2, pad=1)
+
+        W, b, W_peephole_if, W_peephole_o = self.cores[t]
+        lstm_(convolution(generation_in, W, b), c, h, W_peephole_if,
+              W_peephole_o, tanh_c, xp)
+
+        if is_final_step:
+            W, b = self.final_upsampler
+            mu_x[...] = r
+            self.add_depth2space(mu_x, convolution(h, W, b, stride=2, pad=1))
+        else:
+            W, b = self.upsamplers[t]
+            self.add_depth2space(r, convolution(h, W, b, stride=2, pad=1))
+
+    # Adds depth2space(y) to the canvas x in place
+    def add_depth2space(self, x, y):
+        n, channels, height, width = x.shape
+        r = self.scale
+        x = x.reshape(n, channels, height // r, r, width // r, r)
+        x = x.transpose(0, 3, 5, 1, 2, 4)
+        x += y.reshape(n, r, r, channels, height // r, width // r)
+
+    def chunks(self, batch_size):
+        for start in range(0, batch_size, self.max_batch_size):
+            yield start, min(start + self.max_batch_size, batch_size)
+
+
+# Samples images from the prior of an LSTMModel (see Sampler)
+class PriorSampler(Sampler):
+    def sample_chunk(self, batch_size, mu_x, r_t_array):
+        C = self.chz_channels
+        workspace = self.workspace
+        # h, z and the downsampled canvas are stored where the core expects
+        # them to be concatenated
+        generation_in = workspace.array(
+            "generation_in",
+            (batch_size, 2 * C + self.downsampler_channels) + self.chrz_size,
+            self.dtype)
+        c = workspace.array("c", (batch_size, C) + self.chrz_size, self.dtype)
+        r = workspace.array("r", (batch_size, 3) + self.image_size,
+                            self.dtype)
+        h, z = generation_in[:, :C], generation_in[:, C:2 * C]
+        h.fill(0)
+        c.fill(0)
+        r.fill(0)
+
+        for t in range(self.generation_steps):
+            W, b = self.priors[t]
+            self.sample_z_(convolution(h, W, b), z)
+            is_final_step = t == self.generation_steps - 1
+            self.generation_step(t, generation_in, c, r, mu_x, is_final_step)
+            if not is_final_step and r_t_array is not None:
+                r_t_array[t] = r
+
+    def run(self, batch_size, r_t_array):
+        mu_x = self.xp.empty(
+            (batch_size, 3) + self.image_size, dtype=self.dtype)
+        with chainer.no_backprop_mode(), chainer.using_config(
+                "train", False):
+            for start, end in self.chunks(batch_size):
+                self.sample_chunk(
+                    end - start, mu_x[start:end], None
+                    if r_t_array is None else r_t_array[:, start:end])
+        return mu_x
+
+    # Returns the mean of p(x) (the final canvas)
+    def sample(self, batch_size):
+        return self.run(batch_size, None)
+
+    # Returns the canvas after each step in an array of shape
+    # (generation_steps - 1, batch_size, 3, height, width) and the mean of p(x)
+    def sample_at_each_step(self, batch_size):
+        r_t_array = self.xp.empty(
+            (self.generation_steps - 1, batch_size, 3) + self.image_size,
+            dtype=self.dtype)
+        mu_x = self.run(batch_size, r_t_array)
+        return r_t_array, mu_x
+
+
+# Same as LSTMModel.sample_image_at_each_step_from_posterior (see Sampler).
+# The states of both networks, z, the downsampled x, x - r_t and the canvas
+# are stored in one buffer, ordered so that the inputs of the inference core
+# and of the generation core are both contiguous in it:
+#   h_enc | downsampled x | downsampled x - r_t | h_gen | z | downsampled r_t
+# The input channels of the inference gates are reordered to match when the
+# sampler is created, so no step concatenates or copies its inputs.
+class PosteriorSampler(Sampler):
+    def __init__(self, model, max_batch_size=256, seed=None):
+        super().__init__(model, max_batch_size=max_batch_size, seed=seed)
+        hyperparams = model.hyperparams
+        self.inference_downsampler_channels = hyperparams.inference_downsampler_channels
+        C = self.chz_channels
+        D = self.inference_downsampler_channels
+        self.inference_cores = []
+        self.posteriors = []
+        for t in range(self.generation_steps):
+            arrays = self.fuse(
+                model.get_inference_core(t),
+                draw.nn.serializers.fuse_lstm_arrays)
+            W = arrays["lstm_gates/W"]
+            if "lstm_gates/W_reordered" not in arrays:
+                arrays["lstm_gates/W_reordered"] = self.xp.concatenate(
+                    (W[:, :C], W[:, 2 * C:], W[:, C:2 * C]), axis=1)
+            self.inference_cores.append(
+                (arrays["lstm_gates/W_reordered"], arrays["lstm_gates/b"],
+                 arrays["lstm_peephole_if/W"], arrays["lstm_peephole_o/W"]))
+            arrays = self.fuse(
+                model.get_inference_posterior(t),
+                draw.nn.serializers.fuse_gaussian_arrays)
+            self.posteriors.append((arrays["mean_ln_var_z/W"],
+                                    arrays["mean_ln_var_z/b"]))
+        self.downsampler_x = (model.inference_downsampler_x.conv_1.W.array,
+                              model.inference_downsampler_x.conv_1.b.array)
+        self.downsampler_diff_xr = (
+            model.inference_downsampler_diff_xr.conv_1.W.array,
+            model.inference_downsampler_diff_xr.conv_1.b.array)
+
+    def sample_chunk(self, x, mu_x, r_t_array, zero_variance, step_limit):
+        xp = self.xp
+        C = self.chz_channels
+        D = self.inference_downsampler_channels
+        batch_size = x.shape[0]
+        workspace = self.workspace
+        state_in = workspace.array(
+            "state_in",
+            (batch_size, 3 * C + 2 * D + self.downsampler_channels) +
+            self.chrz_size, self.dtype)
+        c_enc = workspace.array("c_enc", (batch_size, C) + self.chrz_size,
+                                self.dtype)
+        c_gen = workspace.array("c_gen", (batch_size, C) + self.chrz_size,
+                                self.dtype)
+        r = workspace.array("r", x.shape, self.dtype)
+        diff_xr = workspace.array("diff_xr", x.shape, self.dtype)
+        tanh_c = workspace.array("tanh_c", c_enc.shape, self.dtype)
+        inference_in = state_in[:, :2 * C + 2 * D]
+        generation_in = state_in[:, C + 2 * D:]
+        h_enc = state_in[:, :C]
+        downsampled_x = state_in[:, C:C + D]
+        downsampled_diff_xr = state_in[:, C + D:C + 2 * D]
+        z = generation_in[:, C:2 * C]
+        state_in.fill(0)
+        c_enc.fill(0)
+        c_gen.fill(0)
+        r.fill(0)
+
+        W, b = self.downsampler_x
+        downsampled_x[...] = convolution(x, W, b, stride=2, pad=1)
+
+        for t in range(step_limit):
+            xp.subtract(x, r, out=diff_xr)
+            W, b = self.downsampler_diff_xr
+            downsampled_diff_xr[...] = convolution(
+                diff_xr, W, b, stride=2, pad=1)
+
+            # The posterior and both cores read the states of the previous
+            # step, so the gates of the inference core are computed before
+            # h_enc and h_gen are updated in place. Its output is not used
+            # after the final step.
+            is_final_step = t == step_limit - 1
+            if not is_final_step:
+                W, b, W_peephole_if, W_peephole_o = self.inference_cores[t]
+                gates = convolution(inference_in, W, b)
+            W, b = self.posteriors[t]
+            self.sample_z_(convolution(h_enc, W, b), z, zero_variance)
+            if not is_final_step:
+                lstm_(gates, c_enc, h_enc, W_peephole_if, W_peephole_o,
+                      tanh_c, xp)
+
+            self.generation_step(t, generation_in, c_gen, r, mu_x,
+                                 is_final_step)
+            if not is_final_step and r_t_array is not None:
+                r_t_array[t] = r
+
+    def run(self, x, r_t_array, zero_variance, step_limit):
+        x = x.astype(self.dtype, copy=False)
+        mu_x = self.xp.empty(x.shape, dtype=self.dtype)
+        with chainer.no_backprop_mode(), chainer.using_config(
+                "train", False):
+            for start, end in self.chunks(x.shape[0]):
+                self.sample_chunk(
+                    x[start:end], mu_x[start:end], None
+                    if r_t_array is None else r_t_array[:, start:end],
+                    zero_variance, step_limit)
+        return mu_x
+
+    # Returns the mean of p(x) (the final canvas)
+    def sample(self, x, zero_variance=False, step_limit=None):
+        return self.run(x, None, zero_variance, step_limit
+                        or self.generation_steps)
+
+    # Returns the canvas after each step in an array of shape
+    # (step_limit - 1, batch_size, 3, height, width) and the mean of p(x)
+    def sample_at_each_step(self, x, zero_variance=False, step_limit=None):
+        step_limit = step_limit or self.generation_steps
+        r_t_array = self.xp.empty(
+            (step_limit - 1, ) + x.shape, dtype=self.dtype)
+        mu_x = self.run(x, r_t_array, zero_variance, step_limit)
+        return r_t_array, mu_x
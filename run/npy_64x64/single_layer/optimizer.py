@@ -1,4 +1,6 @@
+import functools
 import math
+import warnings
 
 import chainermn
 from chainer import optimizers
@@ -7,6 +9,26 @@ from tabulate import tabulate
 from eve import Eve
 
 
+# Same as chainer.Optimizer.check_nan_in_grads but parameters that have not
+# been initialized are skipped. Links that are only used at some steps (e.g.
+# the inference core of the last step) stay uninitialized until a snapshot
+# with them is loaded.
+def check_nan_in_grads(optimizer):
+    optimizer._loss_scaling_isnan = False
+    if not optimizer._loss_scaling_is_dynamic:
+        return
+    for name, param in optimizer.target.namedparams():
+        if param.grad is None:
+            continue
+        xp = param.device.xp
+        if not xp.all(xp.isfinite(param.grad)):
+            optimizer._loss_scaling_isnan = True
+            optimizer._loss_scaling_isnan_ever = True
+            warnings.warn(
+                "Non finite number found in param.grad of {} (iteration: {}, loss_scale: {})".
+                format(name, optimizer.t, optimizer._loss_scale))
+
+
 class Optimizer:
     def __init__(
             self,
@@ -42,8 +64,21 @@ class Optimizer:
             rows.append([key, value])
         print(tabulate(rows))
 
+    # Parameters in float16 are updated through float32 copies and the loss is
+    # scaled dynamically. The scale is halved and the update is skipped when a
+    # gradient overflows, and it is doubled every `interval` updates otherwise.
+    def enable_mixed_precision(self, interval=1000):
+        self.optimizer.use_fp32_update()
+        self.optimizer.loss_scaling(interval=interval)
+        self.optimizer.check_nan_in_grads = functools.partial(
+            check_nan_in_grads, self.optimizer)
+
     def loss_scale(self):
-        return None
+        return self.optimizer._loss_scale
+
+    @property
+    def update_skipped(self):
+        return not self.optimizer.is_safe_to_update()
 
 
 class AdamOptimizer(Optimizer):
@@ -81,9 +116,6 @@ class AdamOptimizer(Optimizer):
     def anneal_learning_rate(self, training_step):
         self.optimizer.hyperparam.alpha = self.mu_s(training_step)
 
-    def loss_scale(self):
-        return self.optimizer._loss_scale
-
 
 class EveOptimizer(Optimizer):
     def __init__(
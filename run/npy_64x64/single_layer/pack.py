@@ -0,0 +1,23 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join("..", "..", ".."))
+import draw
+
+
+def main():
+    dataset = draw.data.build_packed_dataset(args.dataset_path,
+                                             args.output_directory)
+    print("packed {} images of shape {} from {} files into {}".format(
+        len(dataset), dataset.shape[1:], len(dataset.files),
+        args.output_directory))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset-path", "-dataset", type=str, required=True)
+    parser.add_argument(
+        "--output-directory", "-output", type=str, required=True)
+    args = parser.parse_args()
+    main()
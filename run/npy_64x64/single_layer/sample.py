@@ -0,0 +1,64 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join("..", "..", ".."))
+import draw
+from hyperparams import HyperParameters
+from models import LSTMModel, PriorSampler
+
+
+def printr(string):
+    sys.stdout.write(string)
+    sys.stdout.write("\r")
+    sys.stdout.flush()
+
+
+def make_uint8(x):
+    x = draw.backend.to_cpu(x).astype(np.float32)
+    return np.uint8(np.clip(x * 255, 0, 255)).transpose((0, 2, 3, 1))
+
+
+def main():
+    using_gpu = args.gpu_device >= 0
+    xp = draw.backend.get_xp(args.gpu_device)
+
+    hyperparams = HyperParameters(snapshot_directory=args.snapshot_directory)
+    hyperparams.print()
+
+    model = LSTMModel(hyperparams, snapshot_directory=args.snapshot_directory)
+    if using_gpu:
+        model.to_gpu()
+
+    sampler = PriorSampler(
+        model, max_batch_size=args.batch_size, seed=args.seed)
+
+    start_time = time.time()
+    with draw.data.PackedDatasetWriter(args.output_directory) as writer:
+        for start in range(0, args.num_samples, args.batch_size):
+            batch_size = min(args.batch_size, args.num_samples - start)
+            mu_x = sampler.sample(batch_size)
+            writer.append(make_uint8(mu_x))
+            elapsed_time = time.time() - start_time
+            printr("{} / {} - {:.1f} images/sec".format(
+                start + batch_size, args.num_samples,
+                (start + batch_size) / elapsed_time))
+    print("\033[2Kwrote {} samples to {}".format(args.num_samples,
+                                                  args.output_directory))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--snapshot-directory", "-snapshot", type=str, required=True)
+    parser.add_argument(
+        "--output-directory", "-output", type=str, required=True)
+    parser.add_argument("--gpu-device", "-gpu", type=int, default=-1)
+    parser.add_argument("--num-samples", "-n", type=int, default=10000)
+    parser.add_argument("--batch-size", "-b", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    main()
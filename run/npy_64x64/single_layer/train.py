@@ -5,11 +5,8 @@ import random
 import sys
 
 import chainer
-import chainer.functions as cf
 import matplotlib.pyplot as plt
 import numpy as np
-import cupy as cp
-from chainer.backends import cuda
 from PIL import Image
 
 sys.path.append(os.path.join("..", "..", ".."))
@@ -17,6 +14,7 @@ import draw
 from hyperparams import HyperParameters
 from models import GRUModel, LSTMModel
 from optimizer import AdamOptimizer
+from training_state import TrainingState
 
 
 def printr(string):
@@ -25,53 +23,41 @@ def printr(string):
     sys.stdout.flush()
 
 
-def to_gpu(array):
-    if cuda.get_array_module(array) is np:
-        return cuda.to_gpu(array)
-    return array
-
-
-def to_cpu(array):
-    if cuda.get_array_module(array) is cp:
-        return cuda.to_cpu(array)
-    return array
-
-
 def make_uint8(x):
-    x = to_cpu(x)
+    x = draw.backend.to_cpu(x)
     if x.shape[0] == 3:
         x = x.transpose(1, 2, 0)
     return np.uint8(np.clip(x * 255, 0, 255))
 
 
+loss_accumulators = {
+    "streaming": draw.nn.losses.LossAccumulator,
+    "stacked": draw.nn.losses.StackedLossAccumulator,
+}
+
+
 def main():
     try:
         os.mkdir(args.snapshot_directory)
     except:
         pass
 
-    images = []
-    files = os.listdir(args.dataset_path)
-    files.sort()
-    for filename in files:
-        image = np.load(os.path.join(args.dataset_path, filename))
-        image = image / 255
-        images.append(image)
-
-    images = np.vstack(images)
-    images = images.transpose((0, 3, 1, 2)).astype(np.float32)
-    train_dev_split = 0.9
-    num_images = images.shape[0]
-    num_train_images = int(num_images * train_dev_split)
-    num_dev_images = num_images - num_train_images
-    images_train = images[:num_train_images]
-    images_dev = images[num_dev_images:]
-
-    xp = np
+    if args.streaming:
+        images = draw.data.ShardedDataset(args.dataset_path)
+        images_train = images
+        images_dev = draw.data.Dataset(images.read_shard(-1))
+    else:
+        images = draw.data.PackedDataset(args.dataset_path)
+        train_dev_split = 0.9
+        num_images = len(images)
+        num_train_images = int(num_images * train_dev_split)
+        num_dev_images = num_images - num_train_images
+        images_train = images.subset(np.arange(num_train_images))
+        images_dev = images.subset(np.arange(num_dev_images, num_images))
+    num_dev_images = len(images_dev)
+
     using_gpu = args.gpu_device >= 0
-    if using_gpu:
-        cuda.get_device(args.gpu_device).use()
-        xp = cp
+    xp = draw.backend.get_xp(args.gpu_device)
 
     hyperparams = HyperParameters()
     hyperparams.chz_channels = args.chz_channels
@@ -86,6 +72,13 @@ def main():
     hyperparams.batch_normalization_enabled = args.enable_batch_normalization
     hyperparams.use_gru = args.use_gru
     hyperparams.no_backprop_diff_xr = args.no_backprop_diff_xr
+    hyperparams.fused_gates = args.fused_gates
+    hyperparams.fused_heads = args.fused_heads
+    hyperparams.checkpoint_segment_length = args.checkpoint_segment_length
+    hyperparams.incremental_downsampling = args.incremental_downsampling
+    hyperparams.hoist_inference_x = args.hoist_inference_x
+    hyperparams.batched_prior = args.batched_prior
+    hyperparams.dtype = args.dtype
 
     hyperparams.save(args.snapshot_directory)
     hyperparams.print()
@@ -105,12 +98,35 @@ def main():
         lr_f=args.final_lr,
         beta_1=args.adam_beta1,
     )
+    if hyperparams.dtype != "float32":
+        optimizer.enable_mixed_precision()
     optimizer.print()
 
     num_pixels = images.shape[1] * images.shape[2] * images.shape[3]
 
-    dataset = draw.data.Dataset(images_train)
-    iterator = draw.data.Iterator(dataset, batch_size=args.batch_size)
+    if args.streaming:
+        dataset = None
+        iterator = draw.data.StreamingIterator(
+            images_train,
+            batch_size=args.batch_size,
+            shuffle_buffer_size=args.shuffle_buffer_size)
+    else:
+        dataset = images_train
+        iterator = draw.data.Iterator(
+            dataset, batch_size=args.batch_size, sort_indices=True)
+    converter = None
+    if using_gpu:
+        converter = lambda x: draw.backend.to_gpu(x, device=args.gpu_device)
+    loader = draw.data.PrefetchIterator(
+        dataset,
+        iterator,
+        num_prefetch=args.prefetch,
+        num_workers=args.loader_workers,
+        transform=draw.data.Dequantize(),
+        converter=converter)
+
+    dequantize = draw.data.Dequantize(noise=False)
+    loss_accumulator_class = loss_accumulators[args.loss_accumulator]
 
     figure = plt.figure(figsize=(20, 4))
     axis_1 = figure.add_subplot(1, 5, 1)
@@ -119,32 +135,25 @@ def main():
     axis_4 = figure.add_subplot(1, 5, 4)
     axis_5 = figure.add_subplot(1, 5, 5)
 
-    num_updates = 0
+    state = TrainingState(snapshot_directory=args.snapshot_directory)
+    if state.iterator is not None and not args.streaming:
+        loader.load_state_dict(state.iterator)
+    num_updates = state.num_updates
+    if num_updates > 0:
+        optimizer.anneal_learning_rate(num_updates - 1)
 
-    for iteration in range(args.training_steps):
+    start_epoch = 0 if args.streaming else iterator.epoch
+    for iteration in range(start_epoch, args.training_steps):
         mean_kld = 0
         mean_nll = 0
 
-        for batch_index, data_indices in enumerate(iterator):
-            x = dataset[data_indices]
-            x += np.random.uniform(0, 1 / 256, size=x.shape)
-            x = to_gpu(x)
-
-            loss_kld = 0
-            z_t_param_array, x_param, r_t_array = model.sample_z_and_x_params_from_posterior(
-                x)
-            for params in z_t_param_array:
-                mean_z_q, ln_var_z_q, mean_z_p, ln_var_z_p = params
-                kld = draw.nn.functions.gaussian_kl_divergence(
-                    mean_z_q, ln_var_z_q, mean_z_p, ln_var_z_p)
-                loss_kld += cf.sum(kld)
-
-            loss_sse = 0
-            for r_t in r_t_array:
-                loss_sse += cf.sum(cf.squared_error(r_t, x))
-
-            mu_x, ln_var_x = x_param
-            loss_nll = cf.gaussian_nll(x, mu_x, ln_var_x) + math.log(256.0)
+        start = 0 if args.streaming else iterator.offset
+        for batch_index, (data_indices, x) in enumerate(
+                loader, start=start):
+            accumulator = loss_accumulator_class()
+            mu_x, ln_var_x = model.accumulate_loss(x, accumulator)
+            loss_nll, loss_kld, loss_sse = accumulator.reduce()
+            loss_nll += math.log(256.0)
 
             loss_nll /= args.batch_size
             loss_kld /= args.batch_size
@@ -152,7 +161,7 @@ def main():
             loss = args.loss_beta * loss_nll + loss_kld + loss_sse
 
             model.cleargrads()
-            loss.backward()
+            loss.backward(loss_scale=optimizer.loss_scale())
             optimizer.update(num_updates)
 
             num_updates += 1
@@ -164,10 +173,12 @@ def main():
                     axis_1.imshow(make_uint8(x[0]))
                     axis_2.imshow(make_uint8(mu_x.data[0]))
 
-                    x_dev = images_dev[random.choice(range(num_dev_images))]
-                    axis_3.imshow(make_uint8(x_dev))
+                    x_dev = dequantize(
+                        images_dev.take([random.choice(range(num_dev_images))]))
+                    axis_3.imshow(make_uint8(x_dev[0]))
 
-                    x_dev = to_gpu(x_dev)[None, ...]
+                    if using_gpu:
+                        x_dev = draw.backend.to_gpu(x_dev)
                     r_t_array, x_param = model.sample_image_at_each_step_from_posterior(
                         x_dev)
                     mu_x, ln_var_x = x_param
@@ -189,12 +200,24 @@ def main():
                     (hyperparams.generator_generation_steps - 1),
                     float(loss_kld.data), optimizer.learning_rate))
 
+            if batch_index > 0 and batch_index % args.snapshot_interval == 0:
+                model.serialize(args.snapshot_directory)
+                state.num_updates = num_updates
+                if not args.streaming:
+                    state.iterator = loader.state_dict()
+                state.save(args.snapshot_directory)
+
         model.serialize(args.snapshot_directory)
+        state.num_updates = num_updates
+        if not args.streaming:
+            state.iterator = loader.state_dict()
+        state.save(args.snapshot_directory)
         print(
-            "\r\033[2KIteration {} - loss: nll_per_pixel: {:.6f} - mse: {:.6f} - kld: {:.6f} - lr: {:.4e}".
+            "\r\033[2KIteration {} - loss: nll_per_pixel: {:.6f} - mse: {:.6f} - kld: {:.6f} - lr: {:.4e} - data_wait: {:.3f} sec ({:.2f} ms/batch)".
             format(iteration + 1,
                    float(loss_nll.data) / num_pixels, float(loss_sse.data),
-                   float(loss_kld.data), optimizer.learning_rate))
+                   float(loss_kld.data), optimizer.learning_rate,
+                   loader.wait_time, loader.mean_wait_time * 1000))
 
 
 if __name__ == "__main__":
@@ -202,8 +225,13 @@ if __name__ == "__main__":
     parser.add_argument("--dataset-path", "-dataset", type=str, required=True)
     parser.add_argument(
         "--snapshot-directory", "-snapshot", type=str, default="snapshot")
-    parser.add_argument("--gpu-device", "-gpu", type=int, default=0)
+    parser.add_argument("--gpu-device", "-gpu", type=int, default=-1)
     parser.add_argument("--batch-size", "-b", type=int, default=36)
+    parser.add_argument("--prefetch", type=int, default=2)
+    parser.add_argument("--loader-workers", type=int, default=1)
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument("--shuffle-buffer-size", type=int, default=10000)
+    parser.add_argument("--snapshot-interval", type=int, default=100)
     parser.add_argument("--training-steps", type=int, default=1000000)
     parser.add_argument("--generation-steps", "-gsteps", type=int, default=32)
     parser.add_argument("--initial-lr", "-lr-i", type=float, default=0.0001)
@@ -234,5 +262,21 @@ if __name__ == "__main__":
     parser.add_argument("--use-gru", "-gru", action="store_true")
     parser.add_argument(
         "--no-backprop-diff-xr", "-no-xr-grad", action="store_true")
+    parser.add_argument("--fused-gates", action="store_true")
+    parser.add_argument("--fused-heads", action="store_true")
+    parser.add_argument("--checkpoint-segment-length", type=int, default=0)
+    parser.add_argument("--incremental-downsampling", action="store_true")
+    parser.add_argument("--hoist-inference-x", action="store_true")
+    parser.add_argument("--batched-prior", action="store_true")
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        choices=draw.nn.precision.dtypes,
+        default="float32")
+    parser.add_argument(
+        "--loss-accumulator",
+        type=str,
+        choices=loss_accumulators.keys(),
+        default="stacked")
     args = parser.parse_args()
     main()
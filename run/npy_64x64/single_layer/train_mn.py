@@ -1,19 +1,14 @@
 import argparse
 import math
 import os
-import random
 import sys
 import time
 import multiprocessing
 
 import chainer
 import chainermn
-import chainer.functions as cf
 import numpy as np
-import cupy as cp
-from chainer.backends import cuda
 from PIL import Image
-from collections import deque
 
 sys.path.append(".")
 sys.path.append(os.path.join("..", "..", ".."))
@@ -21,6 +16,7 @@ import draw
 from hyperparams import HyperParameters
 from models import GRUModel, LSTMModel
 from optimizer import AdamOptimizer, EveOptimizer
+from training_state import TrainingState
 
 
 def printr(string):
@@ -29,25 +25,19 @@ def printr(string):
     sys.stdout.flush()
 
 
-def to_gpu(array):
-    if cuda.get_array_module(array) is np:
-        return cuda.to_gpu(array)
-    return array
-
-
-def to_cpu(array):
-    if cuda.get_array_module(array) is cp:
-        return cuda.to_cpu(array)
-    return array
-
-
 def make_uint8(x):
-    x = to_cpu(x)
+    x = draw.backend.to_cpu(x)
     if x.shape[0] == 3:
         x = x.transpose(1, 2, 0)
     return np.uint8(np.clip(x * 255, 0, 255))
 
 
+loss_accumulators = {
+    "streaming": draw.nn.losses.LossAccumulator,
+    "stacked": draw.nn.losses.StackedLossAccumulator,
+}
+
+
 def main():
     try:
         os.mkdir(args.snapshot_directory)
@@ -56,30 +46,14 @@ def main():
 
     comm = chainermn.create_communicator()
     device = comm.intra_rank
-    cuda.get_device(device).use()
-    xp = cp
-
-    images = []
-    files = os.listdir(args.dataset_path)
-    files.sort()
-    subset_size = int(math.ceil(len(files) / comm.size))
-    files = deque(files)
-    files.rotate(-subset_size * comm.rank)
-    files = list(files)[:subset_size]
-    for filename in files:
-        image = np.load(os.path.join(args.dataset_path, filename))
-        image = image / 256
-        images.append(image)
-
-    print(comm.rank, files)
-
-    images = np.vstack(images)
-    images = images.transpose((0, 3, 1, 2)).astype(np.float32)
+    xp = draw.backend.get_xp(device)
+
+    images = draw.data.PackedDataset(args.dataset_path)
     train_dev_split = 0.9
-    num_images = images.shape[0]
+    num_images = len(images)
     num_train_images = int(num_images * train_dev_split)
     num_dev_images = num_images - num_train_images
-    images_train = images[:num_train_images]
+    images_train = images.subset(np.arange(num_train_images))
 
     # To avoid OpenMPI bug
     # multiprocessing.set_start_method("forkserver")
@@ -100,6 +74,13 @@ def main():
     hyperparams.batch_normalization_enabled = args.enable_batch_normalization
     hyperparams.use_gru = args.use_gru
     hyperparams.no_backprop_diff_xr = args.no_backprop_diff_xr
+    hyperparams.fused_gates = args.fused_gates
+    hyperparams.fused_heads = args.fused_heads
+    hyperparams.checkpoint_segment_length = args.checkpoint_segment_length
+    hyperparams.incremental_downsampling = args.incremental_downsampling
+    hyperparams.hoist_inference_x = args.hoist_inference_x
+    hyperparams.batched_prior = args.batched_prior
+    hyperparams.dtype = args.dtype
 
     if comm.rank == 0:
         hyperparams.save(args.snapshot_directory)
@@ -119,44 +100,53 @@ def main():
         lr_f=args.final_lr,
         beta_1=args.adam_beta1,
         communicator=comm)
+    if hyperparams.dtype != "float32":
+        optimizer.enable_mixed_precision()
     if comm.rank == 0:
         optimizer.print()
 
     num_pixels = images.shape[1] * images.shape[2] * images.shape[3]
 
-    dataset = draw.data.Dataset(images_train)
-    iterator = draw.data.Iterator(dataset, batch_size=args.batch_size)
-
-    num_updates = 0
-
-    for iteration in range(args.training_steps):
+    dataset = images_train
+    sampler = draw.data.DistributedSampler(
+        dataset, num_replicas=comm.size, rank=comm.rank, seed=args.seed)
+    iterator = draw.data.Iterator(
+        dataset,
+        batch_size=args.batch_size,
+        sort_indices=True,
+        sampler=sampler)
+    print(comm.rank, "{} samples / {} batches".format(
+        len(sampler), len(iterator)))
+    loader = draw.data.PrefetchIterator(
+        dataset,
+        iterator,
+        num_prefetch=args.prefetch,
+        num_workers=args.loader_workers,
+        # Inputs are scaled by 1/256 as train_mn.py always did, while train.py
+        # and PackedDataset use 1/255
+        transform=draw.data.Dequantize(scale=256),
+        converter=lambda x: draw.backend.to_gpu(x, device=device))
+
+    loss_accumulator_class = loss_accumulators[args.loss_accumulator]
+
+    state = TrainingState(snapshot_directory=args.snapshot_directory)
+    if state.iterator is not None:
+        loader.load_state_dict(state.iterator)
+    num_updates = state.num_updates
+    if num_updates > 0:
+        optimizer.anneal_learning_rate(num_updates - 1)
+
+    for iteration in range(iterator.epoch, args.training_steps):
         mean_kld = 0
         mean_nll = 0
         mean_mse = 0
         start_time = time.time()
 
-        for batch_index, data_indices in enumerate(iterator):
-            x = dataset[data_indices]
-            x += np.random.uniform(0, 1 / 256, size=x.shape)
-            x = to_gpu(x)
-
-            z_t_param_array, x_param, r_t_array = model.sample_z_and_x_params_from_posterior(
-                x)
-
-            loss_kld = 0
-            for params in z_t_param_array:
-                mean_z_q, ln_var_z_q, mean_z_p, ln_var_z_p = params
-                kld = draw.nn.functions.gaussian_kl_divergence(
-                    mean_z_q, ln_var_z_q, mean_z_p, ln_var_z_p)
-                loss_kld += cf.sum(kld)
-
-            loss_sse = 0
-            for r_t in r_t_array:
-                loss_sse += cf.sum(cf.squared_error(r_t, x))
-
-            mu_x, ln_var_x = x_param
-
-            loss_nll = cf.gaussian_nll(x, mu_x, ln_var_x)
+        for batch_index, (data_indices, x) in enumerate(
+                loader, start=iterator.offset):
+            accumulator = loss_accumulator_class()
+            mu_x, ln_var_x = model.accumulate_loss(x, accumulator)
+            loss_nll, loss_kld, loss_sse = accumulator.reduce()
 
             loss_nll /= args.batch_size
             loss_kld /= args.batch_size
@@ -184,18 +174,25 @@ def main():
 
             if comm.rank == 0 and batch_index > 0 and batch_index % 100 == 0:
                 model.serialize(args.snapshot_directory)
+                state.num_updates = num_updates
+                state.iterator = loader.state_dict()
+                state.save(args.snapshot_directory)
 
         if comm.rank == 0:
             model.serialize(args.snapshot_directory)
+            state.num_updates = num_updates
+            state.iterator = loader.state_dict()
+            state.save(args.snapshot_directory)
 
         if comm.rank == 0:
             elapsed_time = time.time() - start_time
             print(
-                "\r\033[2KIteration {} - loss: nll_per_pixel: {:.6f} - mse: {:.6f} - kld: {:.6f} - lr: {:.4e} - elapsed_time: {:.3f} min".
+                "\r\033[2KIteration {} - loss: nll_per_pixel: {:.6f} - mse: {:.6f} - kld: {:.6f} - lr: {:.4e} - elapsed_time: {:.3f} min - data_wait: {:.3f} min ({:.2f} ms/batch)".
                 format(iteration + 1,
                        mean_nll / len(iterator) / num_pixels + math.log(256.0),
                        mean_mse / len(iterator), mean_kld / len(iterator),
-                       optimizer.learning_rate, elapsed_time / 60))
+                       optimizer.learning_rate, elapsed_time / 60,
+                       loader.wait_time / 60, loader.mean_wait_time * 1000))
 
 
 if __name__ == "__main__":
@@ -204,6 +201,9 @@ if __name__ == "__main__":
     parser.add_argument(
         "--snapshot-directory", "-snapshot", type=str, default="snapshot")
     parser.add_argument("--batch-size", "-b", type=int, default=36)
+    parser.add_argument("--prefetch", type=int, default=2)
+    parser.add_argument("--loader-workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
     parser.add_argument("--training-steps", type=int, default=1000000)
     parser.add_argument("--generation-steps", "-gsteps", type=int, default=32)
     parser.add_argument("--initial-lr", "-lr-i", type=float, default=0.0001)
@@ -235,5 +235,21 @@ if __name__ == "__main__":
     parser.add_argument("--use-gru", "-gru", action="store_true")
     parser.add_argument(
         "--no-backprop-diff-xr", "-no-xr-grad", action="store_true")
+    parser.add_argument("--fused-gates", action="store_true")
+    parser.add_argument("--fused-heads", action="store_true")
+    parser.add_argument("--checkpoint-segment-length", type=int, default=0)
+    parser.add_argument("--incremental-downsampling", action="store_true")
+    parser.add_argument("--hoist-inference-x", action="store_true")
+    parser.add_argument("--batched-prior", action="store_true")
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        choices=draw.nn.precision.dtypes,
+        default="float32")
+    parser.add_argument(
+        "--loss-accumulator",
+        type=str,
+        choices=loss_accumulators.keys(),
+        default="stacked")
     args = parser.parse_args()
     main()
@@ -0,0 +1,32 @@
+import json
+import os
+import uuid
+
+
+# Saved next to model.hdf5 so that a preempted run resumes at the same
+# position of the same epoch with the same learning rate step
+class TrainingState():
+    def __init__(self, snapshot_directory=None):
+        self.num_updates = 0
+        self.iterator = None
+
+        if snapshot_directory is not None:
+            json_path = os.path.join(snapshot_directory, self.filename)
+            if os.path.exists(json_path) and os.path.isfile(json_path):
+                with open(json_path, "r") as f:
+                    print("loading", json_path)
+                    obj = json.load(f)
+                    for (key, value) in obj.items():
+                        setattr(self, key, value)
+
+    @property
+    def filename(self):
+        return "training_state.json"
+
+    def save(self, snapshot_directory):
+        tmp_filename = str(uuid.uuid4())
+        with open(os.path.join(snapshot_directory, tmp_filename), "w") as f:
+            json.dump(self.__dict__, f, indent=4, sort_keys=True)
+        os.rename(
+            os.path.join(snapshot_directory, tmp_filename),
+            os.path.join(snapshot_directory, self.filename))
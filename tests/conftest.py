@@ -0,0 +1,7 @@
+import os
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+# models and hyperparams of the 64x64 single layer model
+sys.path.insert(0, os.path.join(root, "run", "npy_64x64", "single_layer"))
@@ -0,0 +1,214 @@
+import numpy as np
+import pytest
+
+import draw
+from draw.codec import Bitstream, LatentQuantizer, rans
+
+
+def make_table(num_symbols=17, seed=0):
+    probabilities = np.random.RandomState(seed).uniform(0.01, 1, num_symbols)
+    return rans.FrequencyTable(probabilities)
+
+
+def random_symbols(table, shape, seed=0):
+    probabilities = table.freqs.astype(np.float64) / (1 << table.precision)
+    return np.random.RandomState(seed).choice(
+        len(table), size=shape, p=probabilities)
+
+
+@pytest.mark.parametrize("num_lanes", [1, 4, 64])
+@pytest.mark.parametrize("batch_size", [1, 3])
+@pytest.mark.parametrize("num_symbols", [1, 5, 63, 64, 65, 1000])
+def test_rans_round_trip(num_lanes, batch_size, num_symbols):
+    table = make_table()
+    symbols = random_symbols(table, (batch_size, num_symbols))
+    messages = rans.encode(symbols, table, num_lanes)
+    assert len(messages) == batch_size
+    decoded = rans.decode(messages, table, num_symbols, num_lanes)
+    np.testing.assert_array_equal(decoded, symbols)
+
+
+@pytest.mark.parametrize("num_lanes", [4, 64])
+def test_rans_empty_messages(num_lanes):
+    table = make_table()
+    symbols = np.zeros((3, 0), dtype=np.int64)
+    messages = rans.encode(symbols, table, num_lanes)
+    assert all(len(message) == 4 * num_lanes for message in messages)
+    decoded = rans.decode(messages, table, 0, num_lanes)
+    assert decoded.shape == (3, 0)
+
+
+def test_rans_extreme_symbols():
+    quantizer = LatentQuantizer(step=1.0, max_deviation=8.0)
+    table = quantizer.table
+    top = 2 * quantizer.max_index
+    assert len(table) == top + 1
+    symbols = np.array([[0, top] * 50, [top] * 77 + [0] * 23, [0] * 100])
+    messages = rans.encode(symbols, table, 8)
+    decoded = rans.decode(messages, table, 100, 8)
+    np.testing.assert_array_equal(decoded, symbols)
+
+
+# Messages of different lengths in one batch, as the latents of a batch of
+# images are
+def test_rans_batch_of_images():
+    quantizer = LatentQuantizer()
+    table = quantizer.table
+    symbols = np.stack([
+        random_symbols(table, (4 * 32 * 32, ), seed=seed) for seed in range(3)
+    ])
+    symbols[1] = quantizer.max_index
+    messages = rans.encode(symbols, table, 64)
+    assert len(set(len(message) for message in messages)) > 1
+    decoded = rans.decode(messages, table, symbols.shape[1], 64)
+    np.testing.assert_array_equal(decoded, symbols)
+    for message, row in zip(messages, symbols):
+        decoded = rans.decode([message], table, symbols.shape[1], 64)
+        np.testing.assert_array_equal(decoded[0], row)
+
+
+def test_rans_corrupted_message():
+    table = make_table()
+    symbols = random_symbols(table, (1, 100))
+    message, = rans.encode(symbols, table, 4)
+    with pytest.raises(ValueError):
+        rans.decode([message[:4 * 4 - 1]], table, 100, 4)
+    with pytest.raises(ValueError):
+        rans.decode([message[:-1]], table, 100, 4)
+
+
+def make_bitstream(num_steps=4, num_lanes=8):
+    chunks = [bytes(range(t, t + 10 + 3 * t)) for t in range(num_steps)]
+    return Bitstream(chunks, num_lanes, np.float32(0.3), 27)
+
+
+def test_bitstream_round_trip():
+    bitstream = make_bitstream()
+    data = bitstream.to_bytes()
+    assert len(data) == bitstream.size()
+    decoded = Bitstream.from_bytes(data)
+    assert decoded.chunks == bitstream.chunks
+    assert decoded.num_lanes == bitstream.num_lanes
+    assert decoded.step == bitstream.step
+    assert decoded.max_index == bitstream.max_index
+
+
+@pytest.mark.parametrize("num_steps", [0, 1, 3, 4])
+def test_bitstream_truncate(num_steps):
+    bitstream = make_bitstream()
+    truncated = bitstream.truncate(num_steps)
+    assert truncated.num_steps == num_steps
+    assert truncated.chunks == bitstream.chunks[:num_steps]
+    assert truncated.size() == bitstream.size(num_steps)
+    decoded = Bitstream.from_bytes(truncated.to_bytes())
+    assert decoded.chunks == bitstream.chunks[:num_steps]
+
+
+# Data cut off after any chunk or inside one decodes to the complete chunks
+def test_bitstream_cut_off():
+    bitstream = make_bitstream()
+    data = bitstream.to_bytes()
+    for t in range(bitstream.num_steps + 1):
+        end = bitstream.size(t)
+        assert Bitstream.from_bytes(data[:end]).chunks == bitstream.chunks[:t]
+        if t < bitstream.num_steps:
+            for cut in (end + 2, end + 4, end + 4 + len(bitstream.chunks[t]) -
+                        1):
+                assert Bitstream.from_bytes(
+                    data[:cut]).chunks == bitstream.chunks[:t]
+
+
+def test_bitstream_bad_magic():
+    data = bytearray(make_bitstream().to_bytes())
+    data[:4] = b"WARD"
+    with pytest.raises(ValueError):
+        Bitstream.from_bytes(bytes(data))
+
+
+def test_bitstream_short_header():
+    data = make_bitstream().to_bytes()
+    for length in (0, 3, draw.codec.bitstream.header.size - 1):
+        with pytest.raises(ValueError):
+            Bitstream.from_bytes(data[:length])
+
+
+def test_quantizer_round_trip():
+    quantizer = LatentQuantizer(step=0.5, max_deviation=4.0)
+    rng = np.random.RandomState(0)
+    mean_z_p = rng.normal(size=(2, 4, 8, 8)).astype(np.float32)
+    ln_var_z_p = rng.uniform(-2, 1, size=mean_z_p.shape).astype(np.float32)
+    std = np.exp(0.5 * ln_var_z_p)
+    offsets = rng.randint(-quantizer.max_index, quantizer.max_index + 1,
+                          mean_z_p.shape)
+    mean_z_q = mean_z_p + offsets * quantizer.step * std
+    symbols = quantizer.quantize(mean_z_q, mean_z_p, ln_var_z_p)
+    np.testing.assert_array_equal(symbols, offsets + quantizer.max_index)
+    z = quantizer.dequantize(symbols, mean_z_p, ln_var_z_p)
+    assert z.dtype == np.float32
+    np.testing.assert_allclose(z, mean_z_q, rtol=1e-5, atol=1e-5)
+
+    # The nearest point of the grid, within half a step
+    mean_z_q = mean_z_p + rng.uniform(-3.9, 3.9, mean_z_p.shape) * std
+    z = quantizer.dequantize(
+        quantizer.quantize(mean_z_q, mean_z_p, ln_var_z_p), mean_z_p,
+        ln_var_z_p)
+    assert np.all(np.abs(z - mean_z_q) <= 0.5 * quantizer.step * std + 1e-5)
+
+
+def test_quantizer_clipping():
+    quantizer = LatentQuantizer(step=1.0, max_deviation=3.0)
+    assert quantizer.max_index == 3
+    mean_z_p = np.zeros((1, 4), dtype=np.float32)
+    ln_var_z_p = np.zeros((1, 4), dtype=np.float32)
+    mean_z_q = np.array([[-100, -3.4, 3.4, 100]], dtype=np.float32)
+    symbols = quantizer.quantize(mean_z_q, mean_z_p, ln_var_z_p)
+    np.testing.assert_array_equal(symbols, [[0, 0, 6, 6]])
+    z = quantizer.dequantize(symbols, mean_z_p, ln_var_z_p)
+    np.testing.assert_array_equal(z, [[-3, -3, 3, 3]])
+
+
+# The decoder rebuilds the quantizer from the step stored in the bitstream
+# (float32) and the max index, which must give the same table
+@pytest.mark.parametrize("step", [0.3, 0.7, 1.1, 1 / 3])
+def test_quantizer_from_float32_step(step):
+    quantizer = LatentQuantizer(step=step, max_deviation=8.0)
+    data = Bitstream([], 4, quantizer.step, quantizer.max_index).to_bytes()
+    bitstream = Bitstream.from_bytes(data)
+    rebuilt = LatentQuantizer(bitstream.step, max_index=bitstream.max_index)
+    assert rebuilt.step == quantizer.step
+    assert rebuilt.max_index == quantizer.max_index
+    np.testing.assert_array_equal(rebuilt.table.freqs, quantizer.table.freqs)
+    np.testing.assert_array_equal(rebuilt.table.starts,
+                                  quantizer.table.starts)
+
+
+def test_latent_codec_round_trip():
+    chainer = pytest.importorskip("chainer")
+    from hyperparams import HyperParameters
+    from models import LSTMModel
+    from models.codec import LatentCodec
+
+    hyperparams = HyperParameters()
+    hyperparams.chz_channels = 4
+    hyperparams.generator_generation_steps = 3
+    np.random.seed(0)
+    model = LSTMModel(hyperparams)
+    x = np.random.uniform(0, 1, (2, 3, 64, 64)).astype(np.float32)
+    with chainer.no_backprop_mode():
+        model.sample_z_and_x_params_from_posterior(x)
+
+    codec = LatentCodec(model, LatentQuantizer(step=0.5), num_lanes=16)
+    bitstreams, r_t_array, kld = codec.encode(x)
+    assert len(bitstreams) == 2
+    assert len(r_t_array) == 3
+    assert kld.shape == (3, 2)
+    assert np.all(np.isfinite(kld))
+    bitstreams = [
+        Bitstream.from_bytes(bitstream.to_bytes()) for bitstream in bitstreams
+    ]
+    for num_steps in range(1, 4):
+        decoded = codec.decode(
+            [bitstream.truncate(num_steps) for bitstream in bitstreams])
+        assert len(decoded) == num_steps
+        for expected, actual in zip(r_t_array, decoded):
+            np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-5)
@@ -0,0 +1,116 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("PIL")
+from PIL import Image
+
+from draw.data import PackedDataset, ingest_image_directory
+
+
+def write_image(directory, name, seed):
+    array = np.random.RandomState(seed).randint(
+        0, 256, size=(8, 8, 3)).astype(np.uint8)
+    Image.fromarray(array).save(os.path.join(directory, name))
+    return array.transpose((2, 0, 1))
+
+
+def ingest(image_directory, output_directory, capsys):
+    dataset = ingest_image_directory(
+        image_directory, output_directory, image_size=(8, 8), num_workers=1)
+    return dataset, capsys.readouterr().out
+
+
+def images_by_name(dataset):
+    return {
+        file["name"]: dataset.take([file["offset"]])[0]
+        for file in dataset.files
+    }
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    image_directory = str(tmp_path / "images")
+    os.makedirs(image_directory)
+    arrays = {
+        "{}.png".format(i): write_image(image_directory, "{}.png".format(i),
+                                        i)
+        for i in range(4)
+    }
+    return image_directory, str(tmp_path / "packed"), arrays
+
+
+def assert_store(dataset, arrays):
+    actual = images_by_name(dataset)
+    assert sorted(actual) == sorted(arrays)
+    for name, array in arrays.items():
+        np.testing.assert_array_equal(actual[name], array)
+
+
+def test_unchanged_directory_is_not_read(corpus, capsys):
+    image_directory, output_directory, arrays = corpus
+    dataset, out = ingest(image_directory, output_directory, capsys)
+    assert "4 hashed, 4 decoded" in out
+    assert_store(dataset, arrays)
+    images_path = dataset.images_path
+
+    dataset, out = ingest(image_directory, output_directory, capsys)
+    assert "0 hashed, 0 decoded, 0 copied, appended" in out
+    assert dataset.images_path == images_path
+    assert_store(dataset, arrays)
+
+
+def test_new_files_are_appended(corpus, capsys):
+    image_directory, output_directory, arrays = corpus
+    dataset, _ = ingest(image_directory, output_directory, capsys)
+    images_path = dataset.images_path
+    arrays["new.png"] = write_image(image_directory, "new.png", 10)
+    # Same content as an existing file
+    arrays["copy.png"] = write_image(image_directory, "copy.png", 0)
+
+    dataset, out = ingest(image_directory, output_directory, capsys)
+    assert "2 hashed, 1 decoded, 1 copied, appended" in out
+    assert dataset.images_path == images_path
+    assert [file["name"] for file in dataset.files
+            ][:4] == ["0.png", "1.png", "2.png", "3.png"]
+    assert_store(dataset, arrays)
+
+
+def test_touched_file_is_hashed_but_not_decoded(corpus, capsys):
+    image_directory, output_directory, arrays = corpus
+    ingest(image_directory, output_directory, capsys)
+    path = os.path.join(image_directory, "1.png")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    dataset, out = ingest(image_directory, output_directory, capsys)
+    assert "1 hashed, 0 decoded, 0 copied, appended" in out
+    assert_store(dataset, arrays)
+    _, out = ingest(image_directory, output_directory, capsys)
+    assert "0 hashed" in out
+
+
+def test_removed_and_modified_files_rewrite_the_store(corpus, capsys):
+    image_directory, output_directory, arrays = corpus
+    dataset, _ = ingest(image_directory, output_directory, capsys)
+    images_path = dataset.images_path
+    os.remove(os.path.join(image_directory, "0.png"))
+    del arrays["0.png"]
+    arrays["2.png"] = write_image(image_directory, "2.png", 20)
+
+    dataset, out = ingest(image_directory, output_directory, capsys)
+    assert "1 hashed, 1 decoded, 2 copied, rewritten" in out
+    assert dataset.images_path != images_path
+    assert not os.path.exists(os.path.join(output_directory, images_path))
+    assert_store(dataset, arrays)
+
+
+def test_settings_change_decodes_everything(corpus, capsys):
+    image_directory, output_directory, _ = corpus
+    ingest(image_directory, output_directory, capsys)
+    ingest_image_directory(
+        image_directory, output_directory, image_size=(4, 4), num_workers=1)
+    out = capsys.readouterr().out
+    assert "4 hashed, 4 decoded, 0 copied, rewritten" in out
+    assert PackedDataset(output_directory).shape == (4, 3, 4, 4)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+chainer = pytest.importorskip("chainer")
+
+from draw.nn import functions, losses
+
+
+def random_params(seed=0, scale=2):
+    rs = np.random.RandomState(seed)
+    return [(rs.randn(2, 3, 4, 4) * scale).astype(np.float32)
+            for _ in range(4)]
+
+
+def test_elementwise_kl_divergence_matches_reference():
+    params = random_params()
+    expected = functions.gaussian_kl_divergence(*params).array
+    actual = functions.gaussian_kl_divergence_elementwise(*params).array
+    np.testing.assert_allclose(actual.sum(axis=(1, 2, 3)), expected,
+                               rtol=1e-5)
+
+
+def test_elementwise_kl_divergence_large_log_variances():
+    mu_q, _, mu_p, _ = random_params()
+    ln_var = np.full(mu_q.shape, 100, dtype=np.float32)
+    kld = functions.gaussian_kl_divergence_elementwise(
+        mu_q, ln_var, mu_p, ln_var).array
+    assert np.all(np.isfinite(kld))
+    np.testing.assert_allclose(kld, 0, atol=1e-6)
+
+
+def test_streaming_and_stacked_accumulators_agree():
+    streaming = losses.LossAccumulator()
+    stacked = losses.StackedLossAccumulator()
+    x = np.random.RandomState(1).uniform(size=(2, 3, 4, 4)).astype(np.float32)
+    for t in range(3):
+        params = random_params(seed=t)
+        r_t = params[0]
+        for accumulator in (streaming, stacked):
+            accumulator.add_kl_divergence(t, *params)
+            accumulator.add_squared_error(t, r_t, x)
+    _, kld_streaming, sse_streaming = streaming.reduce()
+    _, kld_stacked, sse_stacked = stacked.reduce()
+    np.testing.assert_allclose(kld_streaming.array, kld_stacked.array,
+                               rtol=1e-5)
+    np.testing.assert_allclose(sse_streaming.array, sse_stacked.array,
+                               rtol=1e-5)
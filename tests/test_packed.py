@@ -0,0 +1,133 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from draw.data import PackedDataset, PackedDatasetWriter
+
+
+def random_images(num_images, seed=0):
+    return np.random.RandomState(seed).randint(
+        0, 256, size=(num_images, 4, 4, 3)).astype(np.uint8)
+
+
+def write_store(directory, images, name="a.npy"):
+    with PackedDatasetWriter(directory) as writer:
+        writer.append(images, name=name)
+    return PackedDataset(directory)
+
+
+def test_round_trip(tmp_path):
+    images = random_images(10)
+    dataset = write_store(str(tmp_path), images)
+    assert dataset.shape == (10, 3, 4, 4)
+    np.testing.assert_array_equal(dataset.take(np.arange(10)),
+                                  images.transpose((0, 3, 1, 2)))
+    np.testing.assert_allclose(dataset[np.arange(10)],
+                               images.transpose((0, 3, 1, 2)) / 255)
+    assert dataset.files == [{"name": "a.npy", "offset": 0, "count": 10}]
+
+
+def test_empty_store(tmp_path):
+    with PackedDatasetWriter(str(tmp_path)):
+        pass
+    dataset = PackedDataset(str(tmp_path))
+    assert len(dataset) == 0
+
+
+def test_rewrite_replaces_store(tmp_path):
+    directory = str(tmp_path)
+    write_store(directory, random_images(10))
+    images = random_images(3, seed=1)
+    dataset = write_store(directory, images)
+    np.testing.assert_array_equal(dataset.take(np.arange(3)),
+                                  images.transpose((0, 3, 1, 2)))
+    # The previous images file is removed once the new index is published
+    assert sorted(os.listdir(directory)) == sorted(
+        [PackedDataset.index_filename, dataset.images_path])
+
+
+@pytest.mark.parametrize("error", [KeyboardInterrupt, ValueError])
+def test_interrupted_write_keeps_previous_store(tmp_path, error):
+    directory = str(tmp_path)
+    images = random_images(10)
+    write_store(directory, images)
+    files = sorted(os.listdir(directory))
+
+    with pytest.raises(error):
+        with PackedDatasetWriter(directory) as writer:
+            writer.append(random_images(3, seed=1), name="b.npy")
+            raise error()
+
+    assert sorted(os.listdir(directory)) == files
+    dataset = PackedDataset(directory)
+    assert len(dataset) == 10
+    np.testing.assert_array_equal(dataset.take(np.arange(10)),
+                                  images.transpose((0, 3, 1, 2)))
+
+
+def test_shape_mismatch_keeps_previous_store(tmp_path):
+    directory = str(tmp_path)
+    write_store(directory, random_images(10))
+    with pytest.raises(ValueError):
+        with PackedDatasetWriter(directory) as writer:
+            writer.append(random_images(3))
+            writer.append(np.zeros((1, 8, 8, 3), dtype=np.uint8))
+    assert len(PackedDataset(directory)) == 10
+
+
+def test_reads_legacy_store(tmp_path):
+    directory = str(tmp_path)
+    images = random_images(5)
+    images.transpose((0, 3, 1, 2)).tofile(
+        os.path.join(directory, PackedDataset.images_filename))
+    with open(os.path.join(directory, PackedDataset.index_filename), "w") as f:
+        json.dump({
+            "shape": [5, 3, 4, 4],
+            "files": [{
+                "name": "a.npy",
+                "offset": 0,
+                "count": 5
+            }],
+            "metadata": None
+        }, f)
+    dataset = PackedDataset(directory)
+    np.testing.assert_array_equal(dataset.take(np.arange(5)),
+                                  images.transpose((0, 3, 1, 2)))
+    # Rewriting a legacy store replaces images.bin as well
+    write_store(directory, random_images(2))
+    assert PackedDataset.images_filename not in os.listdir(directory)
+
+
+def test_append(tmp_path):
+    directory = str(tmp_path)
+    images = random_images(10)
+    dataset = write_store(directory, images)
+    images_path = dataset.images_path
+    more_images = random_images(3, seed=1)
+    with PackedDatasetWriter(directory, append=True) as writer:
+        writer.append(more_images, name="b.npy")
+    dataset = PackedDataset(directory)
+    assert dataset.images_path == images_path
+    assert [file["name"] for file in dataset.files] == ["a.npy", "b.npy"]
+    np.testing.assert_array_equal(
+        dataset.take(np.arange(13)),
+        np.concatenate((images, more_images)).transpose((0, 3, 1, 2)))
+
+
+def test_interrupted_append_keeps_previous_store(tmp_path):
+    directory = str(tmp_path)
+    images = random_images(10)
+    dataset = write_store(directory, images)
+    size = os.path.getsize(os.path.join(directory, dataset.images_path))
+    with pytest.raises(KeyboardInterrupt):
+        with PackedDatasetWriter(directory, append=True) as writer:
+            writer.append(random_images(3, seed=1), name="b.npy")
+            raise KeyboardInterrupt()
+    dataset = PackedDataset(directory)
+    assert len(dataset) == 10
+    assert os.path.getsize(os.path.join(directory,
+                                        dataset.images_path)) == size
+    np.testing.assert_array_equal(dataset.take(np.arange(10)),
+                                  images.transpose((0, 3, 1, 2)))
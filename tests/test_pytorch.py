@@ -0,0 +1,271 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+chainer = pytest.importorskip("chainer")
+pytest.importorskip("h5py")
+
+import chainer.functions as cf  # noqa: E402
+
+import draw  # noqa: E402
+import draw.nn.pytorch  # noqa: E402
+from draw.nn.pytorch import serializers  # noqa: E402
+from hyperparams import HyperParameters  # noqa: E402
+from models import LSTMModel  # noqa: E402
+from models.pytorch import PyTorchModel  # noqa: E402
+
+configurations = {
+    "unfused": {},
+    "fused": {
+        "fused_gates": True,
+        "fused_heads": True
+    },
+    "fused_gates": {
+        "fused_gates": True
+    },
+    "unshared": {
+        "generator_share_core": False,
+        "inference_share_core": False,
+        "generator_share_prior": False,
+        "inference_share_posterior": False,
+    },
+    "shared": {
+        "generator_share_prior": True,
+        "inference_share_posterior": True,
+        "generator_share_upsampler": True,
+    },
+    "batchnorm": {
+        "batch_normalization_enabled": True
+    },
+    "batchnorm_fused": {
+        "batch_normalization_enabled": True,
+        "fused_gates": True,
+        "fused_heads": True,
+    },
+}
+
+
+def make_hyperparams(**values):
+    hyperparams = HyperParameters()
+    hyperparams.chz_channels = 4
+    hyperparams.generator_generation_steps = 3
+    for key, value in values.items():
+        setattr(hyperparams, key, value)
+    return hyperparams
+
+
+# The same standard normal noise for the n-th sample of both models
+class FixedNoise():
+    def __init__(self):
+        self.num_samples = 0
+
+    def __call__(self, shape):
+        random = np.random.RandomState(self.num_samples)
+        self.num_samples += 1
+        return random.standard_normal(tuple(shape)).astype(np.float32)
+
+
+@pytest.fixture
+def fixed_noise(monkeypatch):
+    chainer_noise = FixedNoise()
+    torch_noise = FixedNoise()
+    monkeypatch.setattr(
+        chainer.functions, "gaussian", lambda mean, ln_var: mean + cf.exp(
+            0.5 * ln_var) * chainer_noise(mean.shape))
+    monkeypatch.setattr(
+        draw.nn.pytorch.functions, "gaussian",
+        lambda mean, ln_var: mean + torch.exp(0.5 * ln_var) * torch.
+        from_numpy(torch_noise(mean.shape)))
+
+
+def as_numpy(x):
+    if isinstance(x, torch.Tensor):
+        return x.detach().numpy()
+    return np.asarray(chainer.as_array(x))
+
+
+def assert_close(actual, expected):
+    np.testing.assert_allclose(
+        as_numpy(actual), as_numpy(expected), rtol=1e-4, atol=1e-5)
+
+
+# A Chainer model whose parameters have all been initialized (and whose
+# batch normalization statistics have been updated) and the PyTorchModel
+# loaded from its model.hdf5
+@pytest.fixture(params=sorted(configurations))
+def models(request, tmpdir):
+    hyperparams = make_hyperparams(**configurations[request.param])
+    np.random.seed(0)
+    model = LSTMModel(hyperparams)
+    x = np.random.uniform(0, 1, (2, 3, 64, 64)).astype(np.float32)
+    for _ in range(2):
+        model.sample_z_and_x_params_from_posterior(x)
+    model.serialize(str(tmpdir))
+
+    torch_model = PyTorchModel(hyperparams)
+    torch_model.load(os.path.join(str(tmpdir), "model.hdf5"))
+    torch_model.eval()
+    return model, torch_model, x
+
+
+def test_posterior_parity(models):
+    model, torch_model, x = models
+    with chainer.no_backprop_mode(), chainer.using_config("train", False):
+        r_t_array, (mu_x, ln_var_x) = model.sample_image_at_each_step_from_posterior(
+            x, zero_variance=True)
+    with torch.no_grad():
+        torch_r_t_array, (torch_mu_x, torch_ln_var_x
+                          ) = torch_model.sample_image_at_each_step_from_posterior(
+                              x, zero_variance=True)
+    assert len(torch_r_t_array) == len(r_t_array)
+    for actual, expected in zip(torch_r_t_array, r_t_array):
+        assert_close(actual, expected)
+    assert_close(torch_mu_x, mu_x)
+    assert_close(torch_ln_var_x, ln_var_x)
+
+
+def test_z_and_x_params_parity(models, fixed_noise):
+    model, torch_model, x = models
+    with chainer.no_backprop_mode(), chainer.using_config("train", False):
+        z_t_params_array, (mu_x, ln_var_x
+                           ), r_t_array = model.sample_z_and_x_params_from_posterior(x)
+    with torch.no_grad():
+        torch_z_t_params_array, (torch_mu_x, torch_ln_var_x
+                                 ), torch_r_t_array = torch_model.sample_z_and_x_params_from_posterior(
+                                     x)
+    assert len(torch_z_t_params_array) == len(z_t_params_array)
+    for actual, expected in zip(torch_z_t_params_array, z_t_params_array):
+        for actual_param, expected_param in zip(actual, expected):
+            assert_close(actual_param, expected_param)
+    for actual, expected in zip(torch_r_t_array, r_t_array):
+        assert_close(actual, expected)
+    assert_close(torch_mu_x, mu_x)
+    assert_close(torch_ln_var_x, ln_var_x)
+
+
+def test_prior_parity(models, fixed_noise):
+    model, torch_model, _ = models
+    with chainer.no_backprop_mode(), chainer.using_config("train", False):
+        r_t_array, (mu_x, ln_var_x) = model.sample_image_at_each_step_from_prior(
+            2, np)
+    with torch.no_grad():
+        torch_r_t_array, (torch_mu_x, torch_ln_var_x
+                          ) = torch_model.sample_image_at_each_step_from_prior(2)
+    for actual, expected in zip(torch_r_t_array, r_t_array):
+        assert_close(actual, expected)
+    assert_close(torch_mu_x, mu_x)
+    assert_close(torch_ln_var_x, ln_var_x)
+
+
+# There is no Chainer model with GRU cores in the layout of PyTorchModel
+# (GRUModel upsamples to 32x32), so the GRU cores are compared directly
+@pytest.mark.parametrize("fused", [False, True])
+@pytest.mark.parametrize("batchnorm_enabled", [False, True])
+def test_gru_core_parity(tmpdir, fused, batchnorm_enabled):
+    C = 4
+    np.random.seed(0)
+    cores = chainer.ChainList(
+        draw.nn.single_layer.generator.GRUCore(
+            C, batchnorm_enabled, 2, fused=fused),
+        draw.nn.single_layer.inference.GRUCore(
+            C, batchnorm_enabled, 2, fused=fused))
+    h_gen, z, h_enc = [
+        np.random.normal(size=(2, C, 32, 32)).astype(np.float32)
+        for _ in range(3)
+    ]
+    downsampled_r, downsampled_x, downsampled_diff_xr = [
+        np.random.normal(size=(2, 12, 32, 32)).astype(np.float32)
+        for _ in range(3)
+    ]
+    for step in range(2):
+        cores[0].forward_onestep(h_gen, z, downsampled_r, step)
+        cores[1].forward_onestep(h_gen, h_enc, downsampled_x,
+                                 downsampled_diff_xr, step)
+    filepath = os.path.join(str(tmpdir), "cores.hdf5")
+    chainer.serializers.save_hdf5(filepath, cores)
+
+    torch_cores = torch.nn.ModuleList([
+        draw.nn.pytorch.single_layer.generator.GRUCore(
+            C, batchnorm_enabled, 2),
+        draw.nn.pytorch.single_layer.inference.GRUCore(
+            C, batchnorm_enabled, 2)
+    ])
+    serializers.load_hdf5(filepath, torch_cores)
+    torch_cores.eval()
+    with chainer.no_backprop_mode(), chainer.using_config("train", False), \
+            torch.no_grad():
+        for step in range(2):
+            assert_close(
+                torch_cores[0](*[
+                    torch.from_numpy(array)
+                    for array in (h_gen, z, downsampled_r)
+                ], step), cores[0].forward_onestep(h_gen, z, downsampled_r,
+                                                   step))
+            assert_close(
+                torch_cores[1](*[
+                    torch.from_numpy(array)
+                    for array in (h_gen, h_enc, downsampled_x,
+                                  downsampled_diff_xr)
+                ], step),
+                cores[1].forward_onestep(h_gen, h_enc, downsampled_x,
+                                         downsampled_diff_xr, step))
+
+
+def test_gru_model_snapshot(tmpdir):
+    hyperparams = make_hyperparams(use_gru=True)
+    torch.manual_seed(0)
+    torch_model = PyTorchModel(hyperparams)
+    x = np.random.RandomState(0).uniform(0, 1,
+                                         (2, 3, 64, 64)).astype(np.float32)
+    torch_model.eval()
+    with torch.no_grad():
+        torch_model.sample_z_and_x_params_from_posterior(x)
+        r_t_array, (mu_x, _) = torch_model.sample_image_at_each_step_from_posterior(
+            x, zero_variance=True)
+    assert mu_x.shape == (2, 3, 64, 64)
+    torch_model.serialize(str(tmpdir))
+
+    loaded = PyTorchModel(hyperparams)
+    loaded.load(os.path.join(str(tmpdir), "model.pt"))
+    loaded.eval()
+    with torch.no_grad():
+        loaded_r_t_array, (loaded_mu_x,
+                           _) = loaded.sample_image_at_each_step_from_posterior(
+                               x, zero_variance=True)
+    for actual, expected in zip(loaded_r_t_array, r_t_array):
+        assert_close(actual, expected)
+    assert_close(loaded_mu_x, mu_x)
+
+
+# PyTorchModel has to import and load its own snapshots without Chainer and
+# h5py, which are blocked in a fresh interpreter
+def test_torch_only_environment(tmpdir):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = """
+import sys
+sys.modules["chainer"] = None
+sys.modules["h5py"] = None
+sys.modules["cupy"] = None
+sys.path.insert(0, {root!r})
+import torch
+from hyperparams import HyperParameters
+from models.pytorch import PyTorchModel
+hyperparams = HyperParameters()
+hyperparams.chz_channels = 4
+hyperparams.generator_generation_steps = 2
+model = PyTorchModel(hyperparams)
+with torch.no_grad():
+    model.sample_image_at_each_step_from_prior(1)
+model.serialize({path!r})
+loaded = PyTorchModel(hyperparams, snapshot_directory={path!r})
+with torch.no_grad():
+    loaded.sample_image_at_each_step_from_prior(1)
+""".format(root=root, path=str(tmpdir))
+    subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=os.path.join(root, "run", "npy_64x64", "single_layer"),
+        check=True)
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from draw.data import Dequantize
+
+
+@pytest.mark.parametrize("scale", [255, 256])
+def test_dequantize_without_noise(scale):
+    x = np.arange(256, dtype=np.uint8).reshape((4, 1, 8, 8))
+    out = Dequantize(noise=False, scale=scale)(x)
+    assert out.dtype == np.float32
+    np.testing.assert_allclose(out, x / scale, rtol=1e-6)
+
+
+@pytest.mark.parametrize("scale", [255, 256])
+def test_dequantize_noise_width(scale):
+    x = np.repeat(np.arange(256, dtype=np.uint8), 64).reshape((64, 1, 16, 16))
+    out = Dequantize(seed=0, scale=scale)(x)
+    noise = out - x / scale
+    assert noise.min() >= -1e-6
+    assert noise.max() < 1 / 256 + 1e-6
+    assert noise.max() > 0.9 / 256
+
+
+def test_dequantize_reuses_output():
+    x = np.zeros((2, 3, 4, 4), dtype=np.uint8)
+    transform = Dequantize(seed=0)
+    out = np.empty(x.shape, dtype=np.float32)
+    assert transform(x, out=out) is out